@@ -0,0 +1,85 @@
+#!/usr/bin/python
+"""
+Build a ``gitosis.matrix.AccessMatrix`` for a synthetic config of
+USERS users and REPOS repositories, and time row queries (the
+repositories of a user) and column queries (the principals of a
+repository) against it.
+
+Users are spread over groups of 100, every group is granted a few
+hundred repositories, and every tenth group is nested in another.
+
+Usage: python bench/access_matrix.py [USERS [REPOS]]
+"""
+
+import os
+import random
+import sys
+import time
+from ConfigParser import RawConfigParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gitosis import matrix
+
+GROUP_SIZE = 100
+LOOKUPS = 1000
+
+def make_config(users, repos, rand):
+    cfg = RawConfigParser()
+    groups = users // GROUP_SIZE
+    per_group = max(1, repos * 3 // groups)
+    for g in xrange(groups):
+        section = 'group g%d' % g
+        cfg.add_section(section)
+        members = ['u%d' % u
+                   for u in xrange(g * GROUP_SIZE, (g + 1) * GROUP_SIZE)]
+        if g % 10 == 0 and g + 1 < groups:
+            members.append('@g%d' % (g + 1))
+        cfg.set(section, 'members', ' '.join(members))
+        start = rand.randrange(repos)
+        granted = ['r%d' % ((start + i) % repos) for i in xrange(per_group)]
+        half = len(granted) // 2
+        cfg.set(section, 'writable', ' '.join(granted[:half]))
+        cfg.set(section, 'readonly', ' '.join(granted[half:]))
+    return cfg
+
+def timed(fn, args):
+    start = time.time()
+    for arg in args:
+        fn(arg)
+    return (time.time() - start) / len(args)
+
+def main(args):
+    users = 50000
+    repos = 50000
+    if args:
+        users = int(args[0])
+    if args[1:]:
+        repos = int(args[1])
+    rand = random.Random(42)
+
+    start = time.time()
+    cfg = make_config(users, repos, rand)
+    print 'config:      %8.1fms' % ((time.time() - start) * 1000)
+
+    start = time.time()
+    m = matrix.AccessMatrix(cfg)
+    print 'build:       %8.1fms' % ((time.time() - start) * 1000)
+
+    user_names = ['u%d' % rand.randrange(users) for _ in xrange(LOOKUPS)]
+    repo_names = ['r%d' % rand.randrange(repos) for _ in xrange(LOOKUPS)]
+
+    # warm the membership index up, it is built once per config
+    m.userRow(user_names[0], 'readonly')
+
+    row = timed(lambda u: m.userRow(u, 'readonly'), user_names)
+    print 'row bitset:  %8.3fms' % (row * 1000)
+    column = timed(m.repoColumn, repo_names)
+    print 'column bitset: %6.3fms' % (column * 1000)
+    names = timed(m.listRepositories, user_names)
+    print 'row names:   %8.3fms' % (names * 1000)
+    access = timed(m.getAllAccess, repo_names)
+    print 'column names: %7.3fms' % (access * 1000)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+"""
+Measure ``gitosis-access-query`` throughput: QUERIES queries for
+USERS users and REPOS repositories, most of them asked more than
+once, as CI systems do.
+
+Usage: python bench/access_query.py [QUERIES [USERS [REPOS]]]
+"""
+
+import os
+import random
+import sys
+import time
+from ConfigParser import RawConfigParser
+from cStringIO import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gitosis import query
+
+def make_config(users, repos, rand):
+    cfg = RawConfigParser()
+    groups = max(1, users // 50)
+    for g in xrange(groups):
+        section = 'group g%d' % g
+        cfg.add_section(section)
+        cfg.set(section, 'members', ' '.join(
+            ['u%d' % u for u in xrange(g * 50, (g + 1) * 50)]))
+        cfg.set(section, 'writable', ' '.join(
+            ['r%d' % rand.randrange(repos) for _ in xrange(20)]))
+        cfg.set(section, 'readonly', 'team%d/*' % g)
+    return cfg
+
+def main(args):
+    queries = 500000
+    users = 5000
+    repos = 5000
+    if args:
+        queries = int(args[0])
+    if args[1:]:
+        users = int(args[1])
+    if args[2:]:
+        repos = int(args[2])
+    rand = random.Random(42)
+    cfg = make_config(users, repos, rand)
+
+    # a working set of distinct questions, asked over and over
+    distinct = []
+    for _ in xrange(min(queries, 20000)):
+        distinct.append('u%d %s r%d' % (
+            rand.randrange(users),
+            rand.choice(['readonly', 'writable']),
+            rand.randrange(repos)))
+    lines = [rand.choice(distinct) for _ in xrange(queries)]
+    data = '\n'.join(lines) + '\n'
+
+    (rfd, wfd) = os.pipe()
+    if os.fork() == 0:
+        os.close(rfd)
+        f = os.fdopen(wfd, 'w')
+        f.write(data)
+        f.close()
+        os._exit(0)
+    os.close(wfd)
+
+    out = StringIO()
+    start = time.time()
+    query.answer_all(cfg, rfd, out)
+    elapsed = time.time() - start
+    os.close(rfd)
+    os.wait()
+
+    assert len(out.getvalue().splitlines()) == queries
+    print '%d queries (%d distinct) in %.2fs: %.0f queries/s' % (
+        queries, len(set(lines)), elapsed, queries / elapsed)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
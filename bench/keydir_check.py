@@ -0,0 +1,45 @@
+#!/usr/bin/python
+"""
+Measure validating KEYS SSH public keys, one file per user, serially
+and with the process pool.
+
+Usage: python bench/keydir_check.py [KEYS]
+"""
+
+import base64
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gitosis import keycheck
+
+def _string(s):
+    return struct.pack('>I', len(s)) + s
+
+def make_key(i):
+    modulus = '\0' + os.urandom(256)
+    blob = _string('ssh-rsa') + _string('\x01\x00\x01') + _string(modulus)
+    return 'ssh-rsa %s user%d@example.com\n' % (base64.b64encode(blob), i)
+
+def main():
+    keys = 50000
+    if len(sys.argv) > 1:
+        keys = int(sys.argv[1])
+    contents = [make_key(i) for i in xrange(keys)]
+
+    start = time.time()
+    serial = map(keycheck.checkKeyFile, contents)
+    elapsed = time.time() - start
+    print '%d keys serially: %.0fms' % (keys, elapsed * 1000)
+
+    start = time.time()
+    parallel = keycheck.checkKeyFiles(contents)
+    elapsed = time.time() - start
+    print '%d keys in the pool: %.0fms' % (keys, elapsed * 1000)
+    assert serial == parallel
+
+if __name__ == '__main__':
+    main()
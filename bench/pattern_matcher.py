@@ -0,0 +1,86 @@
+#!/usr/bin/python
+"""
+Compare ``gitosis.matcher.PatternMatcher`` against the plain
+``fnmatch`` loop it replaced in ``access.haveAccess``, for repository
+lists of 10 up to 100k patterns.
+
+Every lookup is also checked to give the same answer both ways.
+
+Usage: python bench/pattern_matcher.py [LOOKUPS]
+"""
+
+import os
+import random
+import sys
+import time
+from fnmatch import fnmatch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gitosis import matcher
+
+SIZES = [10, 100, 1000, 10000, 100000]
+
+def make_patterns(n, rand):
+    patterns = []
+    for i in xrange(n):
+        kind = rand.random()
+        if kind < 0.6:
+            patterns.append('proj%d/repo%d' % (i % 97, i))
+        elif kind < 0.9:
+            patterns.append('team%d/*' % i)
+        else:
+            patterns.append('build%d-?-*.tmp' % i)
+    return patterns
+
+def make_names(n, lookups, rand):
+    names = []
+    for _ in xrange(lookups):
+        i = rand.randrange(n * 2)
+        kind = rand.random()
+        if kind < 0.4:
+            names.append('proj%d/repo%d' % (i % 97, i))
+        elif kind < 0.8:
+            names.append('team%d/x/y' % i)
+        else:
+            names.append('build%d-a-b.tmp' % i)
+    return names
+
+def fnmatch_loop(name, patterns):
+    for pattern in patterns:
+        if fnmatch(name, pattern):
+            return True
+    return False
+
+def main(args):
+    lookups = 200
+    if args:
+        lookups = int(args[0])
+    rand = random.Random(42)
+    print '%8s %12s %14s %14s %9s' % (
+        'patterns', 'compile', 'fnmatch/call', 'matcher/call', 'speedup')
+    for n in SIZES:
+        patterns = make_patterns(n, rand)
+        names = make_names(n, lookups, rand)
+
+        start = time.time()
+        m = matcher.PatternMatcher(patterns)
+        compile_time = time.time() - start
+
+        # the fnmatch loop is far too slow to run every lookup on
+        # the big lists
+        slow_names = names[:max(2, min(lookups, 200000 // n))]
+        start = time.time()
+        want = [fnmatch_loop(name, patterns) for name in slow_names]
+        slow = (time.time() - start) / len(slow_names)
+
+        start = time.time()
+        got = [m.match(name) for name in names]
+        fast = (time.time() - start) / len(names)
+
+        assert got[:len(want)] == want, 'matcher disagrees with fnmatch'
+        print '%8d %10.1fms %12.1fus %12.2fus %8.0fx' % (
+            n, compile_time * 1000, slow * 1e6, fast * 1e6, slow / fast)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+"""
+Time ``post-update`` regenerating everything for REPOS repositories,
+serially and with WORKERS threads and processes, and check that every
+way writes the same files.
+
+Usage: python bench/post_update.py [REPOS [WORKERS]]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from ConfigParser import RawConfigParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gitosis import init
+from gitosis import repository
+from gitosis import run_hook
+
+KEY = ('ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAIHaSw601QLuAPAILOu5mzYiHEjI06'
+       + 'gxucUPArdc/9DHt admin@example.com')
+
+ARTIFACTS = ['description', 'git-daemon-export-ok', '.htaccess']
+
+def make_config(repos):
+    lines = ['[group gitosis-admin]',
+             'members = admin',
+             'writable = gitosis-admin',
+             '',
+             '[group devs]',
+             'members = %s' % ' '.join(['u%d' % i for i in xrange(100)]),
+             'writable = %s' % ' '.join(['r%d' % i
+                                         for i in xrange(0, repos, 3)]),
+             '']
+    for i in xrange(repos):
+        lines.extend(['[repo r%d]' % i,
+                      'description = repository %d' % i,
+                      'gitweb = yes',
+                      'daemon = %s' % ['yes', 'no'][i % 2],
+                      ''])
+    return '\n'.join(lines)
+
+def collect(tmp):
+    found = {}
+    for (dirpath, dirnames, filenames) in os.walk(tmp):
+        dirnames[:] = [d for d in dirnames if d != 'gitosis-admin.git']
+        for filename in filenames:
+            if ('.git' in os.path.basename(dirpath)
+                and filename not in ARTIFACTS):
+                continue
+            path = os.path.join(dirpath, filename)
+            f = file(path)
+            try:
+                found[path] = f.read()
+            finally:
+                f.close()
+    return found
+
+def clean(found):
+    for path in found:
+        os.unlink(path)
+
+def main(args):
+    repos = 2000
+    workers = 4
+    if args:
+        repos = int(args[0])
+    if args[1:]:
+        workers = int(args[1])
+
+    tmp = tempfile.mkdtemp(prefix='gitosis-bench-')
+    try:
+        repositories = os.path.join(tmp, 'repositories')
+        os.mkdir(repositories)
+        admin = os.path.join(repositories, 'gitosis-admin.git')
+        init.init_admin_repository(git_dir=admin, pubkey=KEY, user='admin')
+        repository.fast_import(
+            git_dir=admin,
+            committer='Bench <bench@example.com>',
+            commit_msg='bench\n',
+            parent='refs/heads/master^0',
+            files=[('gitosis.conf', make_config(repos))],
+            )
+        for i in xrange(repos):
+            os.mkdir(os.path.join(repositories, 'r%d.git' % i))
+
+        cfg = RawConfigParser()
+        cfg.add_section('gitosis')
+        cfg.set('gitosis', 'repositories', repositories)
+        cfg.set('gitosis', 'htaccess', 'yes')
+        cfg.set('gitosis', 'generate-files-in', os.path.join(tmp, 'generated'))
+        cfg.set('gitosis', 'ssh-authorized-keys-path',
+                os.path.join(tmp, 'authorized_keys'))
+
+        expected = None
+        for (pool, count) in [('thread', 1),
+                              ('thread', workers),
+                              ('process', workers)]:
+            cfg.set('gitosis', 'generate-pool', pool)
+            cfg.set('gitosis', 'generate-workers', str(count))
+            start = time.time()
+            run_hook.post_update(cfg=cfg, git_dir=admin, full=True)
+            elapsed = time.time() - start
+            print '%-8s %2d workers: %6.0fms' % (pool, count, elapsed * 1000)
+            found = collect(tmp)
+            if expected is None:
+                expected = found
+            elif found != expected:
+                print 'MISMATCH with the serial output'
+                sys.exit(1)
+            clean(found)
+        print '%d files identical' % len(expected)
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,53 @@
+#!/usr/bin/python
+"""
+Measure what ``gitosis-serve`` pays in interpreter startup and imports
+before it can make an access decision.
+
+Compares importing ``gitosis.serve`` as it is now against importing it
+together with the modules it used to load eagerly (``pkg_resources``
+and the auto-init helpers), which is what every connection paid
+before those imports were deferred.
+
+Usage: python bench/serve_startup.py [RUNS]
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+CASES = [
+    ('interpreter only', 'pass'),
+    ('gitosis.serve', 'import gitosis.serve'),
+    ('gitosis.serve + eager imports',
+     'import gitosis.serve; import pkg_resources; '
+     + 'import gitosis.repository, gitosis.gitweb, '
+     + 'gitosis.gitdaemon, gitosis.htaccess'),
+    ]
+
+def measure(code, runs):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))
+    times = []
+    for _ in xrange(runs):
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', code], env=env)
+        times.append(time.time() - start)
+    times.sort()
+    return times[len(times) // 2]
+
+def main(args):
+    runs = 30
+    if args:
+        runs = int(args[0])
+    results = []
+    for (name, code) in CASES:
+        median = measure(code, runs)
+        results.append(median)
+        print '%-32s %7.1f ms' % (name, median * 1000)
+    saved = results[2] - results[1]
+    print '%-32s %7.1f ms per connection' % ('saved', saved * 1000)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
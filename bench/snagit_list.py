@@ -0,0 +1,63 @@
+#!/usr/bin/python
+"""
+Time ``snagit list-repos`` for a CI user with access to REPOS
+repositories, granted through GROUPS groups, half of them as
+literal names and half through patterns matched against the
+repositories on disk.
+
+Usage: python bench/snagit_list.py [REPOS [GROUPS]]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from ConfigParser import RawConfigParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gitosis import snagit
+
+class NullFile(object):
+    def write(self, data):
+        pass
+
+def make_config(tmp, repos, groups):
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'repositories', tmp)
+    per_group = repos // groups
+    for g in xrange(groups):
+        section = 'group g%d' % g
+        cfg.add_section(section)
+        cfg.set(section, 'members', 'ci other%d' % g)
+        names = ['team%d/repo%d' % (g, i) for i in xrange(per_group)]
+        half = len(names) // 2
+        cfg.set(section, 'readonly', ' '.join(names[:half]))
+        # the other half lives on disk, granted by pattern
+        cfg.set(section, 'writable', 'team%d/*' % g)
+        os.mkdir(os.path.join(tmp, 'team%d' % g))
+        for name in names[half:]:
+            os.mkdir(os.path.join(tmp, name + '.git'))
+    return cfg
+
+def main(args):
+    repos = 20000
+    groups = 100
+    if args:
+        repos = int(args[0])
+    if args[1:]:
+        groups = int(args[1])
+    tmp = tempfile.mkdtemp(prefix='gitosis-bench-')
+    try:
+        cfg = make_config(tmp, repos, groups)
+        start = time.time()
+        snagit.list_repos(cfg, 'ci', 'snagit list-repos', fp=NullFile())
+        print 'list-repos for %d repositories: %.1fms' % (
+            repos, (time.time() - start) * 1000)
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
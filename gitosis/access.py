@@ -1,21 +1,107 @@
 import os, logging
 from fnmatch import fnmatch
 
+from gitosis import alias
 from gitosis import group
 from gitosis import util
 
-def pathMatchPatterns(path, repos):
+# all modes, strongest first; "writeable" is a popular misspelling
+# that is still honoured
+MODES = ['writable', 'writeable', 'readonly']
+
+def _stripExtension(log, path):
+    basename, ext = os.path.splitext(path)
+    if ext == '.git':
+        log.debug('Stripping .git suffix from %r, new value %r',
+                  path, basename)
+        path = basename
+    return path
+
+def _userSections(config, user, explain=None, membership=None):
     """
-    Check existence of given path against list of path patterns
+    List the sections that apply to ``user``, in the order they are
+    consulted.
 
-    The pattern definition is the as fnmatch.fnmatch.
+    :param membership: the ``group.MembershipIndex`` to use, if not
+      the current one of ``config``
+    """
+    if explain is not None:
+        started = explain.start()
+    if membership is None:
+        groups = group.getMembership(config=config, user=user)
+    else:
+        groups = membership.getMembership(user) + ('all',)
+    sections = ['group %s' % item for item in groups]
+    sections.insert(0, 'user %s' % user)
+    if explain is not None:
+        explain.stop('membership', started)
+        explain.note('%r is in %d groups, checking sections %s',
+                     user, len(sections) - 1,
+                     ', '.join(['[%s]' % s for s in sections]))
+    return sections
+
+def _explainPattern(explain, aliases, value, sectname, mode, path):
+    # only for explaining, which pattern it was does not matter
+    # otherwise
+    for pattern in aliases.expandWords(value.split()):
+        if fnmatch(path, pattern):
+            explain.note('[%s] %s matches %r by pattern %r',
+                         sectname, mode, path, pattern)
+            return
+
+def _sectionAccess(log, config, aliases, sectname, user, mode, path,
+                   explain=None):
     """
-    for repo in repos:
-        if fnmatch(path, repo):
-            return True
-    return False
+    Check one section for ``mode`` access to ``path``.
 
-def haveAccess(config, user, mode, path):
+    Returns ``None`` for no access, or a tuple of toplevel directory
+    and relative path, like ``haveAccess``.
+    """
+    if explain is not None:
+        started = explain.start()
+    value = util.getConfigDefault(config, sectname, mode, '')
+    matched = aliases.compile(value).match(path)
+    if explain is not None:
+        explain.stop('patterns', started)
+
+    mapping = None
+
+    if matched:
+        log.debug('Access ok for %r as %r on %r', user, mode, path)
+        if explain is not None:
+            _explainPattern(explain, aliases, value, sectname, mode, path)
+        mapping = path
+    else:
+        # a plain option lookup, no need to look at the other map
+        # entries of the section
+        if explain is not None:
+            started = explain.start()
+        mapping = util.getConfigDefault(config,
+                                        sectname,
+                                        'map %s %s' % (mode, path),
+                                        None)
+        if explain is not None:
+            explain.stop('map', started)
+        if mapping:
+            log.debug('Access ok for %r as %r on %r=%r',
+                      user, mode, path, mapping)
+            if explain is not None:
+                explain.note('[%s] map %s %s = %s',
+                             sectname, mode, path, mapping)
+
+    if mapping is None:
+        return None
+
+    prefix = util.getConfigDefault(config,
+                                   sectname,
+                                   'repositories',
+                                   'repositories',
+                                   'gitosis')
+
+    log.debug('Using prefix %r for %r', prefix, mapping)
+    return (prefix, mapping)
+
+def haveAccess(config, user, mode, path, explain=None):
     """
     Map request for write access to allowed path.
 
@@ -24,80 +110,135 @@ def haveAccess(config, user, mode, path):
 
     Returns ``None`` for no access, or a tuple of toplevel directory
     containing repositories and a relative path to the physical repository.
+
+    :param explain: an ``explain.Explainer`` to tell how the decision
+      was made, if any
     """
     log = logging.getLogger('gitosis.access.haveAccess')
 
-    log.debug(
-        'Access check for %(user)r as %(mode)r on %(path)r...'
-        % dict(
-        user=user,
-        mode=mode,
-        path=path,
-        ))
+    log.debug('Access check for %r as %r on %r...', user, mode, path)
 
-    basename, ext = os.path.splitext(path)
-    if ext == '.git':
-        log.debug(
-            'Stripping .git suffix from %(path)r, new value %(basename)r'
-            % dict(
-            path=path,
-            basename=basename,
-            ))
-        path = basename
+    path = _stripExtension(log, path)
 
-    sections = ['group %s' % item for item in
-                 group.getMembership(config=config, user=user)]
-    sections.insert(0, 'user %s' % user)
+    return _haveAccess(log, config, alias.getAliasTable(config),
+                       _userSections(config, user, explain),
+                       user, mode, path, explain)
 
+def _haveAccess(log, config, aliases, sections, user, mode, path, explain):
     for sectname in sections:
-        repos = util.getConfigList(config, sectname, mode)
-
-        mapping = None
-
-        if pathMatchPatterns(path, repos):
-            log.debug(
-                'Access ok for %(user)r as %(mode)r on %(path)r'
-                % dict(
-                user=user,
-                mode=mode,
-                path=path,
-                ))
-            mapping = path
-        else:
-            mapping = util.getConfigDefault(config,
-                                            sectname,
-                                            'map %s %s' % (mode, path),
-                                            None)
-            if mapping:
-                log.debug(
-                    'Access ok for %(user)r as %(mode)r on %(path)r=%(mapping)r'
-                    % dict(
-                    user=user,
-                    mode=mode,
-                    path=path,
-                    mapping=mapping,
-                    ))
-
-        if mapping is not None:
-            prefix = util.getConfigDefault(config,
-                                           sectname,
-                                           'repositories',
-                                           'repositories',
-                                           'gitosis')
-
-            log.debug(
-                'Using prefix %(prefix)r for %(path)r'
-                % dict(
-                prefix=prefix,
-                path=mapping,
-                ))
-            return (prefix, mapping)
+        newpath = _sectionAccess(log, config, aliases, sectname, user, mode,
+                                 path, explain)
+        if newpath is not None:
+            return newpath
+    return None
+
+def resolveAccess(config, user, path, explain=None):
+    """
+    Find the strongest access ``user`` has to ``path``.
+
+    Gives the same answer as calling ``haveAccess`` for each of
+    ``MODES`` in turn, but walks the user's sections only once.
+
+    Returns ``None`` for no access, or a tuple of the mode and what
+    ``haveAccess`` would have returned for it.
+
+    :param explain: an ``explain.Explainer`` to tell how the decision
+      was made, if any
+    """
+    log = logging.getLogger('gitosis.access.resolveAccess')
+
+    log.debug('Access check for %r on %r...', user, path)
+
+    path = _stripExtension(log, path)
+
+    return _resolveAccess(log, config, alias.getAliasTable(config),
+                          _userSections(config, user, explain),
+                          user, path, explain)
+
+def _resolveAccess(log, config, aliases, sections, user, path, explain):
+    # the first section granting a mode wins for that mode, just like
+    # in haveAccess
+    found = {}
+    for sectname in sections:
+        for mode in MODES:
+            if mode in found:
+                continue
+            newpath = _sectionAccess(log, config, aliases, sectname, user,
+                                     mode, path, explain)
+            if newpath is not None:
+                found[mode] = newpath
+        if MODES[0] in found:
+            # nothing can beat that
+            break
+
+    for mode in MODES:
+        if mode in found:
+            if explain is not None:
+                explain.note('%r gets %s access to %r', user, mode, path)
+            return (mode, found[mode])
+    if explain is not None:
+        explain.note('%r has no access to %r', user, path)
+    return None
+
+class AccessChecker(object):
+    """
+    Access checks against ``config``, for as long as it does not
+    change.
+
+    ``haveAccess`` and ``resolveAccess`` make sure the group
+    membership index and aliases they use are up to date with the
+    config on every call. A checker takes them once, and remembers
+    which sections apply to each user, for answering many questions
+    about one loaded configuration.
+
+    :type config: RawConfigParser
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.membership = group.getMembershipIndex(config)
+        self.aliases = alias.getAliasTable(config)
+        self.sections = {}
+
+    def userSections(self, user, explain=None):
+        if explain is None:
+            try:
+                return self.sections[user]
+            except KeyError:
+                pass
+        sections = _userSections(self.config, user, explain,
+                                 membership=self.membership)
+        self.sections[user] = sections
+        return sections
+
+    def haveAccess(self, user, mode, path, explain=None):
+        """
+        Like ``access.haveAccess``.
+        """
+        log = logging.getLogger('gitosis.access.haveAccess')
+        log.debug('Access check for %r as %r on %r...', user, mode, path)
+        path = _stripExtension(log, path)
+        return _haveAccess(log, self.config, self.aliases,
+                           self.userSections(user, explain),
+                           user, mode, path, explain)
+
+    def resolveAccess(self, user, path, explain=None):
+        """
+        Like ``access.resolveAccess``.
+        """
+        log = logging.getLogger('gitosis.access.resolveAccess')
+        log.debug('Access check for %r on %r...', user, path)
+        path = _stripExtension(log, path)
+        return _resolveAccess(log, self.config, self.aliases,
+                              self.userSections(user, explain),
+                              user, path, explain)
 
 
 def cacheAccess(config, mode, cache):
     """
     Computes access lists for all repositories in one pass.
     """
+    aliases = alias.getAliasTable(config)
     for sectname in config.sections():
         GROUP_PREFIX = 'group '
         USER_PREFIX  = 'user '
@@ -119,7 +260,8 @@ def cacheAccess(config, mode, cache):
         else:
             continue
 
-        repos = util.getConfigList(config, sectname, mode)
+        repos = aliases.expandWords(
+            util.getConfigList(config, sectname, mode))
         for (iname, ivalue) in config.items(sectname):
             if iname.startswith('map %s ' % mode):
                 repos.append(ivalue)
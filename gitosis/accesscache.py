@@ -0,0 +1,223 @@
+"""
+On-disk cache of access decisions.
+
+Automated clients tend to fetch the same repositories as the same
+users over and over again. ``gitosis-serve`` remembers the outcome of
+``access.resolveAccess`` for each ``(user, path)`` in a ``dbm`` file
+in the generated files directory, ``access-cache``, so that such
+repeated requests do not have to evaluate the configuration at all.
+
+Everything in the cache was computed from one particular
+``gitosis.conf``, identified by its fingerprint; if the configuration
+changes, the cache is thrown away as a whole. ``post-update`` also
+empties it on every push to ``gitosis-admin``.
+
+The cache holds at most ``access-cache-size`` decisions (from the
+``[gitosis]`` section, default 10000, 0 disables the cache). They
+are kept in the order they were stored, and every decision stored
+past that drops the one stored longest ago. That is first in, first
+out rather than least recently used: a lookup only reads, so any
+number of them can share the cache with a shared lock, where
+remembering each hit would make every lookup a write.
+
+``dumbdbm``, what ``anydbm`` falls back to when Python has no real
+``dbm`` module, rewrites its whole index on every change, which
+takes longer than deciding does; the cache is not used with it, and
+every request is decided from the configuration.
+"""
+
+import anydbm
+import errno
+import fcntl
+import logging
+import marshal
+import os
+import whichdb
+
+from ConfigParser import NoSectionError, NoOptionError
+
+from gitosis import util
+
+log = logging.getLogger('gitosis.accesscache')
+
+DEFAULT_SIZE = 10000
+
+_FINGERPRINT = '\0fingerprint'
+_NEXT = '\0next'
+
+# a broken cache must never stop anyone from fetching, treat all of
+# these as a cache miss
+_ERRORS = (IOError, OSError, ValueError, EOFError) + tuple(anydbm.error)
+
+def getCachePath(config):
+    return os.path.join(util.getGeneratedFilesDir(config), 'access-cache')
+
+def getCacheSize(config):
+    try:
+        return config.getint('gitosis', 'access-cache-size')
+    except (NoSectionError, NoOptionError):
+        return DEFAULT_SIZE
+
+# the files a dbm named path may consist of, depending on the flavour
+_SUFFIXES = ['', '.db', '.dir', '.dat', '.bak', '.pag']
+
+def _remove(path):
+    # not every dbm flavour honours the 'n' flag of anydbm.open
+    for suffix in _SUFFIXES:
+        try:
+            os.unlink(path + suffix)
+        except OSError, e:
+            if e.errno == errno.ENOENT:
+                pass
+            else:
+                raise
+
+class DecisionCache(object):
+    """
+    Access decisions made under the config with ``fingerprint``.
+
+    Every operation locks the cache and opens the ``dbm`` file anew,
+    so any number of ``gitosis-serve`` processes can share it.
+
+    Decision number ``n`` is stored as ``(n, result)``, and slot
+    ``n % size`` remembers its key, so that storing decision
+    ``n + size`` knows which one to drop without looking at the rest.
+    """
+
+    def __init__(self, path, fingerprint, size=DEFAULT_SIZE):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.size = size
+
+    def _open(self):
+        lock = file(self.path + '.lock', 'a')
+        try:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            db = anydbm.open(self.path, 'c')
+            if db.get(_FINGERPRINT) != self.fingerprint:
+                db.close()
+                _remove(self.path)
+                db = anydbm.open(self.path, 'c')
+                db[_FINGERPRINT] = self.fingerprint
+                db[_NEXT] = '0'
+        except:
+            lock.close()
+            raise
+        return (lock, db)
+
+    def _close(self, lock, db):
+        try:
+            db.close()
+        finally:
+            lock.close()
+
+    def _key(self, user, path):
+        return '%s\0%s' % (user, path)
+
+    def _slot(self, n):
+        return '\0slot %d' % (n % self.size)
+
+    def lookup(self, user, path):
+        """
+        Get the cached result of ``access.resolveAccess`` for
+        ``(user, path)``: ``None``, or the mode and the toplevel
+        directory and relative path tuple.
+
+        Raises ``KeyError`` if there is none.
+        """
+        key = self._key(user, path)
+        try:
+            lock = file(self.path + '.lock', 'a')
+            try:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_SH)
+                if whichdb.whichdb(self.path) is None:
+                    # nothing stored yet
+                    raise KeyError(key)
+                db = anydbm.open(self.path, 'r')
+                try:
+                    if db.get(_FINGERPRINT) != self.fingerprint:
+                        # the next store starts over
+                        raise KeyError(key)
+                    (n, result) = marshal.loads(db[key])
+                finally:
+                    db.close()
+            finally:
+                lock.close()
+        except _ERRORS, e:
+            log.warning('Cannot read access cache %r: %s', self.path, e)
+            raise KeyError(key)
+        return result
+
+    def store(self, user, path, result):
+        """
+        Remember ``result`` of ``access.resolveAccess`` for
+        ``(user, path)``, dropping the decision stored longest ago if
+        the cache is full.
+        """
+        key = self._key(user, path)
+        try:
+            (lock, db) = self._open()
+            try:
+                n = int(db[_NEXT])
+                slot = self._slot(n)
+                if n >= self.size:
+                    self._evict(db, db.get(slot), n - self.size)
+                db[key] = marshal.dumps((n, result))
+                db[slot] = key
+                db[_NEXT] = str(n + 1)
+            finally:
+                self._close(lock, db)
+        except _ERRORS, e:
+            log.warning('Cannot update access cache %r: %s', self.path, e)
+
+    def _evict(self, db, key, n):
+        if key is None or not db.has_key(key):
+            return
+        (stored, result) = marshal.loads(db[key])
+        # if it was stored again since, a later slot will drop it
+        if stored == n:
+            del db[key]
+
+    def invalidate(self):
+        """
+        Forget all decisions.
+        """
+        lock = file(self.path + '.lock', 'a')
+        try:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            _remove(self.path)
+        finally:
+            lock.close()
+
+def usable():
+    """
+    Tell whether ``anydbm`` has something better than ``dumbdbm``.
+    """
+    return anydbm._defaultmod.__name__ != 'dumbdbm'
+
+def open_cache(config):
+    """
+    Get the decision cache for ``config``.
+
+    Returns ``None`` if the cache is disabled, ``config`` does not
+    know what file it came from (see ``lazyconfig``), or there is no
+    ``dbm`` module worth using (see ``usable``).
+    """
+    fingerprint = getattr(config, 'fingerprint', None)
+    if fingerprint is None:
+        return None
+    if not usable():
+        return None
+    size = getCacheSize(config)
+    if size <= 0:
+        return None
+    return DecisionCache(getCachePath(config), fingerprint, size)
+
+def invalidate(config):
+    """
+    Forget all decisions cached for ``config``, if there are any.
+    """
+    path = getCachePath(config)
+    if not os.path.exists(path + '.lock'):
+        return
+    DecisionCache(path, None).invalidate()
@@ -0,0 +1,164 @@
+"""
+Named repository sets.
+
+A section like::
+
+	[alias public]
+	repos = bar baz @docs
+
+defines ``@public``, which can be used anywhere a list of
+repositories is expected: in ``readonly`` and ``writable`` grants and
+in the ``repos`` of a ``[mirror]`` section. Aliases may refer to
+other aliases.
+
+Aliases are expanded once per configuration, and every repository
+list using them is compiled once, with the aliases already replaced
+by what they stand for. ``@all`` in a mirror's ``repos`` is not an
+alias, and an ``@name`` with no such alias is left alone.
+"""
+
+import logging
+import weakref
+
+from gitosis import matcher
+from gitosis import util
+
+log = logging.getLogger('gitosis.alias')
+
+ALIAS_PREFIX = 'alias '
+
+class AliasCycleError(Exception):
+    """Repository alias cycle"""
+
+    def __str__(self):
+        return '%s: %s' % (self.__doc__, ' -> '.join(self.args))
+
+class AliasTable(object):
+    """
+    The aliases of one configuration, expanded on first use.
+    """
+
+    def __init__(self, aliases):
+        """
+        :param aliases: pairs of alias name and list of repositories,
+          in config order
+        """
+        self.aliases = dict(aliases)
+        self.expansion = {}
+        self.matchers = {}
+
+    def expand(self, name):
+        """
+        Get the repositories alias ``name`` stands for, with nested
+        aliases expanded.
+
+        Raises ``AliasCycleError`` if ``name`` ends up containing
+        itself.
+
+        :rtype: tuple
+        """
+        try:
+            return self.expansion[name]
+        except KeyError:
+            pass
+
+        # depth first, like group.MembershipIndex.expand
+        path = [name]
+        stack = [iter(self.aliases.get(name, []))]
+        while stack:
+            for repo in stack[-1]:
+                if not repo.startswith('@'):
+                    continue
+                nested = repo[1:]
+                if nested in self.expansion or nested not in self.aliases:
+                    continue
+                if nested in path:
+                    cycle = path[path.index(nested):] + [nested]
+                    raise AliasCycleError(*cycle)
+                path.append(nested)
+                stack.append(iter(self.aliases[nested]))
+                break
+            else:
+                stack.pop()
+                done = path.pop()
+                self.expansion[done] = tuple(self._expandWords(
+                    self.aliases.get(done, [])))
+        return self.expansion[name]
+
+    def _expandWords(self, words):
+        seen = set()
+        for word in words:
+            if word.startswith('@') and word[1:] in self.aliases:
+                names = self.expand(word[1:])
+            else:
+                names = [word]
+            for name in names:
+                if name not in seen:
+                    seen.add(name)
+                    yield name
+
+    def expandWords(self, words):
+        """
+        Replace the aliases in the list of repositories ``words`` by
+        what they stand for.
+        """
+        if not self.aliases:
+            return list(words)
+        return list(self._expandWords(words))
+
+    def compile(self, value):
+        """
+        Get a ``matcher.PatternMatcher`` for the repository list
+        ``value``, with aliases expanded.
+        """
+        if '@' not in value:
+            return matcher.compileOption(value)
+        try:
+            return self.matchers[value]
+        except KeyError:
+            pass
+        m = matcher.PatternMatcher(self.expandWords(value.split()))
+        self.matchers[value] = m
+        return m
+
+def _aliasRepos(config):
+    aliases = []
+    for section in config.sections():
+        if not section.startswith(ALIAS_PREFIX):
+            continue
+        name = section[len(ALIAS_PREFIX):]
+        aliases.append((name, util.getConfigList(config, section, 'repos')))
+    return aliases
+
+_tables = weakref.WeakKeyDictionary()
+
+def getAliasTable(config):
+    """
+    Get the ``AliasTable`` for ``config``.
+
+    Like ``group.getMembershipIndex``, the table is built once per
+    config object, and rebuilt only once the config has changed.
+
+    :type config: RawConfigParser
+    """
+    generation = util.getConfigGeneration(config)
+    aliases = None
+    if generation is None:
+        aliases = _aliasRepos(config)
+        generation = aliases
+    try:
+        (built, table) = _tables[config]
+    except (KeyError, TypeError):
+        pass
+    else:
+        if built == generation:
+            return table
+    if aliases is None:
+        aliases = _aliasRepos(config)
+    table = AliasTable(aliases)
+    try:
+        _tables[config] = (generation, table)
+    except TypeError:
+        # not weakly referenceable, just don't remember it
+        pass
+    return table
@@ -0,0 +1,268 @@
+"""
+Resident authorization daemon for ``gitosis-serve``.
+
+Every ``gitosis-serve`` run pays for starting Python, loading
+``gitosis.conf`` and resolving group membership, only to make one
+access decision. ``gitosis-authd`` keeps the configuration loaded and
+answers those decisions over a Unix domain socket, reloading the
+configuration whenever the file changes.
+
+``gitosis-serve`` asks the daemon first, and just runs the rewritten
+command it gets back. If the daemon is not running or does not
+answer, ``gitosis-serve`` decides on its own as before.
+
+The protocol is one request per connection: the client sends
+``user``, a NUL byte and the command, and shuts down its side of the
+socket. The daemon answers with a status word, a NUL byte and a
+payload:
+
+- ``ok``: access granted, payload is the rewritten command
+
+- ``deny``: access denied, payload is the error message
+
+- ``fallback``: the daemon will not decide this one (e.g. because
+  serving it needs to change the client's environment, or the
+  repository has to be created first), payload is the reason
+
+Requests are served in threads, so a client that is slow to send its
+request does not hold up the others. The daemon never changes
+anything on disk: creating a repository on the fly, and regenerating
+what depends on it, is left to the ``gitosis-serve`` asking.
+"""
+
+import errno
+import logging
+import os
+import socket
+import SocketServer
+import threading
+
+from ConfigParser import NoSectionError, NoOptionError
+from cStringIO import StringIO
+
+from gitosis import app
+from gitosis import lazyconfig
+from gitosis import serve
+from gitosis import util
+
+log = logging.getLogger('gitosis.authd')
+
+OK = 'ok'
+DENY = 'deny'
+FALLBACK = 'fallback'
+
+# how long gitosis-serve waits for an answer before deciding itself
+CLIENT_TIMEOUT = 5.0
+
+class DaemonUnavailable(Exception):
+    """Authorization daemon not available"""
+
+    def __str__(self):
+        return '%s: %s' % (self.__doc__, ': '.join(self.args))
+
+def getSocketPath(config):
+    try:
+        path = config.get('gitosis', 'authd-socket')
+    except (NoSectionError, NoOptionError):
+        path = os.path.join(util.getGeneratedFilesDir(config), 'authd.sock')
+    return path
+
+def _recv_all(sock):
+    chunks = []
+    while True:
+        data = sock.recv(65536)
+        if not data:
+            break
+        chunks.append(data)
+    return ''.join(chunks)
+
+def query(path, user, command, timeout=CLIENT_TIMEOUT):
+    """
+    Ask the daemon listening at ``path`` whether ``user`` may run
+    ``command``.
+
+    Returns a tuple of status (``OK``, ``DENY`` or ``FALLBACK``) and
+    payload. Raises ``DaemonUnavailable`` if the daemon cannot be
+    reached or gives a garbled answer.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        try:
+            sock.connect(path)
+            sock.sendall('%s\0%s' % (user, command))
+            sock.shutdown(socket.SHUT_WR)
+            answer = _recv_all(sock)
+        except (socket.error, socket.timeout), e:
+            raise DaemonUnavailable(str(e))
+    finally:
+        sock.close()
+
+    try:
+        (status, payload) = answer.split('\0', 1)
+    except ValueError:
+        raise DaemonUnavailable('bad answer %r' % answer)
+    if status not in [OK, DENY, FALLBACK]:
+        raise DaemonUnavailable('bad answer %r' % answer)
+    return (status, payload)
+
+class Policy(object):
+    """
+    The loaded configuration, reloaded when the file changes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.key = None
+        self.config = None
+        self._lock = threading.Lock()
+        self.reload()
+
+    def _stat_key(self):
+        st = os.stat(self.path)
+        return (st.st_size, st.st_mtime, st.st_ino)
+
+    def reload(self):
+        self._lock.acquire()
+        try:
+            self._reload()
+        finally:
+            self._lock.release()
+
+    def _reload(self):
+        try:
+            key = self._stat_key()
+        except OSError, e:
+            if self.config is None:
+                raise
+            log.error('Cannot stat %r, keeping old config: %s',
+                      self.path, e)
+            return
+        if key == self.key:
+            return
+
+        # counts its changes, so that membership and aliases are only
+        # worked out once per load, and parsed right away, for the
+        # threads to share
+        cfg = lazyconfig.LazyConfigParser()
+        try:
+            f = file(self.path)
+            try:
+                cfg.readfp(StringIO(f.read()), self.path)
+            finally:
+                f.close()
+        except Exception, e:
+            if self.config is None:
+                raise
+            log.error('Cannot read %r, keeping old config: %s',
+                      self.path, e)
+            return
+        log.info('Loaded %r', self.path)
+        self.config = cfg
+        self.key = key
+
+    def decide(self, user, command):
+        """
+        Decide on ``command`` for ``user``, like ``gitosis-serve`` would.
+
+        Returns a tuple of status and payload, as sent to the client.
+        """
+        self.reload()
+        config = self.config
+        words = command.split(None, 1)
+        if words and words[0] == 'cvs':
+            # serve() passes cvs settings on in os.environ
+            return (FALLBACK, 'cvs needs the environment')
+        try:
+            newcmd = serve.serve(
+                cfg=config,
+                user=user,
+                command=command,
+                autoinit=False,
+                )
+        except serve.ServingError, e:
+            return (DENY, str(e))
+        except serve.AutoInitRequired, e:
+            return (FALLBACK, str(e))
+        return (OK, newcmd)
+
+class RequestHandler(SocketServer.BaseRequestHandler):
+    def handle(self):
+        self.request.settimeout(self.server.request_timeout)
+        try:
+            data = _recv_all(self.request)
+        except (socket.error, socket.timeout), e:
+            log.warning('Dropping request: %s', e)
+            return
+        try:
+            (user, command) = data.split('\0', 1)
+        except ValueError:
+            log.warning('Dropping garbled request %r', data)
+            return
+
+        try:
+            (status, payload) = self.server.policy.decide(user, command)
+        except Exception, e:
+            log.exception('Cannot decide %r for %r', command, user)
+            (status, payload) = (FALLBACK, str(e))
+        log.debug('%s for %r on %r: %r', status, user, command, payload)
+        try:
+            self.request.sendall('%s\0%s' % (status, payload))
+        except socket.error, e:
+            log.warning('Cannot answer %r: %s', user, e)
+
+class AuthServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    request_timeout = CLIENT_TIMEOUT
+    daemon_threads = True
+
+    def __init__(self, path, policy):
+        self.policy = policy
+        try:
+            os.unlink(path)
+        except OSError, e:
+            if e.errno == errno.ENOENT:
+                pass
+            else:
+                raise
+        old_umask = os.umask(0077)
+        try:
+            SocketServer.UnixStreamServer.__init__(
+                self, path, RequestHandler)
+        finally:
+            os.umask(old_umask)
+
+class Main(app.App):
+    def create_parser(self):
+        parser = super(Main, self).create_parser()
+        parser.set_usage('%prog [OPTS]')
+        parser.set_description(
+            'Answer gitosis-serve access decisions over a Unix socket')
+        parser.add_option('--socket',
+                          metavar='PATH',
+                          help='listen on PATH instead of the default',
+                          )
+        return parser
+
+    def handle_args(self, parser, cfg, options, args):
+        super(Main, self).handle_args(parser, cfg, options, args)
+
+        path = options.socket
+        if path is None:
+            path = getSocketPath(cfg)
+        path = os.path.abspath(path)
+        policy = Policy(os.path.abspath(options.config))
+
+        # gitosis-serve runs in the home directory, and the
+        # repository paths we hand out are relative to it
+        os.chdir(os.path.expanduser('~'))
+        os.umask(0022)
+
+        server = AuthServer(path, policy)
+        log.info('Listening on %r', path)
+        try:
+            server.serve_forever()
+        finally:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
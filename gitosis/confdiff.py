@@ -0,0 +1,186 @@
+"""
+Work out what a change to ``gitosis.conf`` affects.
+
+``post-update`` used to regenerate every description, export flag and
+``.htaccess`` file on every push to ``gitosis-admin``. Comparing the
+previous and the new configuration section by section and option by
+option tells which repositories can have changed, so only those need
+to be touched:
+
+- a ``[repo foo]`` section affects ``foo``,
+
+- a changed grant (``readonly``, ``writable``, ``map ...``) affects
+  the repositories named in the old and the new value; patterns are
+  matched against the repositories on disk,
+
+- changed ``members`` of a group affect every repository granted to
+  that group, or to any group containing it,
+
+- a changed ``[alias foo]`` section affects the repositories ``@foo``
+  stood for, and the ones it stands for now.
+
+Changes to the ``[gitosis]`` or ``[defaults]`` sections can affect
+anything, and call for regenerating everything.
+"""
+
+import logging
+
+from gitosis import alias
+from gitosis import group
+from gitosis import matcher
+
+log = logging.getLogger('gitosis.confdiff')
+
+USER_PREFIX = 'user '
+GROUP_PREFIX = 'group '
+REPO_PREFIX = 'repo '
+
+GLOBAL_SECTIONS = ['gitosis', 'defaults']
+
+GRANT_OPTIONS = ['readonly', 'writable', 'writeable']
+
+def _sectionItems(config, section):
+    if not config.has_section(section):
+        return {}
+    return dict(config.items(section))
+
+def sectionChanged(old, new, section):
+    """
+    Tell whether ``section`` differs between configs ``old`` and
+    ``new``.
+    """
+    return (old.has_section(section) != new.has_section(section)
+            or _sectionItems(old, section) != _sectionItems(new, section))
+
+def diffSections(old, new):
+    """
+    Compare two configs.
+
+    Returns a dict mapping each section that differs to the set of
+    options that differ in it. A section only in one of the configs
+    has all its options listed.
+
+    :type old: RawConfigParser
+    :type new: RawConfigParser
+    """
+    changed = {}
+    sections = set(old.sections())
+    sections.update(new.sections())
+    for section in sections:
+        before = _sectionItems(old, section)
+        after = _sectionItems(new, section)
+        options = set()
+        for option in set(before) | set(after):
+            if before.get(option) != after.get(option):
+                options.add(option)
+        if options or (old.has_section(section)
+                       != new.has_section(section)):
+            changed[section] = options
+    return changed
+
+def _isGrant(option):
+    if option in GRANT_OPTIONS:
+        return True
+    words = option.split(None, 2)
+    return (len(words) == 3
+            and words[0] == 'map'
+            and words[1] in GRANT_OPTIONS)
+
+def _grantedNames(config, section, option):
+    """
+    List the repository names ``option`` of ``section`` names.
+    """
+    if not config.has_option(section, option):
+        return []
+    value = config.get(section, option)
+    if option.startswith('map '):
+        # the repository on disk, and the name it is known by
+        return [value, option.split(None, 2)[2]]
+    return alias.getAliasTable(config).expandWords(value.split())
+
+def _allGrants(config, section):
+    names = []
+    if not config.has_section(section):
+        return names
+    for option in config.options(section):
+        if _isGrant(option):
+            names.extend(_grantedNames(config, section, option))
+    return names
+
+def _containingGroups(config, name):
+    """
+    List ``name`` and all the groups containing group ``name``,
+    directly or not.
+    """
+    index = group.getMembershipIndex(config)
+    groups = [name]
+    groups.extend(index.getMembership('@%s' % name))
+    return groups
+
+class Changes(object):
+    """
+    What a change from ``old`` to ``new`` config affects.
+
+    ``full`` tells whether everything must be regenerated; if not,
+    ``repos`` holds the names of the repositories that may need their
+    description, export flag or ``.htaccess`` file redone,
+    ``projects`` whether the ``gitweb`` project list may have changed,
+    and ``groups`` whether the group list may have.
+
+    :param ondisk: names of the existing repositories, for patterns
+    """
+
+    def __init__(self, old, new, ondisk):
+        self.full = False
+        self.repos = set()
+        self.projects = False
+        self.groups = False
+
+        changed = diffSections(old, new)
+        log.debug('Changed sections: %r', sorted(changed))
+
+        names = set()
+        changed_groups = set()
+        for (section, options) in changed.iteritems():
+            if section in GLOBAL_SECTIONS:
+                self.full = True
+                return
+            if section.startswith(REPO_PREFIX):
+                names.add(section[len(REPO_PREFIX):])
+                self.projects = True
+                continue
+            if section.startswith(alias.ALIAS_PREFIX):
+                name = section[len(alias.ALIAS_PREFIX):]
+                for config in [old, new]:
+                    names.update(alias.getAliasTable(config).expand(name))
+                continue
+            if section.startswith(USER_PREFIX):
+                # the owner's name goes in the project list
+                self.projects = True
+            elif section.startswith(GROUP_PREFIX):
+                if ('members' in options
+                    or old.has_section(section) != new.has_section(section)):
+                    changed_groups.add(section[len(GROUP_PREFIX):])
+                    self.groups = True
+            else:
+                continue
+            for option in options:
+                if _isGrant(option):
+                    for config in [old, new]:
+                        names.update(_grantedNames(config, section, option))
+
+        # membership changes affect whoever is granted something
+        # through the group
+        for name in changed_groups:
+            for config in [old, new]:
+                for containing in _containingGroups(config, name):
+                    names.update(_allGrants(config,
+                                            GROUP_PREFIX + containing))
+
+        patterns = [name for name in names if matcher.isPattern(name)]
+        if patterns:
+            matches = matcher.expandPatterns(patterns, ondisk)
+            for pattern in patterns:
+                names.remove(pattern)
+                names.update(matches[pattern])
+        self.repos = names
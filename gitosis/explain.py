@@ -0,0 +1,65 @@
+"""
+Explain access decisions.
+
+``gitosis-serve --explain USER``, or setting ``GITOSIS_EXPLAIN=1`` in
+its environment, makes ``gitosis-serve`` print on standard error how
+it came to its decision: which sections it looked at, which pattern
+or ``map`` granted access, and how long loading the config, resolving
+group membership, matching patterns and looking up ``map`` options
+took.
+"""
+
+import os
+import sys
+import time
+
+ENVIRON = 'GITOSIS_EXPLAIN'
+
+# the order stages are reported in
+STAGES = ['config', 'membership', 'patterns', 'map']
+
+class Explainer(object):
+    """
+    Collect the decision path and per stage timings.
+    """
+
+    def __init__(self, fp=None):
+        if fp is None:
+            fp = sys.stderr
+        self.fp = fp
+        self.timings = {}
+
+    def note(self, msg, *args):
+        if args:
+            msg = msg % args
+        self.fp.write('explain: %s\n' % msg)
+
+    def start(self):
+        return time.time()
+
+    def stop(self, stage, started):
+        """
+        Count the time since ``started`` towards ``stage``.
+        """
+        elapsed = time.time() - started
+        self.timings[stage] = self.timings.get(stage, 0.0) + elapsed
+
+    def report(self):
+        """
+        Print the time spent in each stage.
+        """
+        stages = [s for s in STAGES if s in self.timings]
+        stages.extend(sorted([s for s in self.timings if s not in STAGES]))
+        for stage in stages:
+            self.note('%-10s %8.3fms', stage, self.timings[stage] * 1000)
+
+def fromEnviron(environ=None):
+    """
+    Get an ``Explainer`` if ``GITOSIS_EXPLAIN`` asks for one, or
+    ``None``.
+    """
+    if environ is None:
+        environ = os.environ
+    if environ.get(ENVIRON, '') in ['', '0', 'no']:
+        return None
+    return Explainer()
@@ -0,0 +1,124 @@
+"""
+Run the ``post-update`` generation stages, in parallel if configured.
+
+Regenerating after a push to ``gitosis-admin`` consists of stages
+that do not depend on each other once missing repositories have been
+initialized: the project list, repository descriptions, export flags,
+``.htaccess`` files, the group list, the per-user shards and so on.
+A stage is a callable that either does all of its work itself, like
+writing the project list, or works out what to do to each repository
+and returns that as a list of ``(function, args)`` tasks.
+
+With ``generate-workers`` in the ``[gitosis]`` section set above 1
+(default 1), the stages run concurrently in threads, and the tasks
+they return are spread over that many workers; ``generate-pool``
+says whether the workers are threads (the default) or processes.
+As stages may run in threads, they must not fork processes
+themselves; ``authorized_keys``, whose keys are checked by a pool of
+processes, is regenerated before the stages run.
+Task functions must be module level, so they can be sent to another
+process. Every file is written to a temporary file and renamed into
+place by exactly one task, so the result does not depend on the
+order things run in, and is the same as running everything serially.
+"""
+
+import logging
+import multiprocessing
+import multiprocessing.pool
+
+from ConfigParser import NoSectionError, NoOptionError
+
+from gitosis import util
+
+log = logging.getLogger('gitosis.generate')
+
+DEFAULT_WORKERS = 1
+
+POOLS = ['thread', 'process']
+
+def getWorkers(config):
+    try:
+        workers = config.getint('gitosis', 'generate-workers')
+    except (NoSectionError, NoOptionError):
+        return DEFAULT_WORKERS
+    return max(1, workers)
+
+def getPool(config):
+    pool = util.getConfigDefault(config, 'gitosis', 'generate-pool', 'thread')
+    if pool not in POOLS:
+        log.warning('Unknown generate-pool %r, using threads', pool)
+        pool = 'thread'
+    return pool
+
+def runTask(task):
+    """
+    Run one ``(function, args)`` task.
+    """
+    (fn, args) = task
+    return fn(*args)
+
+def runTasks(tasks):
+    """
+    Run ``(function, args)`` tasks one after another.
+    """
+    for task in tasks:
+        runTask(task)
+
+def _runStage(stage):
+    return stage() or []
+
+class Engine(object):
+    """
+    Run generation stages and the tasks they return.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, pool='thread'):
+        self.workers = workers
+        self.pool = pool
+
+    def fromConfig(cls, config):
+        return cls(workers=getWorkers(config), pool=getPool(config))
+    fromConfig = classmethod(fromConfig)
+
+    def run(self, stages):
+        """
+        Run ``stages``, a list of callables returning ``None`` or a
+        list of tasks.
+        """
+        if self.workers < 2 or not stages:
+            for stage in stages:
+                runTasks(_runStage(stage))
+            return
+
+        threads = multiprocessing.pool.ThreadPool(len(stages))
+        try:
+            planned = threads.map(_runStage, stages)
+        finally:
+            threads.close()
+            threads.join()
+        tasks = []
+        for stage_tasks in planned:
+            tasks.extend(stage_tasks)
+        self._runTasks(tasks)
+
+    def _runTasks(self, tasks):
+        if len(tasks) < 2:
+            runTasks(tasks)
+            return
+        workers = min(self.workers, len(tasks))
+        try:
+            if self.pool == 'process':
+                pool = multiprocessing.Pool(workers)
+            else:
+                pool = multiprocessing.pool.ThreadPool(workers)
+        except (OSError, ImportError), e:
+            # e.g. no working sem_open on this platform
+            log.debug('Generating serially: %s', e)
+            runTasks(tasks)
+            return
+        try:
+            chunksize = max(1, len(tasks) // (4 * workers))
+            pool.map(runTask, tasks, chunksize)
+        finally:
+            pool.close()
+            pool.join()
@@ -7,7 +7,7 @@ from ConfigParser import NoSectionError, NoOptionError
 log = logging.getLogger('gitosis.gitdaemon')
 
 from gitosis import util
-from gitosis import access
+from gitosis import matrix
 
 def export_ok_path(repopath):
     p = os.path.join(repopath, 'git-daemon-export-ok')
@@ -73,33 +73,71 @@ def walk_repos(config):
             yield (dirpath, repo, name)
 
 
-def set_export_ok(config):
+def export_ok_tasks(config, repos=None, inventory=None):
+    """
+    List the ``(function, args)`` tasks creating or removing
+    ``git-daemon-export-ok`` in the repositories, see
+    ``gitosis.generate``.
+
+    :param repos: only look at these repositories
+    :type repos: set of str
+
+    :param inventory: take the repositories from here instead of
+      walking the repositories directory
+    :type inventory: gitosis.inventory.RepositoryInventory
+    """
     global_enable = util.getConfigDefaultBoolean(config, 'defaults', 'daemon', False)
     log.debug(
         'Global default is %r',
         {True: 'allow', False: 'deny'}.get(global_enable),
         )
 
+    if inventory is None:
+        walked = walk_repos(config)
+    else:
+        walked = inventory.repos
+    found = [(dirpath, repo, name)
+             for (dirpath, repo, name) in walked
+             if repos is None or name in repos]
+
     enable_if_all = util.getConfigDefaultBoolean(config, 'defaults', 'daemon-if-all', False)
     if enable_if_all:
-        access_table = access.getAccessTable(config)
+        access_table = matrix.AccessMatrix(
+            config,
+            repos=[name for (dirpath, repo, name) in found],
+            )
     log.debug(
         'If accessible to @all: %r',
         {True: 'allow', False: 'unchanged'}.get(enable_if_all),
         )
 
-    for (dirpath, repo, name) in walk_repos(config):
+    tasks = []
+    for (dirpath, repo, name) in found:
         try:
             enable = config.getboolean('repo %s' % name, 'daemon')
         except (NoSectionError, NoOptionError):
             enable = global_enable
             if not enable and enable_if_all:
-                (users,groups,all_refs) = access.getAllAccess(config,access_table,name)
+                (users,groups,all_refs) = access_table.getAllAccess(name)
                 enable = ('@all' in all_refs)
 
         if enable:
             log.debug('Allow %r', name)
-            allow_export(os.path.join(dirpath, repo))
+            tasks.append((allow_export, (os.path.join(dirpath, repo),)))
         else:
             log.debug('Deny %r', name)
-            deny_export(os.path.join(dirpath, repo))
+            tasks.append((deny_export, (os.path.join(dirpath, repo),)))
+    return tasks
+
+def set_export_ok(config, repos=None, inventory=None):
+    """
+    Create or remove ``git-daemon-export-ok`` in the repositories.
+
+    :param repos: only look at these repositories
+    :type repos: set of str
+
+    :param inventory: see ``export_ok_tasks``
+    """
+    for (fn, args) in export_ok_tasks(config=config, repos=repos,
+                                      inventory=inventory):
+        fn(*args)
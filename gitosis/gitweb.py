@@ -35,9 +35,22 @@ def _escape_filename(s):
     s = s.replace('"', '\\"')
     return s
 
-def enum_cfg_repos(config):
+def repo_exists(topdir, subpath, inventory=None):
+    """
+    Tell whether ``subpath`` exists in ``topdir``.
+
+    :param inventory: ask this instead of the disk
+    :type inventory: gitosis.inventory.RepositoryInventory
+    """
+    if inventory is not None:
+        return inventory.exists(subpath)
+    return os.path.exists(os.path.join(topdir, subpath))
+
+def enum_cfg_repos(config, inventory=None):
     """
     Enumerates all repositories that have repo sections in the config.
+
+    :param inventory: see ``repo_exists``
     """
     repositories = util.getRepositoryDir(config)
 
@@ -51,7 +64,7 @@ def enum_cfg_repos(config):
 
         name, = l
 
-        if not os.path.exists(os.path.join(repositories, name)):
+        if not repo_exists(repositories, name, inventory):
             subpath = '%s.git' % name
         else:
             subpath = name
@@ -59,7 +72,7 @@ def enum_cfg_repos(config):
         yield (section, name, repositories, subpath)
 
 
-def generate_project_list_fp(config, fp):
+def generate_project_list_fp(config, fp, inventory=None):
     """
     Generate projects list for ``gitweb``.
 
@@ -68,17 +81,19 @@ def generate_project_list_fp(config, fp):
 
     :param fp: writable for ``projects.list``
     :type fp: (file-like, anything with ``.write(data)``)
+
+    :param inventory: see ``repo_exists``
     """
     log = logging.getLogger('gitosis.gitweb.generate_projects_list')
 
     global_enable = util.getConfigDefaultBoolean(config, 'defaults', 'gitweb', False)
 
-    for (section, name, topdir, subpath) in enum_cfg_repos(config):
+    for (section, name, topdir, subpath) in enum_cfg_repos(config, inventory):
         enable = util.getConfigDefaultBoolean(config, section, 'gitweb', global_enable)
         if not enable:
             continue
 
-        if not os.path.exists(os.path.join(topdir,subpath)):
+        if not repo_exists(topdir, subpath, inventory):
             log.warning(
                 'Cannot find %(name)r in %(topdir)r'
                 % dict(name=name,topdir=topdir))
@@ -98,7 +113,7 @@ def generate_project_list_fp(config, fp):
         line = ' '.join([urllib.quote_plus(s) for s in response])
         print >>fp, line
 
-def generate_project_list(config, path):
+def generate_project_list(config, path, inventory=None):
     """
     Generate projects list for ``gitweb``.
 
@@ -107,30 +122,51 @@ def generate_project_list(config, path):
 
     :param path: path to write projects list to
     :type path: str
+
+    :param inventory: see ``repo_exists``
     """
     tmp = '%s.%d.tmp' % (path, os.getpid())
 
     f = file(tmp, 'w')
     try:
-        generate_project_list_fp(config=config, fp=f)
+        generate_project_list_fp(config=config, fp=f, inventory=inventory)
     finally:
         f.close()
 
     os.rename(tmp, path)
 
 
-def set_descriptions(config):
+def write_description(path, description):
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    f = file(tmp, 'w')
+    try:
+        print >>f, description
+    finally:
+        f.close()
+    os.rename(tmp, path)
+
+def description_tasks(config, repos=None, inventory=None):
     """
-    Set descriptions for gitweb use.
+    List the ``(function, args)`` tasks setting descriptions for
+    gitweb use, see ``gitosis.generate``.
+
+    :param repos: only set descriptions of these repositories
+    :type repos: set of str
+
+    :param inventory: see ``repo_exists``
     """
     log = logging.getLogger('gitosis.gitweb.set_descriptions')
 
-    for (section, name, topdir, subpath) in enum_cfg_repos(config):
+    tasks = []
+    index = {}
+    for (section, name, topdir, subpath) in enum_cfg_repos(config, inventory):
+        if repos is not None and name not in repos:
+            continue
         description = util.getConfigDefault(config, section, 'description', None)
         if not description:
             continue
 
-        if not os.path.exists(os.path.join(topdir,subpath)):
+        if not repo_exists(topdir, subpath, inventory):
             log.warning(
                 'Cannot find %(name)r in %(topdir)r'
                 % dict(name=name,topdir=topdir))
@@ -141,10 +177,22 @@ def set_descriptions(config):
             subpath,
             'description',
             )
-        tmp = '%s.%d.tmp' % (path, os.getpid())
-        f = file(tmp, 'w')
-        try:
-            print >>f, description
-        finally:
-            f.close()
-        os.rename(tmp, path)
+        # [repo foo] and [repo foo.git] are the same repository; the
+        # last one wins, as it would when writing one after another
+        task = (write_description, (path, description))
+        if path in index:
+            tasks[index[path]] = task
+        else:
+            index[path] = len(tasks)
+            tasks.append(task)
+    return tasks
+
+def set_descriptions(config, repos=None):
+    """
+    Set descriptions for gitweb use.
+
+    :param repos: only set descriptions of these repositories
+    :type repos: set of str
+    """
+    for (fn, args) in description_tasks(config=config, repos=repos):
+        fn(*args)
@@ -1,35 +1,181 @@
 import os, logging
+import weakref
 from gitosis import util
 
-def _getMembership(config, user, seen):
-    log = logging.getLogger('gitosis.group.getMembership')
+GROUP_PREFIX = 'group '
 
+class GroupCycleError(Exception):
+    """Group membership cycle"""
+
+    def __str__(self):
+        return '%s: %s' % (self.__doc__, ' -> '.join(self.args))
+
+class MembershipIndex(object):
+    """
+    Who is member of what, for one configuration.
+
+    Holds a reverse map from members (users and ``@group`` references)
+    to the groups listing them, and remembers the transitive closure
+    for every member once it has been asked for. Going the other way,
+    the expansion of every group is remembered likewise.
+    """
+
+    def __init__(self, groups):
+        """
+        :param groups: pairs of group name and list of members, in
+          config order
+        """
+        self.position = {}
+        self.direct = {}
+        self.everyone = []
+        self.closure = {}
+        self.members = {}
+        self.expansion = {}
+        for (pos, (group, members)) in enumerate(groups):
+            self.position[group] = pos
+            self.members[group] = members
+            for member in members:
+                self.direct.setdefault(member, []).append(group)
+            # @all is the only group where membership needs to be
+            # bootstrapped like this, anything else gets started from
+            # the username itself
+            if '@all' in members:
+                self.everyone.append(group)
+
+    def _candidates(self, member):
+        direct = self.direct.get(member, [])
+        if not self.everyone:
+            return direct
+        groups = set(direct)
+        groups.update(self.everyone)
+        return sorted(groups, key=self.position.__getitem__)
+
+    def _walk(self, user):
+        log = logging.getLogger('gitosis.group.getMembership')
+
+        # depth first, in config order, like a recursive walk would;
+        # groups already seen are skipped, which also breaks cycles
+        seen = set()
+        found = []
+        stack = [iter(self._candidates(user))]
+        while stack:
+            for group in stack[-1]:
+                if group in seen:
+                    continue
+                log.debug('found %r in %r', user, group)
+                seen.add(group)
+                found.append(group)
+                stack.append(iter(self._candidates('@%s' % group)))
+                break
+            else:
+                stack.pop()
+        return tuple(found)
+
+    def getMembership(self, user):
+        """
+        List the groups ``user`` is member of, not including the
+        implicit group ``all``.
+        """
+        try:
+            return self.closure[user]
+        except KeyError:
+            pass
+        found = self._walk(user)
+        self.closure[user] = found
+        return found
+
+    def _groupMembers(self, group):
+        # "all" has no real member list, whatever the config says
+        if group == 'all':
+            return []
+        return self.members.get(group, [])
+
+    def expand(self, group):
+        """
+        Get all members of ``group``, including members of nested
+        groups and the ``@group`` references themselves.
+
+        Raises ``GroupCycleError`` if ``group`` ends up containing
+        itself.
+
+        :rtype: frozenset
+        """
+        try:
+            return self.expansion[group]
+        except KeyError:
+            pass
+
+        # depth first; a group is expanded once all the groups it
+        # refers to are
+        path = [group]
+        stack = [iter(self._groupMembers(group))]
+        while stack:
+            for member in stack[-1]:
+                if not member.startswith('@'):
+                    continue
+                nested = member[1:]
+                if nested in self.expansion:
+                    continue
+                if nested in path:
+                    cycle = path[path.index(nested):] + [nested]
+                    raise GroupCycleError(*cycle)
+                path.append(nested)
+                stack.append(iter(self._groupMembers(nested)))
+                break
+            else:
+                stack.pop()
+                done = path.pop()
+                members = set()
+                for member in self._groupMembers(done):
+                    members.add(member)
+                    if member.startswith('@'):
+                        members.update(self.expansion[member[1:]])
+                self.expansion[done] = frozenset(members)
+        return self.expansion[group]
+
+def _groupMembers(config):
+    groups = []
     for section in config.sections():
-        GROUP_PREFIX = 'group '
         if not section.startswith(GROUP_PREFIX):
             continue
         group = section[len(GROUP_PREFIX):]
-        if group in seen:
-            continue
+        groups.append((group, util.getConfigList(config, section, 'members')))
+    return groups
 
-        members = util.getConfigList(config, section, 'members')
+_indexes = weakref.WeakKeyDictionary()
 
-        # @all is the only group where membership needs to be
-        # bootstrapped like this, anything else gets started from the
-        # username itself
-        if (user in members
-            or '@all' in members):
-            log.debug('found %(user)r in %(group)r' % dict(
-                user=user,
-                group=group,
-                ))
-            seen.add(group)
-            yield group
+def getMembershipIndex(config):
+    """
+    Get the ``MembershipIndex`` for ``config``.
+
+    The index is built once per config object, and rebuilt only once
+    the config has changed (see ``util.getConfigGeneration``). A
+    config that does not count its changes has its groups read again
+    every time, to tell.
 
-            for member_of in _getMembership(
-                config, '@%s' % group, seen,
-                ):
-                yield member_of
+    :type config: RawConfigParser
+    """
+    generation = util.getConfigGeneration(config)
+    members = None
+    if generation is None:
+        members = _groupMembers(config)
+        generation = members
+    try:
+        (built, index) = _indexes[config]
+    except (KeyError, TypeError):
+        pass
+    else:
+        if built == generation:
+            return index
+    if members is None:
+        members = _groupMembers(config)
+    index = MembershipIndex(members)
+    try:
+        _indexes[config] = (generation, index)
+    except TypeError:
+        # not weakly referenceable, just don't remember it
+        pass
+    return index
 
 
 def getMembership(config, user):
@@ -38,11 +184,10 @@ def getMembership(config, user):
 
     :type config: RawConfigParser
     :type user: str
-    :param _seen: internal use only
     """
 
-    seen = set()
-    for member_of in _getMembership(config, user, seen):
+    index = getMembershipIndex(config)
+    for member_of in index.getMembership(user):
         yield member_of
 
     # everyone is always a member of group "all"
@@ -53,18 +198,15 @@ def listMembers(config, group, mset):
     """
     Generate a list of members of a group
 
+    Raises ``GroupCycleError`` if the group contains itself.
+
     :type config: RawConfigParser
     :type group: str
     :param mset: Set of members to amend
     """
 
-    if group <> 'all':
-        members = util.getConfigList(config, 'group %s' % group, 'members')
-
-        for user in members:
-            mset.add(user)
-            if user.startswith('@'):
-                listMembers(config, user[1:], mset)
+    index = getMembershipIndex(config)
+    mset.update(index.expand(group))
 
 
 def generate_group_list_fp(config, fp):
@@ -77,16 +219,15 @@ def generate_group_list_fp(config, fp):
     :param fp: file to write group list to
     :type fp: file
     """
+    index = getMembershipIndex(config)
     for section in config.sections():
-        GROUP_PREFIX = 'group '
         if not section.startswith(GROUP_PREFIX):
             continue
         group = section[len(GROUP_PREFIX):]
         if group == 'all':
             continue
 
-        items = set()
-        listMembers(config, group, items)
+        items = index.expand(group)
 
         users = filter(lambda u: not u.startswith('@'), items)
         line = group + ': ' + ' '.join(sorted(users))
@@ -5,8 +5,7 @@ import os
 log = logging.getLogger('gitosis.htaccess')
 
 from gitosis import util
-from gitosis import access
-from gitosis import group
+from gitosis import matrix
 from gitosis import gitdaemon
 
 def htaccess_path(repopath):
@@ -44,24 +43,57 @@ def write_htaccess(repopath, users, groups):
     os.rename(tmp, path)
 
 
-def gen_htaccess(config):
-    table = access.getAccessTable(config)
-
-    for (dirpath, repo, name) in gitdaemon.walk_repos(config):
-        (users, groups, all_refs) = access.getAllAccess(config,table,name)
+def htaccess_tasks(config, repos=None, inventory=None):
+    """
+    List the ``(function, args)`` tasks writing ``.htaccess`` files
+    for the repositories, see ``gitosis.generate``.
+
+    :param repos: only write them for these repositories
+    :type repos: set of str
+
+    :param inventory: see ``gitdaemon.export_ok_tasks``
+    """
+    if inventory is None:
+        walked = gitdaemon.walk_repos(config)
+    else:
+        walked = inventory.repos
+    found = [(dirpath, repo, name)
+             for (dirpath, repo, name) in walked
+             if repos is None or name in repos]
+    table = matrix.AccessMatrix(
+        config,
+        repos=[name for (dirpath, repo, name) in found],
+        )
+
+    tasks = []
+    for (dirpath, repo, name) in found:
+        (users, groups, all_refs) = table.getAllAccess(name)
 
         if '@all' in all_refs:
             log.debug('Allow all for %r', name)
-            remove_htaccess(os.path.join(dirpath, repo))
+            tasks.append((remove_htaccess, (os.path.join(dirpath, repo),)))
         else:
-            write_htaccess(os.path.join(dirpath, repo), users, groups)
+            tasks.append((write_htaccess,
+                          (os.path.join(dirpath, repo), users, groups)))
+    return tasks
+
+def gen_htaccess(config, repos=None, inventory=None):
+    """
+    Write ``.htaccess`` files for the repositories.
+
+    :param repos: only write them for these repositories
+    :type repos: set of str
+    """
+    for (fn, args) in htaccess_tasks(config=config, repos=repos,
+                                     inventory=inventory):
+        fn(*args)
 
 
-def gen_htaccess_if_enabled(config):
+def gen_htaccess_if_enabled(config, repos=None, inventory=None):
     do_htaccess = util.getConfigDefaultBoolean(config, 'gitosis', 'htaccess', False)
 
     if do_htaccess:
-        gen_htaccess(config)
+        gen_htaccess(config, repos=repos, inventory=inventory)
 
     return do_htaccess
 
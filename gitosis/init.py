@@ -77,8 +77,9 @@ def init_admin_repository(
     repository.init(
         path=git_dir,
         )
-    hook = os.path.join(git_dir, 'hooks', 'post-update')
-    os.chmod(hook, 0755)
+    for name in ['post-receive', 'post-update']:
+        hook = os.path.join(git_dir, 'hooks', name)
+        os.chmod(hook, 0755)
     if not repository.has_initial_commit(git_dir):
         log.info('Making initial commit...')
         # ConfigParser does not guarantee order, so jump through hoops
@@ -0,0 +1,164 @@
+"""
+What is in the repositories directory, found by one traversal.
+
+Regenerating after a push to ``gitosis-admin`` used to look at the
+repositories directory over and over: ``gitdaemon.walk_repos`` for
+the export flags and again for ``.htaccess`` files, and
+``os.path.exists`` for every ``[repo ...]`` section when initializing
+repositories, writing descriptions and writing the project list. On
+network file systems, all that metadata traffic is what takes the
+time.
+
+A ``RepositoryInventory`` walks the tree once, like ``walk_repos``,
+and remembers what every directory it listed holds, so that whether
+a repository exists can be answered without going back to the disk.
+It counts the directories it lists and the ``stat`` calls it makes,
+and ``report`` logs them. Directories are read with ``scandir`` where
+available (``os.scandir``, or the ``scandir`` package), which usually
+tells directories from files without a ``stat`` at all; otherwise
+every entry takes one ``lstat``, and symlinks another ``stat``.
+"""
+
+import errno
+import logging
+import os
+import stat
+import threading
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+from gitosis import util
+
+log = logging.getLogger('gitosis.inventory')
+
+def _listScandir(dirpath):
+    stats = 0
+    entries = []
+    for entry in scandir(dirpath):
+        islink = entry.is_symlink()
+        if islink:
+            stats += 1
+            try:
+                isdir = stat.S_ISDIR(os.stat(entry.path).st_mode)
+            except OSError:
+                # dangling, does not exist as far as os.path.exists
+                # is concerned
+                continue
+        else:
+            isdir = entry.is_dir(follow_symlinks=False)
+        entries.append((entry.name, isdir, islink))
+    return (entries, stats)
+
+def _listStat(dirpath):
+    stats = 0
+    entries = []
+    for name in os.listdir(dirpath):
+        path = os.path.join(dirpath, name)
+        stats += 1
+        try:
+            st = os.lstat(path)
+            islink = stat.S_ISLNK(st.st_mode)
+            if islink:
+                stats += 1
+                st = os.stat(path)
+        except OSError:
+            # gone already, or a dangling symlink
+            continue
+        entries.append((name, stat.S_ISDIR(st.st_mode), islink))
+    return (entries, stats)
+
+class RepositoryInventory(object):
+    """
+    The repositories found in the repositories directory of a config,
+    and the entries of every directory looked at to find them.
+
+    ``repos`` lists ``(dirpath, repo, name)`` like
+    ``gitdaemon.walk_repos``.
+    """
+
+    def __init__(self, config):
+        self.topdir = util.getRepositoryDir(config)
+        self.listings = 0
+        self.stats = 0
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def _list(self, dirpath):
+        self.listings += 1
+        if scandir is not None:
+            lister = _listScandir
+        else:
+            lister = _listStat
+        try:
+            (entries, stats) = lister(dirpath)
+        except OSError, e:
+            if e.errno == errno.ENOENT:
+                return []
+            raise
+        self.stats += stats
+        return entries
+
+    def refresh(self):
+        """
+        Walk the repositories directory again, e.g. after creating
+        repositories.
+        """
+        self.repos = []
+        self.listed = {}
+        stack = ['']
+        while stack:
+            reldir = stack.pop()
+            if reldir:
+                dirpath = os.path.join(self.topdir, reldir)
+            else:
+                dirpath = self.topdir
+            entries = self._list(dirpath)
+            self.listed[reldir] = set([name for (name, isdir, islink)
+                                       in entries])
+
+            to_recurse = []
+            for (name, isdir, islink) in entries:
+                if not isdir:
+                    continue
+                if name.endswith('.git'):
+                    self.repos.append(
+                        (dirpath, name, os.path.join(reldir, name[:-4])))
+                elif not islink:
+                    # like os.walk, do not follow symlinks
+                    to_recurse.append(os.path.join(reldir, name))
+            to_recurse.reverse()
+            stack.extend(to_recurse)
+        log.debug('Found %d repositories in %r',
+                  len(self.repos), self.topdir)
+
+    def exists(self, path):
+        """
+        Tell whether ``path``, relative to the repositories directory,
+        exists; only goes to the disk if the directory of ``path`` was
+        not listed.
+        """
+        parts = path.split(os.sep)
+        if not [part for part in parts if part in ['', '.', '..']]:
+            names = self.listed.get(os.sep.join(parts[:-1]))
+            if names is not None:
+                return parts[-1] in names
+        self._lock.acquire()
+        try:
+            self.stats += 1
+        finally:
+            self._lock.release()
+        return os.path.exists(os.path.join(self.topdir, path))
+
+    def report(self):
+        """
+        Log how much looking at the disk this inventory took.
+        """
+        log.info('Repository inventory: %d repositories,'
+                 + ' %d directories listed, %d stats',
+                 len(self.repos), self.listings, self.stats)
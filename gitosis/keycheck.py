@@ -0,0 +1,186 @@
+"""
+Validate SSH public keys from ``keydir``.
+
+Every line of a ``keydir/*.pub`` file ends up in ``authorized_keys``
+after a ``command="gitosis-serve ..."`` prefix, so a line that is not
+exactly one public key must not get there: a line with options of its
+own could weaken the restrictions gitosis puts on the key. A key is
+accepted when
+
+- it is ``TYPE BASE64 [COMMENT]``, with no options and no control
+  characters,
+
+- ``TYPE`` is a key type OpenSSH knows,
+
+- the base64 decodes, and the decoded blob holds the fields of that
+  type, starting with the type itself, and nothing more,
+
+- RSA keys have at least 1024 bits, and Ed25519 keys 32 bytes.
+
+Blank lines and ``#`` comments are skipped. Checking many keys fans
+out to a pool of processes.
+"""
+
+import base64
+import logging
+import multiprocessing
+import re
+import struct
+import threading
+
+log = logging.getLogger('gitosis.keycheck')
+
+# key type -> number of fields in the blob after the type
+KEY_TYPES = {
+    'ssh-rsa': 2,
+    'ssh-dss': 4,
+    'ssh-ed25519': 1,
+    'ecdsa-sha2-nistp256': 2,
+    'ecdsa-sha2-nistp384': 2,
+    'ecdsa-sha2-nistp521': 2,
+    'sk-ecdsa-sha2-nistp256@openssh.com': 3,
+    'sk-ssh-ed25519@openssh.com': 2,
+    }
+
+RSA_MINIMUM_BITS = 1024
+
+ED25519_KEY_SIZE = 32
+
+# below this many lines, forking workers costs more than it saves
+PARALLEL_THRESHOLD = 2000
+
+_BASE64_RE = re.compile(r'^[A-Za-z0-9+/]+={0,2}$')
+
+_CONTROL_RE = re.compile(r'[\x00-\x08\x0a-\x1f\x7f]')
+
+class InvalidKeyError(Exception):
+    """Invalid SSH public key"""
+
+    def __str__(self):
+        return '%s: %s' % (self.__doc__, ': '.join(self.args))
+
+def _fields(blob):
+    """
+    Split an SSH wire format ``blob`` into its length prefixed
+    fields.
+    """
+    fields = []
+    pos = 0
+    while pos < len(blob):
+        if pos + 4 > len(blob):
+            raise InvalidKeyError('truncated key')
+        (size,) = struct.unpack('>I', blob[pos:pos+4])
+        pos += 4
+        if pos + size > len(blob):
+            raise InvalidKeyError('truncated key')
+        fields.append(blob[pos:pos+size])
+        pos += size
+    return fields
+
+def _mpintBits(value):
+    value = value.lstrip('\0')
+    if not value:
+        return 0
+    return (len(value) - 1) * 8 + len(bin(ord(value[0]))) - 2
+
+def validateKey(line):
+    """
+    Check that ``line`` is a well-formed public key.
+
+    Returns the key with surrounding whitespace removed, or ``None``
+    for blank lines and comments.
+
+    :raise InvalidKeyError: the line is not a well-formed key
+    """
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    if _CONTROL_RE.search(line):
+        raise InvalidKeyError('control characters')
+
+    words = line.split(None, 2)
+    keytype = words[0]
+    if keytype not in KEY_TYPES:
+        for word in line.split()[1:]:
+            if word in KEY_TYPES:
+                raise InvalidKeyError('key options are not allowed')
+        raise InvalidKeyError('unknown key type %r' % keytype[:40])
+    if len(words) < 2:
+        raise InvalidKeyError('no key')
+
+    data = words[1]
+    if len(data) % 4 or not _BASE64_RE.match(data):
+        raise InvalidKeyError('bad base64')
+    fields = _fields(base64.b64decode(data))
+    if not fields or fields[0] != keytype:
+        raise InvalidKeyError('key is not of type %r' % keytype)
+    if len(fields) != KEY_TYPES[keytype] + 1:
+        raise InvalidKeyError('malformed %s key' % keytype)
+
+    if keytype == 'ssh-rsa':
+        if _mpintBits(fields[2]) < RSA_MINIMUM_BITS:
+            raise InvalidKeyError('RSA key too short')
+    elif keytype.startswith('ecdsa-'):
+        if fields[1] != keytype.split('-')[-1]:
+            raise InvalidKeyError('wrong curve for %s' % keytype)
+    elif keytype in ['ssh-ed25519', 'sk-ssh-ed25519@openssh.com']:
+        if len(fields[1]) != ED25519_KEY_SIZE:
+            raise InvalidKeyError('malformed %s key' % keytype)
+    return line
+
+def checkKeyFile(data):
+    """
+    Validate the lines of key file contents ``data``.
+
+    Returns a list of the valid keys, and a list of ``(lineno,
+    reason)`` for the rejected ones.
+    """
+    keys = []
+    rejected = []
+    lines = data.split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    for (i, line) in enumerate(lines):
+        try:
+            key = validateKey(line)
+        except InvalidKeyError, e:
+            rejected.append((i + 1, e.args[0]))
+            continue
+        if key is not None:
+            keys.append(key)
+    return (keys, rejected)
+
+def checkKeyFiles(contents):
+    """
+    Validate many key files, given a list of their contents.
+
+    Returns a list of the ``checkKeyFile`` results, in the same
+    order. Large batches are spread over a process per CPU, if there
+    is more than one, unless called from a thread other than the main
+    one: forking then could copy a lock some other thread holds.
+    """
+    lines = 0
+    for data in contents:
+        lines += data.count('\n')
+    try:
+        cpus = multiprocessing.cpu_count()
+    except NotImplementedError:
+        cpus = 1
+    if len(contents) < 2 or lines < PARALLEL_THRESHOLD or cpus < 2:
+        return map(checkKeyFile, contents)
+    if not isinstance(threading.currentThread(), threading._MainThread):
+        log.debug('Checking keys serially outside the main thread')
+        return map(checkKeyFile, contents)
+
+    try:
+        pool = multiprocessing.Pool(cpus)
+    except (OSError, ImportError), e:
+        # e.g. no working sem_open on this platform
+        log.debug('Checking keys serially: %s', e)
+        return map(checkKeyFile, contents)
+    try:
+        chunksize = max(1, len(contents) // (4 * cpus))
+        return pool.map(checkKeyFile, contents, chunksize)
+    finally:
+        pool.close()
+        pool.join()
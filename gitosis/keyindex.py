@@ -0,0 +1,197 @@
+"""
+Look up SSH keys for sshd's ``AuthorizedKeysCommand``.
+
+sshd reads ``authorized_keys`` from start to end on every login,
+which gets slow with tens of thousands of keys. Instead, sshd can
+run::
+
+	Match User git
+		AuthorizedKeysCommand /usr/bin/gitosis-authorized-keys %f
+		AuthorizedKeysCommandUser git
+
+and ``gitosis-authorized-keys`` prints just the ``gitosis-serve``
+line for the key offered, found by its fingerprint in an index of
+``keydir``. The index is a text file of ``FINGERPRINT USER KEY``
+lines, tab separated and sorted by fingerprint, so a lookup is a
+binary search that reads a few blocks of it. ``post-update``
+rebuilds it whenever ``authorized_keys`` is written.
+
+A key can only belong to one user; if ``keydir`` has the same key
+for several users, the first in file name order gets it, as in
+``authorized_keys`` (see ``ssh.uniqueKeys``).
+"""
+
+import base64
+import errno
+import hashlib
+import logging
+import os
+
+from gitosis import app
+from gitosis import lazyconfig
+from gitosis import ssh
+from gitosis import util
+
+log = logging.getLogger('gitosis.keyindex')
+
+FINGERPRINT_PREFIX = 'SHA256:'
+
+def parseKey(line):
+    """
+    Find the key type and base64 blob in public key ``line``.
+
+    Returns ``None`` for blank lines, comments and lines without a
+    key.
+    """
+    words = line.split()
+    if not words or words[0].startswith('#'):
+        return None
+    for i, word in enumerate(words[:-1]):
+        if (word.startswith('ssh-')
+            or word.startswith('ecdsa-')
+            or word.startswith('sk-')):
+            return (word, words[i+1])
+    return None
+
+def fingerprint(blob):
+    """
+    Compute the OpenSSH ``SHA256:`` fingerprint of base64 key
+    ``blob``, as sshd passes it for ``%f``.
+
+    :raise TypeError: ``blob`` is not valid base64
+    """
+    raw = base64.b64decode(blob)
+    digest = base64.b64encode(hashlib.sha256(raw).digest())
+    return FINGERPRINT_PREFIX + digest.rstrip('=')
+
+def indexKeys(keys):
+    """
+    Index ``(user, key)`` pairs by fingerprint.
+
+    A key listed for more than one user goes to the first of them
+    only, see ``ssh.uniqueKeys``.
+
+    Returns a sorted list of ``(fingerprint, user, key)``.
+    """
+    (keys, duplicates) = ssh.uniqueKeys(keys)
+    entries = []
+    for (user, line) in keys:
+        parsed = parseKey(line)
+        if parsed is None:
+            continue
+        (keytype, blob) = parsed
+        try:
+            fp = fingerprint(blob)
+        except TypeError:
+            log.warning('Ignoring malformed SSH key for %r', user)
+            continue
+        entries.append((fp, user, line))
+    entries.sort()
+    return entries
+
+def writeKeyIndex(path, keydir, manifest=None):
+    """
+    Write the index of the well-formed keys in ``keydir`` to ``path``.
+
+    :param manifest: path of the keydir manifest, see
+      ``ssh.readValidKeys``
+    """
+    # duplicates are reported when writing authorized_keys
+    entries = indexKeys(ssh.readValidKeys(keydir, manifest))
+
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    f = file(tmp, 'w')
+    try:
+        for entry in entries:
+            f.write('%s\t%s\t%s\n' % entry)
+        os.fsync(f)
+    finally:
+        f.close()
+    os.rename(tmp, path)
+
+def _findLine(f, key):
+    """
+    Find the line starting with ``key`` and a tab in sorted file
+    ``f``, or return ``None``.
+    """
+    f.seek(0, 2)
+    lo = 0
+    hi = f.tell()
+    # find the first line starting at or after lo that does not sort
+    # before key
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if mid:
+            f.seek(mid - 1)
+            f.readline()
+        else:
+            f.seek(0)
+        line = f.readline()
+        if line and line.split('\t', 1)[0] < key:
+            lo = mid + 1
+        else:
+            hi = mid
+    if lo:
+        f.seek(lo - 1)
+        f.readline()
+    else:
+        f.seek(0)
+    line = f.readline()
+    if line.split('\t', 1)[0] == key:
+        return line
+    return None
+
+def lookup(path, fp):
+    """
+    Find the user and key line with fingerprint ``fp`` in the index at
+    ``path``.
+
+    Returns ``(user, key)`` or ``None``.
+    """
+    try:
+        f = file(path)
+    except IOError, e:
+        if e.errno == errno.ENOENT:
+            log.warning('No SSH key index at %r', path)
+            return None
+        raise
+    try:
+        line = _findLine(f, fp)
+    finally:
+        f.close()
+    if line is None:
+        return None
+    (fp, user, key) = line.rstrip('\n').split('\t', 2)
+    return (user, key)
+
+class Main(app.App):
+    def create_parser(self):
+        parser = super(Main, self).create_parser()
+        parser.set_usage('%prog [OPTS] FINGERPRINT\n'
+                         + '       %prog [OPTS] KEYTYPE KEY')
+        parser.set_description(
+            'Print the authorized_keys line for an SSH key,'
+            +' for sshd AuthorizedKeysCommand')
+        return parser
+
+    def create_config(self, options):
+        # every login runs this, and only needs the [gitosis] section
+        return lazyconfig.LazyConfigParser()
+
+    def handle_args(self, parser, cfg, options, args):
+        if len(args) == 1:
+            fp = args[0]
+        elif len(args) == 2:
+            try:
+                fp = fingerprint(args[1])
+            except TypeError:
+                parser.error('Malformed key.')
+        else:
+            parser.error('Missing argument FINGERPRINT.')
+
+        found = lookup(util.getSSHKeyIndexPath(config=cfg), fp)
+        if found is None:
+            log.info('Unknown SSH key %s', fp)
+            return
+        (user, key) = found
+        print ssh.TEMPLATE % dict(user=user, key=key)
@@ -0,0 +1,278 @@
+"""
+Lazily parsed ``gitosis.conf``.
+
+Every SSH connection reads the configuration, but an access check
+only ever looks at a handful of sections. ``LazyConfigParser``
+memory-maps the file, finds the byte offsets of all section headers
+and parses a section only when it is first asked for.
+
+The offset index is cached next to the configuration file (as
+``gitosis.conf.index``), so that usually a connection does not even
+have to scan the file for section headers.
+"""
+
+import errno
+import hashlib
+import logging
+import marshal
+import mmap
+import os
+import re
+
+from cStringIO import StringIO
+from ConfigParser import RawConfigParser, DEFAULTSECT
+
+log = logging.getLogger('gitosis.lazyconfig')
+
+INDEX_VERSION = 1
+
+# same as RawConfigParser.SECTCRE, but anchored to the start of a line
+# and not allowed to span lines
+_SECTION_RE = re.compile(r'^\[(?P<header>[^]\n]+)\]', re.MULTILINE)
+
+def index_path(path):
+    """
+    Where to cache the section index for the config file at ``path``.
+    """
+    return os.path.realpath(path) + '.index'
+
+def _stat_key(st):
+    # the ctime catches a same-size rewrite in place within the
+    # resolution of the mtime, or with the mtime set back
+    return (st.st_size, st.st_mtime, st.st_ctime, st.st_ino)
+
+def build_index(data):
+    """
+    Find the sections in ``data``.
+
+    Returns a tuple of the section names in file order and a
+    dictionary mapping each name to a list of ``(start, end)`` byte
+    ranges; a section may be split over several ranges if its header
+    is repeated. Text before the first section header is recorded
+    under ``None``.
+    """
+    order = []
+    spans = {}
+    headers = [(m.start(), m.group('header'))
+               for m in _SECTION_RE.finditer(data)]
+    headers.append((len(data), None))
+
+    if headers[0][0] > 0:
+        spans[None] = [(0, headers[0][0])]
+    for i in xrange(len(headers) - 1):
+        (start, name) = headers[i]
+        end = headers[i + 1][0]
+        if name not in spans:
+            order.append(name)
+            spans[name] = []
+        spans[name].append((start, end))
+    return (tuple(order), spans)
+
+def _read_index(path, key):
+    try:
+        f = file(index_path(path), 'rb')
+    except (IOError, OSError), e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise
+    try:
+        try:
+            cached = marshal.load(f)
+        except (EOFError, ValueError, TypeError):
+            return None
+    finally:
+        f.close()
+    try:
+        (version, cached_key, digest, order, spans) = cached
+    except (TypeError, ValueError):
+        return None
+    if version != INDEX_VERSION or tuple(cached_key) != key:
+        return None
+    return (digest, order, spans)
+
+def _write_index(path, key, digest, order, spans):
+    dst = index_path(path)
+    tmp = '%s.%d.tmp' % (dst, os.getpid())
+    try:
+        f = file(tmp, 'wb')
+        try:
+            marshal.dump((INDEX_VERSION, key, digest, order, spans), f)
+        finally:
+            f.close()
+        os.rename(tmp, dst)
+    except (IOError, OSError), e:
+        # caching is only an optimization; the config directory
+        # may well not be writable by us
+        log.debug('Cannot cache section index in %r: %s', dst, e)
+
+def fingerprint(path):
+    """
+    Fingerprint of the config file at ``path``, as later seen in
+    ``LazyConfigParser.fingerprint`` when reading it.
+
+    Always hashes the contents, never trusting the cached section
+    index, so that whatever is stamped with it matches the file.
+    """
+    f = file(path)
+    try:
+        data = f.read()
+    finally:
+        f.close()
+    return hashlib.sha1(data).hexdigest()
+
+class LazyConfigParser(RawConfigParser):
+    """
+    A ``RawConfigParser`` that parses sections on first access.
+
+    Only ``readfp`` with a real file is lazy; any other way of
+    reading configuration (``read``, or ``readfp`` with e.g. a
+    ``StringIO``) first parses everything read so far and then
+    behaves exactly like ``RawConfigParser``.
+
+    ``generation`` counts the changes made to it, including reading
+    more configuration; parsing a section on first access is not a
+    change.
+    """
+
+    def __init__(self, *a, **kw):
+        RawConfigParser.__init__(self, *a, **kw)
+        self._data = None
+        self._fpname = None
+        self._order = ()
+        self._pending = {}
+        self.fingerprint = None
+        self.generation = 0
+
+    def readfp(self, fp, filename=None):
+        if filename is None:
+            try:
+                filename = fp.name
+            except AttributeError:
+                filename = '<???>'
+        try:
+            fileno = fp.fileno()
+        except AttributeError:
+            fileno = None
+        if fileno is None or self._data is not None:
+            RawConfigParser.readfp(self, fp, filename)
+            return
+        self._open(fileno, filename)
+
+    def _open(self, fileno, filename):
+        self.generation += 1
+        st = os.fstat(fileno)
+        if st.st_size == 0:
+            # mmap refuses empty files, and there is nothing to index
+            self.fingerprint = hashlib.sha1().hexdigest()
+            return
+
+        data = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        key = _stat_key(st)
+        cached = None
+        if filename != '<???>':
+            cached = _read_index(filename, key)
+        if cached is not None:
+            (digest, order, spans) = cached
+        else:
+            log.debug('Indexing sections of %r', filename)
+            digest = hashlib.sha1(data).hexdigest()
+            (order, spans) = build_index(data)
+            if filename != '<???>':
+                _write_index(filename, key, digest, order, spans)
+
+        self._data = data
+        self._fpname = filename
+        self.fingerprint = digest
+        self._order = order
+        self._pending = dict(spans)
+
+        # text before the first header may only be comments, which
+        # the scratch parser will check for us; [DEFAULT] applies to
+        # every section, so it cannot wait
+        if None in self._pending:
+            self._parse(None)
+        if DEFAULTSECT in self._pending:
+            self._parse(DEFAULTSECT)
+
+    def _parse(self, section):
+        spans = self._pending.pop(section)
+        text = ''.join([self._data[start:end] for (start, end) in spans])
+        scratch = RawConfigParser(dict_type=self._dict)
+        scratch.optionxform = self.optionxform
+        scratch._read(StringIO(text), self._fpname)
+        if section is None:
+            return
+        if section == DEFAULTSECT:
+            self._defaults.update(scratch._defaults)
+            return
+        parsed = scratch._sections[section]
+        if section in self._sections:
+            # added by hand before it was ever looked at; whatever is
+            # in the file comes first, just like with readfp
+            parsed.update(self._sections[section])
+        self._sections[section] = parsed
+
+    def _load(self, section):
+        if section in self._pending:
+            self._parse(section)
+
+    def _loadAll(self):
+        for section in self._order:
+            self._load(section)
+
+    def sections(self):
+        names = [s for s in self._order
+                 if s != DEFAULTSECT
+                 and (s in self._pending or s in self._sections)]
+        seen = set(self._order)
+        names.extend([s for s in self._sections if s not in seen])
+        return names
+
+    def has_section(self, section):
+        return (section in self._pending and section != DEFAULTSECT
+                or RawConfigParser.has_section(self, section))
+
+    def add_section(self, section):
+        self._load(section)
+        RawConfigParser.add_section(self, section)
+        self.generation += 1
+
+    def options(self, section):
+        self._load(section)
+        return RawConfigParser.options(self, section)
+
+    def get(self, section, option):
+        self._load(section)
+        return RawConfigParser.get(self, section, option)
+
+    def items(self, section):
+        self._load(section)
+        return RawConfigParser.items(self, section)
+
+    def has_option(self, section, option):
+        self._load(section)
+        return RawConfigParser.has_option(self, section, option)
+
+    def set(self, section, option, value=None):
+        self._load(section)
+        RawConfigParser.set(self, section, option, value)
+        self.generation += 1
+
+    def remove_option(self, section, option):
+        self._load(section)
+        self.generation += 1
+        return RawConfigParser.remove_option(self, section, option)
+
+    def remove_section(self, section):
+        self._load(section)
+        self.generation += 1
+        return RawConfigParser.remove_section(self, section)
+
+    def write(self, fp):
+        self._loadAll()
+        RawConfigParser.write(self, fp)
+
+    def _read(self, fp, fpname):
+        self._loadAll()
+        RawConfigParser._read(self, fp, fpname)
+        self.generation += 1
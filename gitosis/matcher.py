@@ -0,0 +1,175 @@
+"""
+Compiled repository name patterns.
+
+Repository lists in ``gitosis.conf`` (``writable``, ``readonly``,
+...) may contain ``fnmatch`` patterns. Instead of calling ``fnmatch``
+once per pattern for every access check, a ``PatternMatcher`` sorts
+the patterns into
+
+- plain names, kept in a set,
+
+- names followed by ``*`` only (``squee-*``, ``team/*``), kept in a
+  prefix trie,
+
+- everything else, combined into a few big regular expressions,
+
+and gives exactly the same answers as ``fnmatch.fnmatch`` would.
+"""
+
+import bisect
+import fnmatch
+import os
+import re
+
+_MAGIC = re.compile(r'[*?[]')
+
+# end of pattern marker in the prefix trie; not a string, so it cannot
+# collide with a character of a pattern
+_END = None
+
+# compiling one huge alternation gets slow fast, so split it up
+_REGEX_CHUNK = 500
+
+def _regex_body(pattern):
+    """
+    ``fnmatch.translate``, without the end anchor and flags, so that
+    several patterns can be combined into one regular expression.
+    """
+    res = fnmatch.translate(pattern)
+    suffix = '\\Z(?ms)'
+    assert res.endswith(suffix), \
+           'unexpected fnmatch translation: %r' % res
+    return res[:-len(suffix)]
+
+class PatternMatcher(object):
+    """
+    Match names against a list of ``fnmatch`` patterns.
+    """
+
+    def __init__(self, patterns):
+        self.literals = set()
+        self.trie = {}
+        self.regexes = []
+
+        rest = []
+        for pattern in patterns:
+            # fnmatch does this too; a no-op everywhere but Windows
+            pattern = os.path.normcase(pattern)
+            if not _MAGIC.search(pattern):
+                self.literals.add(pattern)
+                continue
+            prefix = pattern.rstrip('*')
+            if not _MAGIC.search(prefix):
+                self._add_prefix(prefix)
+                continue
+            rest.append(pattern)
+
+        for i in xrange(0, len(rest), _REGEX_CHUNK):
+            chunk = rest[i:i+_REGEX_CHUNK]
+            self.regexes.append(re.compile(
+                '(?ms)(?:%s)\\Z' % '|'.join([_regex_body(p) for p in chunk])))
+
+    def _add_prefix(self, prefix):
+        node = self.trie
+        for c in prefix:
+            node = node.setdefault(c, {})
+        node[_END] = True
+
+    def _match_prefix(self, name):
+        node = self.trie
+        if _END in node:
+            return True
+        for c in name:
+            node = node.get(c)
+            if node is None:
+                return False
+            if _END in node:
+                return True
+        return False
+
+    def match(self, name):
+        """
+        Does ``name`` match any of the patterns?
+        """
+        name = os.path.normcase(name)
+        if name in self.literals:
+            return True
+        if self.trie and self._match_prefix(name):
+            return True
+        for regex in self.regexes:
+            if regex.match(name):
+                return True
+        return False
+
+_cache = {}
+_CACHE_SIZE = 1024
+
+def compileOption(value):
+    """
+    Get a ``PatternMatcher`` for the whitespace separated patterns in
+    the config option value ``value``.
+
+    Matchers are cached by value, so each distinct repository list is
+    compiled only once.
+    """
+    try:
+        return _cache[value]
+    except KeyError:
+        pass
+    if len(_cache) >= _CACHE_SIZE:
+        _cache.clear()
+    m = PatternMatcher(value.split())
+    _cache[value] = m
+    return m
+
+def isPattern(name):
+    """
+    Does ``name`` contain any ``fnmatch`` special characters?
+    """
+    return _MAGIC.search(name) is not None
+
+def expandPatterns(patterns, names):
+    """
+    Match every one of ``patterns`` against all of ``names``.
+
+    Patterns are grouped by their literal prefix (the part before the
+    first special character), and each group is only compared against
+    the names sharing that prefix, found by bisecting the sorted
+    names.
+
+    Returns a dict mapping each pattern to the sorted list of names
+    it matches.
+    """
+    names = sorted(set([os.path.normcase(name) for name in names]))
+
+    by_prefix = {}
+    for pattern in patterns:
+        normal = os.path.normcase(pattern)
+        match = _MAGIC.search(normal)
+        if match is None:
+            prefix = normal
+        else:
+            prefix = normal[:match.start()]
+        by_prefix.setdefault(prefix, []).append((pattern, normal))
+
+    found = {}
+    for (prefix, group) in by_prefix.iteritems():
+        start = bisect.bisect_left(names, prefix)
+        end = start
+        while end < len(names) and names[end].startswith(prefix):
+            end += 1
+        candidates = names[start:end]
+
+        for (pattern, normal) in group:
+            rest = normal[len(prefix):]
+            if not rest:
+                # a literal name
+                hits = [name for name in candidates if name == normal]
+            elif not rest.strip('*'):
+                # only stars left, anything with the prefix matches
+                hits = candidates
+            else:
+                regex = re.compile(fnmatch.translate(normal))
+                hits = [name for name in candidates if regex.match(name)]
+            found[pattern] = hits
+    return found
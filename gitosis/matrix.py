@@ -0,0 +1,284 @@
+"""
+Who can access what, for all users and repositories at once.
+
+Generating ``.htaccess`` files, ``git-daemon-export-ok`` flags or
+repository listings used to ask the access code the same questions
+over and over. An ``AccessMatrix`` reads the configuration once,
+numbers users, ``@group`` references and repositories, and keeps
+
+- per principal (user or ``@group``), the repositories it is granted,
+
+- per repository, once a column is asked for, the principals granted
+  it,
+
+- per group, once asked for, all its members, including nested
+  groups,
+
+as integer bitsets, so that any row or column of the matrix is a
+handful of big integer operations.
+
+Only ``readonly`` and ``writable`` are told apart; ``writeable``
+counts as ``writable``. Repository names are the literal names and
+``map`` targets from the config, as in ``access.getAccessTable``,
+with ``@alias`` references expanded (see ``gitosis.alias``). Grants
+given as patterns are expanded against a list of repository
+names, typically the ones on disk, if there is one.
+"""
+
+import logging
+import os
+
+from gitosis import alias
+from gitosis import group
+from gitosis import matcher
+
+log = logging.getLogger('gitosis.matrix')
+
+MODES = ['readonly', 'writable']
+
+# config option to matrix mode
+_OPTIONS = {
+    'readonly': 'readonly',
+    'writable': 'writable',
+    'writeable': 'writable',
+    }
+
+USER_PREFIX = 'user '
+GROUP_PREFIX = 'group '
+REPO_PREFIX = 'repo '
+
+def _bits(n):
+    """
+    List the indexes of the bits set in ``n``.
+    """
+    found = []
+    s = bin(n)[:1:-1]
+    i = s.find('1')
+    while i != -1:
+        found.append(i)
+        i = s.find('1', i+1)
+    return found
+
+class _Interned(object):
+    """
+    Names numbered in the order they were first seen.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+
+    def intern(self, name):
+        try:
+            return self.ids[name]
+        except KeyError:
+            i = len(self.names)
+            self.ids[name] = i
+            self.names.append(name)
+            return i
+
+    def bitset(self, names):
+        bits = 0
+        for name in names:
+            bits |= 1 << self.intern(name)
+        return bits
+
+    def lookup(self, bits):
+        return [self.names[i] for i in _bits(bits)]
+
+class AccessMatrix(object):
+    """
+    The access matrix of ``config``, as it was when the matrix was
+    built.
+
+    :type config: RawConfigParser
+
+    :param repos: repository names to expand pattern grants against;
+      if not given, patterns are taken as literal names. Only gone
+      through if there are patterns, so it may be a generator walking
+      the repositories on disk.
+
+    :param visible: have ``map`` options grant the name users ask
+      for, instead of the repository it maps to, as a listing for
+      users should
+    """
+
+    def __init__(self, config, repos=None, visible=False):
+        self.config = config
+        self.candidates = repos
+        self.visible = visible
+        self.principals = _Interned()
+        self.repos = _Interned()
+        # mode -> principal id -> repository bitset
+        self.rows = dict([(mode, {}) for mode in MODES])
+        # mode -> repository id -> principal bitset, on first use
+        self.columns = None
+        # group name -> bitset of all its members, filled on demand
+        self.closure = {}
+        self.membership = group.getMembershipIndex(config)
+        self._build()
+
+    def _build(self):
+        aliases = alias.getAliasTable(self.config)
+        sections = []
+        patterns = set()
+        for sectname in self.config.sections():
+            if sectname.startswith(USER_PREFIX):
+                principal = sectname[len(USER_PREFIX):]
+            elif sectname.startswith(GROUP_PREFIX):
+                principal = '@' + sectname[len(GROUP_PREFIX):]
+            elif sectname.startswith(REPO_PREFIX):
+                self.repos.intern(sectname[len(REPO_PREFIX):])
+                continue
+            else:
+                continue
+
+            grants = dict([(mode, []) for mode in MODES])
+            for (option, value) in self.config.items(sectname):
+                if option in _OPTIONS:
+                    grants[_OPTIONS[option]].extend(
+                        aliases.expandWords(value.split()))
+                elif option.startswith('map '):
+                    words = option.split(None, 2)
+                    if len(words) == 3 and words[1] in _OPTIONS:
+                        if self.visible:
+                            name = words[2]
+                        else:
+                            name = value
+                        grants[_OPTIONS[words[1]]].append(name)
+
+            if self.candidates is not None:
+                for mode in MODES:
+                    for name in grants[mode]:
+                        if matcher.isPattern(name):
+                            patterns.add(name)
+            sections.append((principal, grants))
+
+        # all patterns are matched at once, see matcher.expandPatterns
+        matches = {}
+        if patterns:
+            matches = matcher.expandPatterns(patterns, self.candidates)
+
+        for (principal, grants) in sections:
+            pid = self.principals.intern(principal)
+            for mode in MODES:
+                if not grants[mode]:
+                    continue
+                names = []
+                for name in grants[mode]:
+                    if name in matches:
+                        names.extend(matches[name])
+                    else:
+                        names.append(name)
+                bits = self.repos.bitset(names)
+                row = self.rows[mode]
+                row[pid] = row.get(pid, 0) | bits
+
+        log.debug('Access matrix of %d principals and %d repositories',
+                  len(self.principals.names), len(self.repos.names))
+
+    def groupClosure(self, name):
+        """
+        Get the bitset of all members of group ``name``, see
+        ``group.MembershipIndex.expand``.
+        """
+        try:
+            return self.closure[name]
+        except KeyError:
+            pass
+        bits = self.principals.bitset(self.membership.expand(name))
+        self.closure[name] = bits
+        return bits
+
+    def _repoId(self, path):
+        basename, ext = os.path.splitext(path)
+        if ext == '.git':
+            path = basename
+        return self.repos.ids.get(path)
+
+    def userRow(self, user, mode):
+        """
+        Get the bitset of repositories ``user`` is granted ``mode``
+        to, directly or through a group.
+        """
+        row = self.rows[mode]
+        principals = self.principals.ids
+        bits = 0
+        pid = principals.get(user)
+        if pid is not None:
+            bits = row.get(pid, 0)
+        for name in self.membership.getMembership(user) + ('all',):
+            pid = principals.get('@' + name)
+            if pid is not None:
+                bits |= row.get(pid, 0)
+        return bits
+
+    def listRepositories(self, user):
+        """
+        List the repositories ``user`` can access.
+
+        Returns a tuple of sorted lists of the repositories writable
+        by ``user``, and of the ones only readable.
+        """
+        writable = self.userRow(user, 'writable')
+        readonly = self.userRow(user, 'readonly') & ~writable
+        return (sorted(self.repos.lookup(writable)),
+                sorted(self.repos.lookup(readonly)))
+
+    def iterRepositories(self, user):
+        """
+        Generate ``(mode, name)`` for the repositories ``user`` can
+        access, like ``listRepositories`` but without sorting: the
+        writable ones first, then the ones only readable, each in no
+        particular order.
+        """
+        writable = self.userRow(user, 'writable')
+        readonly = self.userRow(user, 'readonly') & ~writable
+        for (mode, bits) in [('writable', writable), ('readonly', readonly)]:
+            for i in _bits(bits):
+                yield (mode, self.repos.names[i])
+
+    def _transpose(self):
+        # only as much work as there are grants
+        self.columns = dict([(mode, {}) for mode in MODES])
+        for mode in MODES:
+            columns = self.columns[mode]
+            for (pid, bits) in self.rows[mode].iteritems():
+                pbit = 1 << pid
+                for rid in _bits(bits):
+                    columns[rid] = columns.get(rid, 0) | pbit
+
+    def repoColumn(self, path, modes=MODES):
+        """
+        Get the bitset of principals granted any of ``modes`` to
+        ``path`` directly.
+        """
+        rid = self._repoId(path)
+        if rid is None:
+            return 0
+        if self.columns is None:
+            self._transpose()
+        bits = 0
+        for mode in modes:
+            bits |= self.columns[mode].get(rid, 0)
+        return bits
+
+    def getAllAccess(self, path, modes=MODES):
+        """
+        Like ``access.getAllAccess``: returns the users and groups
+        granted access to ``path``, and all group references and
+        users they stand for.
+        """
+        users = set()
+        groups = set()
+        refs = 0
+        for principal in self.principals.lookup(self.repoColumn(path, modes)):
+            if principal.startswith('@'):
+                name = principal[1:]
+                groups.add(name)
+                refs |= (1 << self.principals.ids[principal]) \
+                        | self.groupClosure(name)
+            else:
+                users.add(principal)
+        all_refs = set(self.principals.lookup(refs))
+        return (users, groups, all_refs)
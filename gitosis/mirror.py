@@ -7,6 +7,7 @@ from ConfigParser import NoOptionError, NoSectionError
 import os
 import logging
 
+from gitosis import alias
 from gitosis import repository
 from gitosis import util
 
@@ -68,11 +69,12 @@ def get_mirrors(config, git_name):
     except (NoSectionError, NoOptionError):
         pass
     
+    aliases = alias.getAliasTable(config)
     mirror_sections = (s for s in config.sections() if s.startswith('mirror '))
     for section in mirror_sections:
         try:
             repos = config.get(section, 'repos')
-            if repos == '@all' or git_name in repos.split():
+            if repos == '@all' or git_name in aliases.expandWords(repos.split()):
                 yield config.get(section, 'uri').strip() % git_name
         except NoOptionError:
             log.error('%s section is lacking the "repos" or "uri" settings.', section)
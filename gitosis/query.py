@@ -0,0 +1,116 @@
+"""
+Answer access queries in bulk, for external tools.
+
+``gitosis-access-query`` loads ``gitosis.conf`` once and reads
+queries from standard input, one per line::
+
+	USER MODE PATH
+
+where ``MODE`` is ``readonly``, ``writable`` or ``writeable``, and
+answers each on a line of its own on standard output, with tab
+separated fields:
+
+- ``ok``, the toplevel directory and the relative path of the
+  repository, as returned by ``access.haveAccess``
+
+- ``deny``
+
+- ``error`` and a message, for lines that are not a valid query
+
+As with ``access.haveAccess``, read access needs checking for write
+access too. Answers are written as soon as all the queries read so
+far are answered, so a client can also send one query at a time and
+wait for the answer.
+"""
+
+import errno
+import logging
+import os
+import sys
+
+from gitosis import access
+from gitosis import app
+
+log = logging.getLogger('gitosis.query')
+
+MODES = ['readonly', 'writable', 'writeable']
+
+# the same questions tend to come again and again
+CACHE_SIZE = 100000
+
+READ_SIZE = 65536
+
+def answer(checker, line, cache=None):
+    """
+    Answer the query ``line``, without the trailing newline.
+
+    :type checker: access.AccessChecker
+    :param cache: dict to remember answers in
+    """
+    if cache is not None:
+        try:
+            return cache[line]
+        except KeyError:
+            pass
+
+    words = line.split(' ', 2)
+    if len(words) != 3:
+        return 'error\texpected USER MODE PATH'
+    (user, mode, path) = words
+    if mode not in MODES:
+        return 'error\tunknown mode %r' % mode
+
+    newpath = checker.haveAccess(
+        user=user,
+        mode=mode,
+        path=path,
+        )
+    if newpath is None:
+        result = 'deny'
+    else:
+        result = 'ok\t%s\t%s' % newpath
+
+    if cache is not None:
+        if len(cache) >= CACHE_SIZE:
+            cache.clear()
+        cache[line] = result
+    return result
+
+def answer_all(config, infd, outfp):
+    """
+    Answer the queries read from file descriptor ``infd`` on
+    ``outfp``, until end of file.
+    """
+    checker = access.AccessChecker(config)
+    cache = {}
+    pending = ''
+    while True:
+        try:
+            data = os.read(infd, READ_SIZE)
+        except OSError, e:
+            if e.errno == errno.EINTR:
+                continue
+            raise
+        if not data:
+            break
+        lines = (pending + data).split('\n')
+        pending = lines.pop()
+        outfp.write(''.join([answer(checker, line, cache) + '\n'
+                             for line in lines]))
+        outfp.flush()
+
+    if pending:
+        outfp.write(answer(checker, pending, cache) + '\n')
+        outfp.flush()
+
+class Main(app.App):
+    def create_parser(self):
+        parser = super(Main, self).create_parser()
+        parser.set_usage('%prog [OPTS]')
+        parser.set_description(
+            'Answer "USER MODE PATH" access queries read from stdin')
+        return parser
+
+    def handle_args(self, parser, cfg, options, args):
+        super(Main, self).handle_args(parser, cfg, options, args)
+        answer_all(cfg, sys.stdin.fileno(), sys.stdout)
@@ -188,6 +188,149 @@ def export(git_dir, path):
     if returncode != 0:
         raise GitCheckoutIndexError('exit status %d' % returncode)
 
+class GitCatFileError(GitError):
+    """git cat-file failed"""
+
+# file modes of blobs in trees; symlinks and submodules are left out
+BLOB_MODES = ['100644', '100755']
+
+def parse_tree(data):
+    """
+    Parse the raw contents of a tree object.
+
+    Returns a list of ``(mode, name, sha1)``.
+    """
+    entries = []
+    pos = 0
+    while pos < len(data):
+        space = data.index(' ', pos)
+        nul = data.index('\0', space)
+        entries.append((
+                data[pos:space],
+                data[space+1:nul],
+                data[nul+1:nul+21].encode('hex'),
+                ))
+        pos = nul + 21
+    return entries
+
+class CatFile(object):
+    """
+    Read objects from ``git_dir`` through one ``git cat-file --batch``
+    process, without checking anything out.
+    """
+
+    # keep the requests written ahead of reading the answers well
+    # within a pipe buffer, so neither side blocks the other
+    BATCH = 1000
+
+    def __init__(self, git_dir):
+        self.child = subprocess.Popen(
+            args=[
+                'git',
+                '--git-dir=%s' % git_dir,
+                'cat-file',
+                '--batch',
+                ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            close_fds=True,
+            bufsize=-1,
+            )
+
+    def _answer(self):
+        header = self.child.stdout.readline()
+        if not header.endswith('\n'):
+            raise GitCatFileError('unexpected end of output')
+        words = header.split()
+        if len(words) == 2 and words[1] in ['missing', 'ambiguous']:
+            return None
+        try:
+            (sha1, type_, size) = words
+            size = int(size)
+        except ValueError:
+            raise GitCatFileError('bad header: %r' % header)
+        data = self.child.stdout.read(size)
+        if len(data) != size or self.child.stdout.read(1) != '\n':
+            raise GitCatFileError('unexpected end of output')
+        return (sha1, type_, data)
+
+    def readMany(self, names):
+        """
+        Read the objects ``names`` name, such as ``HEAD:gitosis.conf``
+        or a sha1.
+
+        Returns a list of ``(sha1, type, data)``, with ``None`` for the
+        names that do not name an object.
+        """
+        found = []
+        for start in xrange(0, len(names), self.BATCH):
+            batch = names[start:start+self.BATCH]
+            for name in batch:
+                if '\n' in name:
+                    raise ValueError('newline in object name: %r' % name)
+            self.child.stdin.write(''.join(['%s\n' % name for name in batch]))
+            self.child.stdin.flush()
+            for name in batch:
+                found.append(self._answer())
+        return found
+
+    def read(self, name):
+        """
+        Read the object ``name``; see ``readMany``.
+        """
+        return self.readMany([name])[0]
+
+    def readTree(self, name):
+        """
+        List the entries of tree ``name``; see ``parse_tree``.
+
+        A missing tree has no entries.
+        """
+        found = self.read(name)
+        if found is None:
+            return []
+        (sha1, type_, data) = found
+        if type_ != 'tree':
+            raise GitCatFileError('not a tree: %r' % name)
+        return parse_tree(data)
+
+    def close(self):
+        self.child.stdin.close()
+        self.child.stdout.close()
+        returncode = self.child.wait()
+        if returncode != 0:
+            raise GitCatFileError('exit status %d' % returncode)
+
+# the old or new id of a ref that is created or deleted
+NULL_SHA1 = '0' * 40
+
+class GitSymbolicRefError(GitError):
+    """git symbolic-ref failed"""
+
+def head_ref(git_dir):
+    """
+    Get the ref ``HEAD`` points to, or ``None`` if it is detached.
+    """
+    child = subprocess.Popen(
+        args=[
+            'git',
+            '--git-dir=.',
+            'symbolic-ref',
+            '-q',
+            'HEAD',
+            ],
+        cwd=git_dir,
+        stdout=subprocess.PIPE,
+        close_fds=True,
+        )
+    got = child.stdout.read()
+    returncode = child.wait()
+    if returncode == 1:
+        return None
+    if returncode != 0:
+        raise GitSymbolicRefError('exit status %d' % returncode)
+    return got.rstrip('\n')
+
 class GitHasInitialCommitError(GitError):
     """Check for initial commit failed"""
 
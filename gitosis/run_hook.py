@@ -4,77 +4,441 @@ Perform gitosis actions for a git hook.
 from ConfigParser import NoOptionError, NoSectionError
 
 import errno
+import functools
 import logging
 import os
 import sys
 import shutil
+from cStringIO import StringIO
 
+from gitosis import accesscache
+from gitosis import confdiff
 from gitosis import repository
 from gitosis import ssh
+from gitosis import sshca
+from gitosis import generate
 from gitosis import gitweb
 from gitosis import gitdaemon
+from gitosis import keyindex
 from gitosis import htaccess
+from gitosis import inventory
 from gitosis import app
+from gitosis import lazyconfig
+from gitosis import shard
+from gitosis import spool
 from gitosis import util
 from gitosis import group
 from gitosis import mirror
 from gitosis import serve
 
-def autoinit_repos(config):
+def autoinit_repos(config, inventory=None):
+    """
+    Create the repositories that have a repo section in the config but
+    do not exist yet, if ``init-on-config`` says so.
+
+    Returns how many were created.
+
+    :param inventory: see ``gitweb.repo_exists``
+    """
+    log = logging.getLogger('gitosis.run_hook.autoinit_repos')
     do_init = util.getConfigDefaultBoolean(config, 'gitosis', 'init-on-config', False)
     if not do_init:
-        return
+        return 0
 
-    for (section, name, topdir, subpath) in gitweb.enum_cfg_repos(config):
-        if os.path.exists(os.path.join(topdir,subpath)):
+    created = 0
+    for (section, name, topdir, subpath) in gitweb.enum_cfg_repos(config, inventory):
+        if gitweb.repo_exists(topdir, subpath, inventory):
             continue
 
         try:
             serve.auto_init_repo(config,topdir,subpath)
-        except GitInitError, e:
+        except repository.GitInitError, e:
             log.warning('Auto-init failed: %r' % e)
-        except GitError, e:
+        except repository.GitError, e:
             log.warning('Git error in init: %r' % e)
+        else:
+            created += 1
+    return created
+
+
+class ConfigMissingError(repository.GitError):
+    """gitosis.conf missing from gitosis-admin"""
+
+def _read_config(path):
+    """
+    Read ``path`` into a fresh config, or return ``None`` if there is
+    no such file.
+
+    The config counts its changes, so membership and aliases are
+    worked out once for all the stages (see
+    ``util.getConfigGeneration``).
+    """
+    cfg = lazyconfig.LazyConfigParser()
+    try:
+        f = file(path)
+    except IOError, e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise
+    try:
+        # parsed right away, the stages share it between threads
+        cfg.readfp(StringIO(f.read()), path)
+    finally:
+        f.close()
+    return cfg
+
+def post_update(cfg, git_dir, full=False, updates=None):
+    """
+    Regenerate everything derived from the pushed ``gitosis-admin``.
 
+    Unless ``full`` is set, repository descriptions, export flags,
+    ``.htaccess`` files and the project and group lists are only
+    regenerated as far as the change from the previous
+    ``gitosis.conf`` calls for (see ``gitosis.confdiff``).
 
-def post_update(cfg, git_dir):
-    export = os.path.join(git_dir, 'gitosis-export')
+    :param updates: the ``(old, new, ref)`` of the push, as a
+      ``post-receive`` hook reads them; when given, what the push did
+      not change in ``HEAD`` is not regenerated
+    """
+    log = logging.getLogger('gitosis.run_hook.post_update')
+    catfile = repository.CatFile(git_dir)
     try:
-        shutil.rmtree(export)
+        changed = None
+        if updates and not full:
+            changed = _changed_by_push(git_dir, catfile, updates)
+        if changed is not None and not changed & set(['gitosis.conf',
+                                                     'keydir']):
+            log.info('Push changed neither gitosis.conf nor keydir,'
+                     + ' skipping regeneration')
+            return
+        _post_update(cfg, git_dir, catfile, full, changed)
+    finally:
+        catfile.close()
+
+def read_updates(fp):
+    """
+    Read the ``old new ref`` lines a ``post-receive`` hook gets.
+    """
+    updates = []
+    for line in fp:
+        words = line.split()
+        if len(words) == 3:
+            updates.append(tuple(words))
+    return updates
+
+def hook_updates(hook, fp):
+    """
+    Get the updates of the push for ``hook``: read from ``fp`` for
+    ``post-receive``, unknown (``None``) for ``post-update``, which
+    gets none.
+    """
+    if hook == 'post-receive':
+        return read_updates(fp)
+    return None
+
+def changed_paths(catfile, old, new):
+    """
+    List the toplevel entries that differ between the trees of
+    commits ``old`` and ``new``.
+    """
+    trees = []
+    for commit in [old, new]:
+        trees.append(dict([(name, (mode, sha1)) for (mode, name, sha1)
+                           in catfile.readTree('%s^{tree}' % commit)]))
+    (before, after) = trees
+    return set([name for name in set(before) | set(after)
+                if before.get(name) != after.get(name)])
+
+def _changed_by_push(git_dir, catfile, updates):
+    """
+    Find what the push ``updates`` changed in ``HEAD``.
+
+    ``updates`` may be those of several pushes, oldest first (see
+    ``spool.coalesce``); they are taken together, from the oldest
+    ``old`` to the newest ``new``.
+
+    Returns a set of toplevel paths, or ``None`` if everything has to
+    be considered changed.
+    """
+    log = logging.getLogger('gitosis.run_hook.post_update')
+    head = repository.head_ref(git_dir)
+    found = [(old, new) for (old, new, ref) in updates if ref == head]
+    if not found:
+        log.info('Push did not update %s, skipping regeneration', head)
+        return set()
+    old = found[0][0]
+    new = found[-1][1]
+    if new == repository.NULL_SHA1:
+        log.info('Push deleted %s, skipping regeneration', head)
+        return set()
+    if old == repository.NULL_SHA1:
+        return None
+    changed = changed_paths(catfile, old, new)
+    log.debug('Push changed %r', sorted(changed))
+    return changed
+
+def _write_config(git_dir, catfile):
+    """
+    Write ``gitosis.conf`` of ``HEAD`` to ``git_dir``.
+    """
+    found = catfile.read('HEAD:gitosis.conf')
+    if found is None:
+        raise ConfigMissingError(git_dir)
+    (sha1, type_, data) = found
+    path = os.path.join(git_dir, 'gitosis.conf')
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    f = file(tmp, 'w')
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    os.rename(tmp, path)
+
+def _with_settings(cfg, config):
+    """
+    Add to ``config`` the ``[gitosis]`` settings of ``cfg`` that it
+    does not set itself, e.g. where the repositories are.
+
+    Nothing else of what ``cfg`` holds carries over, so that whatever
+    a push removed from ``gitosis.conf``, like a grant, is gone.
+    """
+    if cfg.has_section('gitosis'):
+        if not config.has_section('gitosis'):
+            config.add_section('gitosis')
+        for (name, value) in cfg.items('gitosis'):
+            if not config.has_option('gitosis', name):
+                config.set('gitosis', name, value)
+    return config
+
+def _post_update(cfg, git_dir, catfile, full, changed):
+    log = logging.getLogger('gitosis.run_hook.post_update')
+    # checked out by older versions; everything is now read straight
+    # from the git objects
+    try:
+        shutil.rmtree(os.path.join(git_dir, 'gitosis-export'))
     except OSError, e:
         if e.errno == errno.ENOENT:
             pass
         else:
             raise
-    repository.export(git_dir=git_dir, path=export)
-    os.rename(
-        os.path.join(export, 'gitosis.conf'),
-        os.path.join(export, '..', 'gitosis.conf'),
-        )
-    # re-read config to get up-to-date settings
-    cfg.read(os.path.join(export, '..', 'gitosis.conf'))
-    autoinit_repos(config=cfg)
-    gitweb.set_descriptions(
-        config=cfg,
-        )
+    # a push can only be trusted to have changed nothing if whatever
+    # it did not change was generated before
+    path = os.path.join(git_dir, 'gitosis.conf')
+    old = _read_config(path)
+    if old is not None:
+        _with_settings(cfg, old)
+    config_changed = (changed is None
+                      or 'gitosis.conf' in changed
+                      or old is None)
+
+    if config_changed:
+        _write_config(git_dir, catfile)
+    else:
+        log.info('gitosis.conf unchanged, skipping policy regeneration')
+    new = _read_config(path)
+    if new is None:
+        raise ConfigMissingError(path)
+    cfg = _with_settings(cfg, new)
+    fingerprint = lazyconfig.fingerprint(path)
     generated = util.getGeneratedFilesDir(config=cfg)
-    gitweb.generate_project_list(
+    stages = []
+    repositories = None
+    if config_changed:
+        repositories = inventory.RepositoryInventory(cfg)
+        stages.extend(_policy_stages(
+                cfg, old, generated, full, repositories))
+
+    util.mkdir(generated)
+    manifest = os.path.join(generated, 'keydir.manifest')
+    # [gitosis] says where the keys and their index go
+    keys_changed = (changed is None
+                    or 'keydir' in changed
+                    or not os.path.exists(manifest)
+                    or old is None
+                    or confdiff.sectionChanged(old, cfg, 'gitosis'))
+    keydir = ssh.KeyTree(catfile, 'HEAD:keydir')
+    keydir_users = ssh.keyUsers(keydir)
+    if keys_changed:
+        # not a stage: checking many keys forks a pool of processes,
+        # which must not happen while other stage threads hold locks
+        _regenerate_keys(cfg, keydir, manifest)
+    else:
+        log.info('keydir unchanged, skipping SSH key regeneration')
+
+    stages.append(functools.partial(
+        sshca.writeCAFiles,
         config=cfg,
-        path=os.path.join(generated, 'projects.list'),
-        )
-    gitdaemon.set_export_ok(
+        generated=generated,
+        keydir_users=keydir_users,
+        ))
+    stages.append(functools.partial(
+        shard.write_shards,
         config=cfg,
-        )
-    if htaccess.gen_htaccess_if_enabled(config=cfg):
-        group.generate_group_list(
+        users=keydir_users,
+        fingerprint=fingerprint,
+        ))
+    generate.Engine.fromConfig(cfg).run(stages)
+    if config_changed:
+        repositories.report()
+        accesscache.invalidate(config=cfg)
+
+def _policy_stages(cfg, old, generated, full, repositories):
+    """
+    Initialize missing repositories, and list the stages regenerating
+    what config ``cfg`` says, as far as the change from config ``old``
+    calls for.
+
+    :type repositories: gitosis.inventory.RepositoryInventory
+    """
+    log = logging.getLogger('gitosis.run_hook.post_update')
+    if autoinit_repos(config=cfg, inventory=repositories):
+        repositories.refresh()
+
+    changes = None
+    if not full and old is not None:
+        # the stages get the very config compared here
+        changes = confdiff.Changes(
+            old=old,
+            new=cfg,
+            ondisk=[name for (dirpath, repo, name)
+                    in repositories.repos],
+            )
+        if changes.full:
+            changes = None
+    if changes is None:
+        log.info('Regenerating everything')
+        repos = None
+    else:
+        repos = changes.repos
+        log.info('Regenerating for %d repositories', len(repos))
+
+    do_htaccess = util.getConfigDefaultBoolean(
+        cfg, 'gitosis', 'htaccess', False)
+    stages = []
+    if changes is None or changes.projects:
+        stages.append(functools.partial(
+            gitweb.generate_project_list,
+            config=cfg,
+            path=os.path.join(generated, 'projects.list'),
+            inventory=repositories,
+            ))
+    if repos is None or repos:
+        stages.append(functools.partial(
+            gitweb.description_tasks,
+            config=cfg,
+            repos=repos,
+            inventory=repositories,
+            ))
+        stages.append(functools.partial(
+            gitdaemon.export_ok_tasks,
+            config=cfg,
+            repos=repos,
+            inventory=repositories,
+            ))
+        if do_htaccess:
+            stages.append(functools.partial(
+                htaccess.htaccess_tasks,
+                config=cfg,
+                repos=repos,
+                inventory=repositories,
+                ))
+    if do_htaccess and (changes is None or changes.groups):
+        stages.append(functools.partial(
+            group.generate_group_list,
             config=cfg,
             path=os.path.join(generated, 'groups'),
-            )
+            ))
+    return stages
+
+def _regenerate_keys(cfg, keydir, manifest):
+    """
+    Regenerate ``authorized_keys`` and the key index from ``keydir``.
+    """
     authorized_keys = util.getSSHAuthorizedKeysPath(config=cfg)
-    ssh.writeAuthorizedKeys(
+    changed_keys = ssh.writeAuthorizedKeys(
         path=authorized_keys,
-        keydir=os.path.join(export, 'keydir'),
+        keydir=keydir,
+        manifest=manifest,
         )
+    key_index = util.getSSHKeyIndexPath(config=cfg)
+    if changed_keys or not os.path.exists(key_index):
+        util.mkdir(os.path.dirname(key_index))
+        keyindex.writeKeyIndex(
+            path=key_index,
+            keydir=keydir,
+            manifest=manifest,
+            )
+
+def regenerate_repos(cfg, repos):
+    """
+    Regenerate what changes when repositories ``repos`` come into
+    existence: the project list, and their descriptions, export flags
+    and ``.htaccess`` files.
+    """
+    repositories = inventory.RepositoryInventory(cfg)
+    generated = util.getGeneratedFilesDir(config=cfg)
+    util.mkdir(generated)
+    # [repo foo.git] is about foo too
+    repos = set(repos)
+    repos.update(['%s.git' % name for name in repos])
+    stages = [
+        functools.partial(
+            gitweb.generate_project_list,
+            config=cfg,
+            path=os.path.join(generated, 'projects.list'),
+            inventory=repositories,
+            ),
+        functools.partial(
+            gitweb.description_tasks,
+            config=cfg,
+            repos=repos,
+            inventory=repositories,
+            ),
+        functools.partial(
+            gitdaemon.export_ok_tasks,
+            config=cfg,
+            repos=repos,
+            inventory=repositories,
+            ),
+        ]
+    if util.getConfigDefaultBoolean(cfg, 'gitosis', 'htaccess', False):
+        stages.append(functools.partial(
+            htaccess.htaccess_tasks,
+            config=cfg,
+            repos=repos,
+            inventory=repositories,
+            ))
+    generate.Engine.fromConfig(cfg).run(stages)
+    repositories.report()
+
+def regenerate(request):
+    """
+    Do what the merged ``request`` of the background worker asks for,
+    see ``gitosis.spool``.
+    """
+    log = logging.getLogger('gitosis.run_hook.regenerate')
+
+    def read():
+        # read afresh, nothing of what was read before may stick
+        cfg = lazyconfig.LazyConfigParser()
+        if not cfg.read(request['config']):
+            log.warning('Cannot read config %r', request['config'])
+        return cfg
+
+    if request['git_dir'] is not None:
+        # only the [gitosis] settings of this one carry over, see
+        # post_update
+        post_update(
+            cfg=read(),
+            git_dir=request['git_dir'],
+            full=request['full'],
+            updates=request['updates'],
+            )
+    if request['repos']:
+        log.info('Regenerating for new repositories %r',
+                 request['repos'])
+        # after post_update, which may just have rewritten it
+        regenerate_repos(read(), request['repos'])
 
 def update_mirrors(cfg, git_dir):
     mirror.push_mirrors(cfg, git_dir)
@@ -86,6 +450,18 @@ class Main(app.App):
         parser.set_usage('%prog [OPTS] HOOK')
         parser.set_description(
             'Perform gitosis actions for a git hook')
+        parser.add_option('--full',
+                          action='store_true',
+                          default=False,
+                          help='regenerate everything, not just what'
+                          +' the config change affects',
+                          )
+        parser.add_option('--wait',
+                          action='store_true',
+                          default=False,
+                          help='wait for the regeneration to finish,'
+                          +' instead of leaving it to the background',
+                          )
         return parser
 
     def handle_args(self, parser, cfg, options, args):
@@ -102,10 +478,20 @@ class Main(app.App):
             log.error('Must have GIT_DIR set in enviroment')
             sys.exit(1)
 
-        if hook == 'post-update':
+        if hook in ['post-update', 'post-receive']:
             log.info('Running hook %s', hook)
-            post_update(cfg, git_dir)
-            log.info('Done.')
+            updates = hook_updates(hook, sys.stdin)
+            request = spool.makeRequest(
+                config=os.path.abspath(options.config),
+                git_dir=os.path.abspath(git_dir),
+                full=options.full,
+                updates=updates,
+                )
+            spool.submit(cfg, request, regenerate, wait=options.wait)
+            if options.wait:
+                log.info('Done.')
+            else:
+                log.info('Regenerating in the background.')
         elif hook == 'update-mirrors':
             log.info('Running hook %s', hook)
             update_mirrors(cfg, git_dir)
@@ -2,6 +2,10 @@
 Enforce git-shell to only serve allowed by access control policy.
 directory. The client should refer to them without any extra directory
 prefix. Repository names are forced to match ALLOW_RE.
+
+This runs for every single git operation over SSH, so only what the
+access decision needs is imported at module load; everything used
+only when auto-initializing a repository is imported on demand.
 """
 
 import logging
@@ -9,16 +13,14 @@ import logging
 import sys, os, re
 
 from ConfigParser import NoSectionError, NoOptionError
-from pkg_resources import resource_filename
 
 from gitosis import access
-from gitosis import repository
-from gitosis import gitweb
-from gitosis import gitdaemon
-from gitosis import htaccess
+from gitosis import accesscache
 from gitosis import app
+from gitosis import explain
+from gitosis import lazyconfig
+from gitosis import shard
 from gitosis import util
-from gitosis import group
 
 
 log = logging.getLogger('gitosis.serve')
@@ -59,7 +61,16 @@ class WriteAccessDenied(AccessDenied):
 class ReadAccessDenied(AccessDenied):
     """Repository read access denied"""
 
+class AutoInitRequired(Exception):
+    """Repository has to be created first"""
+
+    def __str__(self):
+        return '%s: %s' % (self.__doc__, ': '.join(self.args))
+
 def auto_init_repo(cfg,topdir,repopath):
+    from pkg_resources import resource_filename
+    from gitosis import repository
+
     # create leading directories
     p = topdir
 
@@ -97,30 +108,40 @@ def path_from_args(args):
 
     return match.group('path')
 
-def path_for_write(cfg, user, path):
-    # write access is always sufficient
-    newpath = access.haveAccess(
-        config=cfg,
-        user=user,
-        mode='writable',
-        path=path)
+def resolve_access(cfg, user, path, cache=None, explain=None):
+    """
+    Find the strongest access ``user`` has to ``path``.
+
+    Returns what ``access.resolveAccess`` does, remembered in
+    ``cache`` if given (see ``gitosis.accesscache``). When explaining,
+    the cache is not consulted, so there is a decision to explain.
+    """
+    resolved = None
+    hit = False
+    if cache is not None and explain is None:
+        try:
+            resolved = cache.lookup(user, path)
+            hit = True
+        except KeyError:
+            pass
 
-    if newpath is None:
-        # didn't have write access; try once more with the popular
-        # misspelling
-        newpath = access.haveAccess(
+    if not hit:
+        resolved = access.resolveAccess(
             config=cfg,
             user=user,
-            mode='writeable',
-            path=path)
-        if newpath is not None:
-            log.warning(
-                'Repository %r config has typo "writeable", '
-                +'should be "writable"',
-                path,
-                )
-
-    return newpath
+            path=path,
+            explain=explain)
+        if cache is not None:
+            cache.store(user, path, resolved)
+
+    # cached or not, the typo gets the same warning
+    if resolved is not None and resolved[0] == 'writeable':
+        log.warning(
+            'Repository %r config has typo "writeable", '
+            +'should be "writable"',
+            path,
+            )
+    return resolved
 
 def construct_path(newpath):
     (topdir, relpath) = newpath
@@ -134,7 +155,35 @@ def serve(
     cfg,
     user,
     command,
+    shard=None,
+    cache=None,
+    explain=None,
+    spool_config=None,
+    autoinit=True,
     ):
+    """
+    Check ``command`` against the access control policy and rewrite
+    it to refer to the actual repository.
+
+    Access is decided by ``shard`` if given (see ``gitosis.shard``),
+    otherwise by ``cfg`` itself. Decisions are looked up in and added
+    to ``cache``, if given (see ``gitosis.accesscache``). The decision
+    is explained to ``explain``, if given (see ``gitosis.explain``).
+
+    A repository created on the fly needs its description, export
+    flag and so on; if ``spool_config``, the path ``cfg`` was read
+    from, is given, that is left to the background worker (see
+    ``gitosis.spool``), otherwise it is done right away. Without
+    ``autoinit``, ``AutoInitRequired`` is raised instead of creating
+    the repository.
+    """
+    if shard is None:
+        acl = cfg
+    else:
+        acl = shard
+        if explain is not None:
+            explain.note('deciding by the shard for %r', user)
+
     if '\n' in command:
         raise CommandMayNotContainNewlineError()
 
@@ -163,9 +212,11 @@ def serve(
 
         path = path_from_args(args)
 
-        newpath = path_for_write(cfg=cfg, user=user, path=path)
-        if newpath is None:
+        resolved = resolve_access(cfg=acl, user=user, path=path, cache=cache,
+                                  explain=explain)
+        if resolved is None or resolved[0] == 'readonly':
             raise WriteAccessDenied()
+        (mode, newpath) = resolved
 
         (topdir, repopath) = construct_path(newpath)
 
@@ -195,26 +246,20 @@ def serve(
     path = path_from_args(args)
 
     # write access is always sufficient
-    newpath = path_for_write(
-        cfg=cfg,
+    resolved = resolve_access(
+        cfg=acl,
         user=user,
-        path=path)
-
-    if newpath is None:
-        # didn't have write access
-
-        newpath = access.haveAccess(
-            config=cfg,
-            user=user,
-            mode='readonly',
-            path=path)
+        path=path,
+        cache=cache,
+        explain=explain)
 
-        if newpath is None:
-            raise ReadAccessDenied()
+    if resolved is None:
+        raise ReadAccessDenied()
 
-        if verb in COMMANDS_WRITE:
-            # didn't have write access and tried to write
-            raise WriteAccessDenied()
+    (mode, newpath) = resolved
+    if mode == 'readonly' and verb in COMMANDS_WRITE:
+        # didn't have write access and tried to write
+        raise WriteAccessDenied()
 
     (topdir, repopath) = construct_path(newpath)
     fullpath = os.path.join(topdir, repopath)
@@ -222,21 +267,21 @@ def serve(
         # it doesn't exist on the filesystem, but the configuration
         # refers to it, we're serving a write request, and the user is
         # authorized to do that: create the repository on the fly
+        if not autoinit:
+            raise AutoInitRequired(repopath)
+        from gitosis import run_hook
+
         auto_init_repo(cfg,topdir,repopath)
-        gitweb.set_descriptions(
-            config=cfg,
-            )
-        generated = util.getGeneratedFilesDir(config=cfg)
-        gitweb.generate_project_list(
-            config=cfg,
-            path=os.path.join(generated, 'projects.list'),
-            )
-        gitdaemon.set_export_ok(
-            config=cfg,
-            )
-        htaccess.gen_htaccess_if_enabled(
-            config=cfg,
-            )
+        name = repopath[:-len('.git')]
+        if spool_config is None:
+            run_hook.regenerate_repos(cfg, [name])
+        else:
+            from gitosis import spool
+            spool.submit(
+                cfg,
+                spool.makeRequest(config=spool_config, repos=[name]),
+                run_hook.regenerate,
+                )
 
     # put the verb back together with the new path
     newcmd = "%(verb)s '%(path)s'" % dict(
@@ -251,8 +296,56 @@ class Main(app.App):
         parser.set_usage('%prog [OPTS] USER')
         parser.set_description(
             'Allow restricted git operations under DIR')
+        parser.add_option('--explain',
+                          action='store_true',
+                          default=False,
+                          help='explain the access decision on stderr'
+                          +' (also enabled by %s=1)' % explain.ENVIRON,
+                          )
         return parser
 
+    def create_config(self, options):
+        if options.explain:
+            self.explain = explain.Explainer()
+        else:
+            self.explain = explain.fromEnviron()
+        # a connection only needs a few sections out of gitosis.conf
+        return lazyconfig.LazyConfigParser()
+
+    def read_config(self, options, cfg):
+        if self.explain is None:
+            return super(Main, self).read_config(options, cfg)
+        started = self.explain.start()
+        try:
+            return super(Main, self).read_config(options, cfg)
+        finally:
+            self.explain.stop('config', started)
+
+    def ask_authd(self, cfg, user, cmd):
+        """
+        Let ``gitosis-authd`` decide, if it is running.
+
+        Returns the command to run, or ``None`` if we have to decide
+        ourselves; exits if access was denied.
+        """
+        from gitosis import authd
+
+        main_log = logging.getLogger('gitosis.serve.main')
+        try:
+            (status, payload) = authd.query(
+                authd.getSocketPath(cfg), user, cmd)
+        except authd.DaemonUnavailable, e:
+            main_log.debug('%s', e)
+            return None
+        if status == authd.DENY:
+            main_log.error('%s', payload)
+            sys.exit(1)
+        elif status == authd.OK:
+            return payload
+        else:
+            main_log.debug('Deciding locally: %s', payload)
+            return None
+
     def handle_args(self, parser, cfg, options, args):
         try:
             (user,) = args
@@ -273,7 +366,8 @@ class Main(app.App):
 
         os.chdir(os.path.expanduser('~'))
 
-        if (cmd == "snagit list-repos"):
+        if cmd.split()[:2] == ['snagit', 'list-repos']:
+            from gitosis import snagit
             try:
                 snagit.list_repos(cfg, user, cmd)
                 sys.exit(0)
@@ -281,15 +375,29 @@ class Main(app.App):
                 main_log.error('%s', e)
                 sys.exit(1)
         
-        try:
-            newcmd = serve(
-                cfg=cfg,
-                user=user,
-                command=cmd,
-                )
-        except ServingError, e:
-            main_log.error('%s', e)
-            sys.exit(1)
+        newcmd = None
+        if self.explain is None:
+            newcmd = self.ask_authd(cfg, user, cmd)
+        else:
+            self.explain.note('not asking gitosis-authd, explaining')
+        if newcmd is None:
+            try:
+                try:
+                    newcmd = serve(
+                        cfg=cfg,
+                        user=user,
+                        command=cmd,
+                        shard=shard.read_shard(cfg, user),
+                        cache=accesscache.open_cache(cfg),
+                        explain=self.explain,
+                        spool_config=os.path.abspath(options.config),
+                        )
+                except ServingError, e:
+                    main_log.error('%s', e)
+                    sys.exit(1)
+            finally:
+                if self.explain is not None:
+                    self.explain.report()
 
         command = ['git', 'shell', '-c', newcmd]
         main_log.info('Serving %s', str(command))
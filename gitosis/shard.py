@@ -0,0 +1,162 @@
+"""
+Per-user authorization shards.
+
+Deciding access for a single connection means resolving the user's
+transitive group membership and then looking at every section the
+user belongs to, which is all driven by ``gitosis.conf`` as a whole.
+
+At ``post-update`` time we instead project ``gitosis.conf`` onto each
+user that has a key in ``keydir``: the shard is itself a small config
+file holding just the user's own section, the sections of the groups
+the user is a member of (with ``members`` trimmed to the entries that
+matter for this user), the repository aliases, and the
+``repositories`` prefix. Running
+``access.haveAccess`` against a shard gives exactly the same answer as
+running it against the full configuration.
+
+Shards live in ``shards/`` in the generated files directory and carry
+the fingerprint of the ``gitosis.conf`` they were made from; a shard
+that does not match the configuration being served is ignored.
+"""
+
+import errno
+import logging
+import os
+
+from ConfigParser import RawConfigParser, NoSectionError, NoOptionError
+
+from gitosis import alias
+from gitosis import group
+from gitosis import util
+
+log = logging.getLogger('gitosis.shard')
+
+SHARD_SECTION = 'shard'
+
+_ACCESS_OPTIONS = ['readonly', 'writable', 'writeable', 'repositories']
+
+def getShardDir(config):
+    return os.path.join(util.getGeneratedFilesDir(config), 'shards')
+
+def shard_path(config, user):
+    return os.path.join(getShardDir(config), '%s.conf' % user)
+
+def _copy_section(config, shard, section, keep_member):
+    shard.add_section(section)
+    for (name, value) in config.items(section):
+        if name == 'members':
+            members = [m for m in value.split() if keep_member(m)]
+            if members:
+                shard.set(section, name, ' '.join(members))
+        elif name in _ACCESS_OPTIONS or name.startswith('map '):
+            shard.set(section, name, value)
+
+def compile_shard(config, user, fingerprint):
+    """
+    Project ``config`` onto the access rules that apply to ``user``.
+
+    :type config: RawConfigParser
+    :type user: str
+    :param fingerprint: fingerprint of the config file
+    :rtype: RawConfigParser
+    """
+    groups = list(group.getMembership(config=config, user=user))
+    relevant = set(['@%s' % g for g in groups])
+    relevant.add('@all')
+    relevant.add(user)
+    def keep_member(member):
+        return member in relevant
+
+    shard = RawConfigParser()
+    shard.add_section(SHARD_SECTION)
+    shard.set(SHARD_SECTION, 'user', user)
+    shard.set(SHARD_SECTION, 'groups', ' '.join(groups))
+    shard.set(SHARD_SECTION, 'fingerprint', fingerprint)
+
+    try:
+        repositories = config.get('gitosis', 'repositories')
+    except (NoSectionError, NoOptionError):
+        pass
+    else:
+        shard.add_section('gitosis')
+        shard.set('gitosis', 'repositories', repositories)
+
+    # keep the original section order, group membership is resolved
+    # by walking the group sections in order
+    wanted = set(['group %s' % g for g in groups])
+    wanted.add('user %s' % user)
+    for section in config.sections():
+        if section in wanted:
+            _copy_section(config, shard, section, keep_member)
+        elif section.startswith(alias.ALIAS_PREFIX):
+            shard.add_section(section)
+            for (name, value) in config.items(section):
+                shard.set(section, name, value)
+    return shard
+
+def write_shards(config, users, fingerprint):
+    """
+    Write a shard for each of ``users``, and remove stale ones.
+
+    :type config: RawConfigParser
+    :param users: names of the users to write shards for
+    :param fingerprint: fingerprint of the config file
+    """
+    shard_dir = getShardDir(config)
+    util.mkdir(shard_dir)
+
+    users = set(users)
+    for user in sorted(users):
+        shard = compile_shard(config, user, fingerprint)
+        path = shard_path(config, user)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        f = file(tmp, 'w')
+        try:
+            shard.write(f)
+        finally:
+            f.close()
+        os.rename(tmp, path)
+
+    for filename in os.listdir(shard_dir):
+        basename, ext = os.path.splitext(filename)
+        if ext != '.conf' or basename in users:
+            continue
+        log.debug('Removing stale shard %r', filename)
+        os.unlink(os.path.join(shard_dir, filename))
+
+def read_shard(config, user):
+    """
+    Read the shard for ``user``.
+
+    Returns ``None`` if there is no shard, or it was not made from
+    the configuration file ``config`` was read from.
+
+    :param config: config as read by ``lazyconfig.LazyConfigParser``
+    :type user: str
+    """
+    fingerprint = getattr(config, 'fingerprint', None)
+    if fingerprint is None:
+        return None
+
+    path = shard_path(config, user)
+    try:
+        f = file(path)
+    except (IOError, OSError), e:
+        if e.errno == errno.ENOENT:
+            log.debug('No shard for %r', user)
+            return None
+        raise
+    shard = RawConfigParser()
+    try:
+        shard.readfp(f)
+    finally:
+        f.close()
+
+    try:
+        got = shard.get(SHARD_SECTION, 'fingerprint')
+    except (NoSectionError, NoOptionError):
+        got = None
+    if got != fingerprint:
+        log.debug('Ignoring stale shard for %r', user)
+        return None
+    return shard
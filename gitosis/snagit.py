@@ -1,40 +1,50 @@
-from gitosis import access
-
-def list_repos(cfg, user, cmd):
-    all_repos = []
-    secs = cfg.sections()
-    for sec in secs:
-        for opt in cfg.options(sec):
-            if ((str(opt) == "writable") or (str(opt) == "writeable")):
-                ws = cfg.get(sec, opt).split()
-                for repo in ws:
-                    try:
-                        all_repos.index(repo)
-                    except ValueError, e:
-                        all_repos.append(repo)
-            elif (str(opt) == "readonly"):
-                readonlyies = cfg.get(sec, opt)
-                for repo in readonlyies:
-                    try:
-                        all_repos.index(repo)
-                    except ValueError, e:
-                        all_repos.append(repo)
-    
-    readonly_repos = []
-    writable_repos = []
-    # At this point should have a list of unique repos.    
-    for repo in all_repos:
-        rs = access.haveAccess(cfg, user, "writable", repo)
-        if (rs): # has read and write access
-            writable_repos.append(repo)
+"""
+List the repositories a user can access, for ``snagit list-repos``.
+
+Every repository the user can write to is listed first, then the ones
+the user can only read, one per line, as::
+
+	foo, writable
+	bar, readonly
+
+``snagit list-repos --porcelain`` gives a tab separated mode and name
+instead, meant for scripts.
+
+The grants come from one ``matrix.AccessMatrix`` of the config, with
+patterns matched against the repositories that exist on disk, all of
+them at once. Lines are written as the user's row of the matrix is
+gone through, not sorted.
+"""
+
+import sys
+
+from gitosis import gitdaemon
+from gitosis import matrix
+
+def user_repos(cfg, user):
+    """
+    Generate ``(mode, name)`` for the repositories ``user`` can
+    access, the writable ones first, see
+    ``matrix.AccessMatrix.iterRepositories``.
+    """
+    # only walked if some grant is a pattern
+    ondisk = (name for (dirpath, repo, name) in gitdaemon.walk_repos(cfg))
+    table = matrix.AccessMatrix(cfg, repos=ondisk, visible=True)
+    return table.iterRepositories(user)
+
+def list_repos(cfg, user, cmd, fp=None):
+    """
+    Write the repositories ``user`` can access to ``fp``, standard
+    output by default.
+
+    :param cmd: the command line, ``snagit list-repos [--porcelain]``
+    """
+    if fp is None:
+        fp = sys.stdout
+    porcelain = '--porcelain' in cmd.split()[2:]
+
+    for (mode, name) in user_repos(cfg, user):
+        if porcelain:
+            fp.write('%s\t%s\n' % (mode, name))
         else:
-            rs = access.haveAccess(cfg, user, "readonly", repo)
-            if (rs): # has read only access
-                readonly_repos.append(repo)
-            else: # has no access
-                pass
-    
-    for repo in writable_repos:
-        print "%s, writable" % str(repo)
-    for repo in readonly_repos:
-        print "%s, readonly" % str(repo)
+            fp.write('%s, %s\n' % (name, mode))
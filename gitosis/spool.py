@@ -0,0 +1,256 @@
+"""
+Regenerate in the background, once for a burst of changes.
+
+Regenerating after a push to ``gitosis-admin``, or after
+``gitosis-serve`` created a repository, used to happen right away,
+with the client waiting for all of it, and a burst of pushes
+regenerated everything once per push. Instead, each of them now
+writes a request to the ``spool`` directory in the generated files
+directory and starts a worker in the background.
+
+Only one worker runs at a time: it holds an ``flock`` on
+``spool/lock``, and a worker that cannot get it just exits, leaving
+its request to the one that has it. The worker reads all queued
+requests, merges them into one and regenerates once for the newest
+configuration, and repeats until the spool is empty. Its log goes to
+``spool/worker.log``. Requests it fails to regenerate for stay
+queued, and are tried again along with the next request.
+
+A request is a dict:
+
+- ``config``: the file ``gitosis.conf`` was read from
+
+- ``git_dir``: the ``gitosis-admin`` repository pushed to, or ``None``
+
+- ``full``: whether to regenerate everything
+
+- ``updates``: the ``(old, new, ref)`` of the push, or ``None`` if
+  not known
+
+- ``repos``: names of repositories created by ``gitosis-serve``
+"""
+
+import errno
+import fcntl
+import itertools
+import logging
+import marshal
+import os
+import sys
+import time
+
+from gitosis import util
+
+log = logging.getLogger('gitosis.spool')
+
+SUFFIX = '.req'
+
+_sequence = itertools.count()
+
+def getSpoolDir(config):
+    return os.path.join(util.getGeneratedFilesDir(config), 'spool')
+
+def makeRequest(config, git_dir=None, full=False, updates=None, repos=()):
+    """
+    Make a request, see the module documentation.
+    """
+    if updates is not None:
+        updates = [tuple(update) for update in updates]
+    return dict(
+        config=config,
+        git_dir=git_dir,
+        full=full,
+        updates=updates,
+        repos=list(repos),
+        )
+
+def _makeSpoolDir(spool_dir):
+    # the generated files directory may not be there yet either
+    util.mkdir(os.path.dirname(spool_dir))
+    util.mkdir(spool_dir)
+
+def enqueue(spool_dir, request):
+    """
+    Write ``request`` to ``spool_dir``.
+
+    Returns the path of the request file.
+    """
+    _makeSpoolDir(spool_dir)
+    name = '%017.6f.%d.%d' % (time.time(), os.getpid(), _sequence.next())
+    path = os.path.join(spool_dir, name + SUFFIX)
+    # dot files are not picked up by the worker
+    tmp = os.path.join(spool_dir, '.%s.tmp' % name)
+    f = file(tmp, 'wb')
+    try:
+        marshal.dump(request, f)
+        os.fsync(f)
+    finally:
+        f.close()
+    os.rename(tmp, path)
+    return path
+
+def pending(spool_dir):
+    """
+    List the paths of the queued requests, oldest first.
+    """
+    try:
+        names = os.listdir(spool_dir)
+    except OSError, e:
+        if e.errno == errno.ENOENT:
+            return []
+        raise
+    return [os.path.join(spool_dir, name) for name in sorted(names)
+            if name.endswith(SUFFIX) and not name.startswith('.')]
+
+def _readRequest(path):
+    f = file(path, 'rb')
+    try:
+        return marshal.load(f)
+    finally:
+        f.close()
+
+def coalesce(requests):
+    """
+    Merge ``requests``, oldest first, into one.
+
+    The newest config and ``gitosis-admin`` win; the pushes are taken
+    together, so whatever any of them changed counts as changed.
+    """
+    merged = makeRequest(config=None, updates=[])
+    for request in requests:
+        merged['config'] = request['config']
+        for name in request['repos']:
+            if name not in merged['repos']:
+                merged['repos'].append(name)
+        if request['git_dir'] is None:
+            continue
+        merged['git_dir'] = request['git_dir']
+        merged['full'] = merged['full'] or request['full']
+        if request['updates'] is None:
+            merged['updates'] = None
+        elif merged['updates'] is not None:
+            merged['updates'].extend(request['updates'])
+    if merged['git_dir'] is None:
+        merged['updates'] = None
+    return merged
+
+def _lock(spool_dir, block):
+    _makeSpoolDir(spool_dir)
+    lock = file(os.path.join(spool_dir, 'lock'), 'a')
+    flags = fcntl.LOCK_EX
+    if not block:
+        flags |= fcntl.LOCK_NB
+    try:
+        fcntl.flock(lock.fileno(), flags)
+    except IOError, e:
+        lock.close()
+        if e.errno in [errno.EAGAIN, errno.EACCES]:
+            return None
+        raise
+    return lock
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except OSError, e:
+        if e.errno == errno.ENOENT:
+            pass
+        else:
+            raise
+
+def _drain(spool_dir, regenerate):
+    while True:
+        paths = pending(spool_dir)
+        if not paths:
+            return
+        requests = []
+        for path in paths:
+            try:
+                requests.append(_readRequest(path))
+            except (IOError, EOFError, ValueError, TypeError), e:
+                log.warning('Dropping unreadable request %r: %s', path, e)
+                _unlink(path)
+        log.info('Regenerating for %d queued requests', len(paths))
+        if requests:
+            # if this fails, the requests stay; dropping them would
+            # lose changes that later pushes do not repeat
+            regenerate(coalesce(requests))
+        for path in paths:
+            _unlink(path)
+
+def work(spool_dir, regenerate, block=False):
+    """
+    Run ``regenerate`` with the merged queued requests until the spool
+    is empty.
+
+    Returns ``False`` without doing anything if another worker is
+    running and ``block`` is not set; with ``block``, waits for that
+    worker to finish first.
+    """
+    while True:
+        lock = _lock(spool_dir, block)
+        if lock is None:
+            log.debug('Another worker is running')
+            return False
+        try:
+            _drain(spool_dir, regenerate)
+        finally:
+            lock.close()
+        # whoever queued a request while we were finishing up found
+        # the lock taken, and left it to us
+        if not pending(spool_dir):
+            return True
+
+def _detach(spool_dir):
+    null = os.open(os.devnull, os.O_RDWR)
+    out = os.open(os.path.join(spool_dir, 'worker.log'),
+                  os.O_WRONLY|os.O_APPEND|os.O_CREAT, 0644)
+    os.dup2(null, 0)
+    os.dup2(null, 1)
+    os.dup2(out, 2)
+    os.close(null)
+    os.close(out)
+
+def spawn(spool_dir, regenerate):
+    """
+    Run ``work`` in a background process.
+
+    The process does not keep the caller's standard input and output
+    open, so git does not wait for it.
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid:
+        os.waitpid(pid, 0)
+        return
+    status = 1
+    try:
+        try:
+            os.setsid()
+            if os.fork():
+                status = 0
+            else:
+                _detach(spool_dir)
+                work(spool_dir, regenerate)
+                status = 0
+        except:
+            log.exception('Background regeneration failed')
+    finally:
+        sys.stderr.flush()
+        os._exit(status)
+
+def submit(config, request, regenerate, wait=False):
+    """
+    Queue ``request`` and have a worker take care of it.
+
+    :param regenerate: callable doing the work for a request
+    :param wait: run the worker here, and return only when the
+      request is done
+    """
+    spool_dir = getSpoolDir(config)
+    enqueue(spool_dir, request)
+    if wait:
+        work(spool_dir, regenerate, block=True)
+    else:
+        spawn(spool_dir, regenerate)
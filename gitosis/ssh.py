@@ -1,5 +1,12 @@
 import os, errno, re
+import hashlib
 import logging
+import marshal
+
+from cStringIO import StringIO
+
+from gitosis import keycheck
+from gitosis import repository
 
 log = logging.getLogger('gitosis.ssh')
 
@@ -9,34 +16,225 @@ def isSafeUsername(user):
     match = _ACCEPTABLE_USER_RE.match(user)
     return (match is not None)
 
-def readKeys(keydir):
+def _keyFileUser(filename):
+    """
+    Get the user key file ``filename`` is for, or ``None`` if it is
+    not a key file.
+    """
+    if filename.startswith('.'):
+        return None
+    basename, ext = os.path.splitext(filename)
+    if ext != '.pub':
+        return None
+
+    if not isSafeUsername(basename):
+        log.warn('Unsafe SSH username in keyfile: %r', filename)
+        return None
+
+    return basename
+
+def _keyFiles(keydir):
     """
-    Read SSH public keys from ``keydir/*.pub``
+    List the ``(user, filename)`` of the key files in ``keydir``.
     """
     for filename in os.listdir(keydir):
-        if filename.startswith('.'):
-            continue
-        basename, ext = os.path.splitext(filename)
-        if ext != '.pub':
-            continue
+        basename = _keyFileUser(filename)
+        if basename is not None:
+            yield (basename, filename)
 
-        if not isSafeUsername(basename):
-            log.warn('Unsafe SSH username in keyfile: %r', filename)
-            continue
+class KeyDirectory(object):
+    """
+    The key files in directory ``path``.
+
+    A key file's stamp is its size and mtime.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def stamps(self):
+        """
+        List the ``(filename, stamp)`` of the key files.
+        """
+        found = []
+        for (basename, filename) in _keyFiles(self.path):
+            st = os.stat(os.path.join(self.path, filename))
+            found.append((filename, (st.st_size, st.st_mtime)))
+        return found
+
+    def contents(self, filenames):
+        """
+        Read the key files ``filenames``.
+        """
+        found = []
+        for filename in filenames:
+            f = file(os.path.join(self.path, filename))
+            try:
+                found.append(f.read())
+            finally:
+                f.close()
+        return found
+
+class KeyTree(object):
+    """
+    The key files in git tree ``tree``, read through
+    ``repository.CatFile`` ``catfile``.
+
+    A key file's stamp is its blob id.
+    """
+
+    def __init__(self, catfile, tree):
+        self.catfile = catfile
+        self.blobs = {}
+        for (mode, filename, sha1) in catfile.readTree(tree):
+            if (mode in repository.BLOB_MODES
+                and _keyFileUser(filename) is not None):
+                self.blobs[filename] = sha1
+
+    def stamps(self):
+        return sorted(self.blobs.items())
+
+    def contents(self, filenames):
+        return [data for (sha1, type_, data)
+                in self.catfile.readMany([self.blobs[filename]
+                                          for filename in filenames])]
+
+def keyUsers(keydir):
+    """
+    List the users with a key file in ``KeyDirectory`` or ``KeyTree``
+    ``keydir``.
+    """
+    return [os.path.splitext(filename)[0]
+            for (filename, stamp) in keydir.stamps()]
+
+MANIFEST_VERSION = 3
 
-        path = os.path.join(keydir, filename)
-        f = file(path)
-        for line in f:
-            line = line.rstrip('\n')
-            yield (basename, line)
+def _readManifest(path):
+    try:
+        f = file(path, 'rb')
+    except (IOError, OSError), e:
+        if e.errno == errno.ENOENT:
+            return {}
+        raise
+    try:
+        try:
+            (version, entries) = marshal.load(f)
+        except (EOFError, ValueError, TypeError):
+            return {}
+    finally:
         f.close()
+    if version != MANIFEST_VERSION:
+        return {}
+    return entries
+
+def _writeManifest(path, entries):
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    f = file(tmp, 'wb')
+    try:
+        marshal.dump((MANIFEST_VERSION, entries), f)
+    finally:
+        f.close()
+    os.rename(tmp, path)
+
+def readValidKeys(keydir, manifest=None):
+    """
+    Read the well-formed SSH public keys from ``keydir/*.pub``.
+
+    Every line is checked with ``keycheck.validateKey``; rejected
+    lines are logged and left out.
+
+    The manifest at ``manifest``, if given, records the stamp, SHA-1
+    and check results of each key file. A file whose stamp matches is
+    not read at all; one whose content hashes the same is not checked
+    again.
+
+    :param keydir: path of the key directory, or a ``KeyDirectory`` or
+      ``KeyTree``
+
+    Returns a list of ``(user, key)``, ordered by file name.
+    """
+    if isinstance(keydir, basestring):
+        keydir = KeyDirectory(keydir)
+    if manifest is None:
+        cached = {}
+    else:
+        cached = _readManifest(manifest)
+    entries = {}
+    misses = []
+    for (filename, stamp) in keydir.stamps():
+        entry = cached.get(filename)
+        if entry is not None and entry[0] == stamp:
+            entries[filename] = entry
+        else:
+            misses.append((filename, stamp, entry))
+
+    contents = []
+    if misses:
+        contents = keydir.contents([filename for (filename, stamp, entry)
+                                    in misses])
+    unchecked = []
+    for ((filename, stamp, entry), data) in zip(misses, contents):
+        digest = hashlib.sha1(data).hexdigest()
+        if entry is not None and entry[1] == digest:
+            entries[filename] = (stamp,) + entry[1:]
+        else:
+            log.debug('Checking changed keyfile %r', filename)
+            unchecked.append((filename, stamp, digest, data))
+
+    results = keycheck.checkKeyFiles([data for (filename, stamp, digest, data)
+                                      in unchecked])
+    for ((filename, stamp, digest, data), (keys, rejected)) in zip(unchecked,
+                                                                  results):
+        entries[filename] = (stamp, digest, keys, rejected)
+    if manifest is not None and entries != cached:
+        _writeManifest(manifest, entries)
+
+    found = []
+    for filename in sorted(entries):
+        (stamp, digest, keys, rejected) = entries[filename]
+        for (lineno, reason) in rejected:
+            log.warning('Rejected SSH key in %s line %d: %s',
+                        filename, lineno, reason)
+        basename = os.path.splitext(filename)[0]
+        found.extend([(basename, key) for key in keys])
+    return found
+
+def uniqueKeys(keys):
+    """
+    Drop the ``(user, key)`` pairs whose key came up before.
+
+    sshd goes by the first line of ``authorized_keys`` with the key
+    offered, so a key belongs to the user it is listed for first: in
+    file name order, for keys as ``readValidKeys`` returns them. Keys
+    are told apart by their base64 blob.
+
+    Returns the pairs left, in the same order, and a list of ``(key,
+    owner, user)`` for the keys dropped for a user other than their
+    owner.
+    """
+    owners = {}
+    unique = []
+    duplicates = []
+    for (user, key) in keys:
+        words = key.split()
+        if len(words) < 2:
+            blob = key
+        else:
+            blob = words[1]
+        owner = owners.get(blob)
+        if owner is None:
+            owners[blob] = user
+            unique.append((user, key))
+        elif owner != user:
+            duplicates.append((key, owner, user))
+    return (unique, duplicates)
 
 COMMENT = '### autogenerated by gitosis, DO NOT EDIT'
 
-def generateAuthorizedKeys(keys):
-    TEMPLATE=('command="gitosis-serve %(user)s",no-port-forwarding,'
-              +'no-X11-forwarding,no-agent-forwarding,no-pty %(key)s')
+TEMPLATE=('command="gitosis-serve %(user)s",no-port-forwarding,'
+          +'no-X11-forwarding,no-agent-forwarding,no-pty %(key)s')
 
+def generateAuthorizedKeys(keys):
     yield COMMENT
     for (user, key) in keys:
         yield TEMPLATE % dict(user=user, key=key)
@@ -60,31 +258,55 @@ def filterAuthorizedKeys(fp):
             continue
         yield line
 
-def writeAuthorizedKeys(path, keydir):
-    tmp = '%s.%d.tmp' % (path, os.getpid())
+def writeAuthorizedKeys(path, keydir, manifest=None):
+    """
+    Write the keys in ``keydir`` to the ``authorized_keys`` file at
+    ``path``, keeping the lines not generated by gitosis.
+
+    The file is only replaced if its content changes.
+
+    Only well-formed keys are written, and a key found for more than
+    one user only for the first of them (see ``uniqueKeys``).
+
+    :param keydir: see ``readValidKeys``
+
+    :param manifest: path of the keydir manifest, see
+      ``readValidKeys``
+
+    Returns whether the file was replaced.
+    """
     try:
         in_ = file(path)
     except IOError, e:
         if e.errno == errno.ENOENT:
-            in_ = None
+            old = None
         else:
             raise
-
-    try:
-        out = file(tmp, 'w')
+    else:
         try:
-            if in_ is not None:
-                for line in filterAuthorizedKeys(in_):
-                    print >>out, line
+            old = in_.read()
+        finally:
+            in_.close()
 
-            keygen = readKeys(keydir)
-            for line in generateAuthorizedKeys(keygen):
-                print >>out, line
+    lines = []
+    if old is not None:
+        lines.extend(filterAuthorizedKeys(StringIO(old)))
+    (keys, duplicates) = uniqueKeys(readValidKeys(keydir, manifest))
+    for (key, owner, user) in duplicates:
+        log.warning('SSH key of %r is already used by %r, ignoring',
+                    user, owner)
+    lines.extend(generateAuthorizedKeys(keys))
+    data = ''.join(['%s\n' % line for line in lines])
+    if data == old:
+        log.debug('Unchanged: %r', path)
+        return False
 
-            os.fsync(out)
-        finally:
-            out.close()
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    out = file(tmp, 'w')
+    try:
+        out.write(data)
+        os.fsync(out)
     finally:
-        if in_ is not None:
-            in_.close()
+        out.close()
     os.rename(tmp, path)
+    return True
@@ -0,0 +1,218 @@
+"""
+Let users log in with SSH certificates instead of listed keys.
+
+With many users, every login makes sshd read through a big
+``authorized_keys``. If instead users log in with certificates signed
+by a certificate authority, sshd only has to check the signature, and
+find out which ``gitosis-serve`` command goes with the principal the
+certificate is for. List the public keys of the CA in ``gitosis.conf``::
+
+	[gitosis]
+	ssh-ca-keys = ssh-ed25519 AAAA... users-ca@example.com
+
+and ``post-update`` writes, in the generated files directory,
+``ssh_ca_keys`` for sshd's ``TrustedUserCAKeys``, and
+``authorized_principals``, an ``AuthorizedPrincipalsFile`` with a
+line per known user::
+
+	command="gitosis-serve jdoe",no-port-forwarding,... jdoe
+
+Known users are the ones in ``keydir``, ``members`` of groups, and
+``[user ...]`` sections. Rather than that file, sshd can run
+``gitosis-authorized-principals %k`` as ``AuthorizedPrincipalsCommand``,
+which reads the principals out of the certificate itself and needs no
+list of users at all. Either way, a principal is the gitosis user name
+and must pass ``ssh.isSafeUsername``.
+
+gitosis only accepts certificates; issuing them is up to the CA.
+"""
+
+import base64
+import errno
+import logging
+import os
+import struct
+import sys
+
+from ConfigParser import NoSectionError, NoOptionError
+
+from gitosis import app
+from gitosis import keycheck
+from gitosis import ssh
+
+log = logging.getLogger('gitosis.sshca')
+
+CERT_SUFFIX = '-cert-v01@openssh.com'
+
+USER_CERT = 1
+
+class _Reader(object):
+    """
+    Read SSH wire format values from ``data``.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def _take(self, size):
+        if self.pos + size > len(self.data):
+            raise keycheck.InvalidKeyError('truncated certificate')
+        value = self.data[self.pos:self.pos+size]
+        self.pos += size
+        return value
+
+    def uint32(self):
+        return struct.unpack('>I', self._take(4))[0]
+
+    def uint64(self):
+        return struct.unpack('>Q', self._take(8))[0]
+
+    def string(self):
+        return self._take(self.uint32())
+
+def _baseType(certtype):
+    base = certtype[:-len(CERT_SUFFIX)]
+    if base.startswith('sk-'):
+        base += '@openssh.com'
+    return base
+
+def certPrincipals(blob):
+    """
+    List the principals of the user certificate ``blob``, decoded
+    from base64.
+
+    :raise keycheck.InvalidKeyError: ``blob`` is not a user
+      certificate
+    """
+    reader = _Reader(blob)
+    certtype = reader.string()
+    if not certtype.endswith(CERT_SUFFIX):
+        raise keycheck.InvalidKeyError('not a certificate: %r'
+                                       % certtype[:40])
+    base = _baseType(certtype)
+    if base not in keycheck.KEY_TYPES:
+        raise keycheck.InvalidKeyError('unknown certificate type %r'
+                                       % certtype[:40])
+    # nonce, then the public key
+    for i in xrange(1 + keycheck.KEY_TYPES[base]):
+        reader.string()
+    reader.uint64()
+    if reader.uint32() != USER_CERT:
+        raise keycheck.InvalidKeyError('not a user certificate')
+    reader.string()
+    packed = _Reader(reader.string())
+    principals = []
+    while packed.pos < len(packed.data):
+        principals.append(packed.string())
+    return principals
+
+def generateAuthorizedPrincipals(users):
+    """
+    Generate the ``authorized_principals`` lines for ``users``.
+    """
+    for user in users:
+        if not ssh.isSafeUsername(user):
+            log.warning('Unsafe SSH principal: %r', user)
+            continue
+        yield ssh.TEMPLATE % dict(user=user, key=user)
+
+def getCAKeys(config):
+    """
+    List the well-formed CA keys in ``ssh-ca-keys`` of ``[gitosis]``.
+    """
+    try:
+        value = config.get('gitosis', 'ssh-ca-keys')
+    except (NoSectionError, NoOptionError):
+        return []
+    keys = []
+    for line in value.split('\n'):
+        try:
+            key = keycheck.validateKey(line)
+        except keycheck.InvalidKeyError, e:
+            log.warning('Ignoring SSH CA key: %s', e)
+            continue
+        if key is not None:
+            keys.append(key)
+    return keys
+
+def knownUsers(config, keydir_users):
+    """
+    List the users in ``keydir_users``, in ``members`` of groups, or
+    with a ``[user ...]`` section, sorted.
+    """
+    users = set(keydir_users)
+    for section in config.sections():
+        if section.startswith('user '):
+            users.add(section[len('user '):])
+        elif (section.startswith('group ')
+              and config.has_option(section, 'members')):
+            users.update([member for member
+                          in config.get(section, 'members').split()
+                          if not member.startswith('@')])
+    return sorted(users)
+
+def _writeLines(path, lines):
+    data = ''.join(['%s\n' % line for line in lines])
+    try:
+        f = file(path)
+    except IOError, e:
+        if e.errno != errno.ENOENT:
+            raise
+    else:
+        try:
+            old = f.read()
+        finally:
+            f.close()
+        if old == data:
+            return
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    f = file(tmp, 'w')
+    try:
+        f.write(data)
+        os.fsync(f)
+    finally:
+        f.close()
+    os.rename(tmp, path)
+
+def writeCAFiles(config, generated, keydir_users):
+    """
+    Write ``ssh_ca_keys`` and ``authorized_principals`` to
+    ``generated``, if ``gitosis.conf`` lists CA keys.
+    """
+    keys = getCAKeys(config)
+    if not keys:
+        return
+    _writeLines(os.path.join(generated, 'ssh_ca_keys'), keys)
+    _writeLines(
+        os.path.join(generated, 'authorized_principals'),
+        generateAuthorizedPrincipals(knownUsers(config, keydir_users)),
+        )
+
+class Main(app.App):
+    def create_parser(self):
+        parser = super(Main, self).create_parser()
+        parser.set_usage('%prog [OPTS] CERTIFICATE')
+        parser.set_description(
+            'Print the authorized_principals lines for an SSH'
+            +' certificate, for sshd AuthorizedPrincipalsCommand')
+        return parser
+
+    def read_config(self, options, cfg):
+        # every login runs this, and the principals only depend on
+        # the certificate; gitosis.conf is not needed at all
+        pass
+
+    def handle_args(self, parser, cfg, options, args):
+        try:
+            (cert,) = args
+        except ValueError:
+            parser.error('Missing argument CERTIFICATE.')
+
+        try:
+            principals = certPrincipals(base64.b64decode(cert))
+        except (keycheck.InvalidKeyError, TypeError), e:
+            log.error('Cannot read certificate: %s', e)
+            sys.exit(1)
+        for line in generateAuthorizedPrincipals(principals):
+            print line
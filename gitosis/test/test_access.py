@@ -208,3 +208,101 @@ def test_pattern():
     cfg.set('group fooers', 'writable', 'foo/*')
     eq(access.haveAccess(config=cfg, user='jdoe', mode='writable', path='foo/bar'),
        ('repositories', 'foo/bar'))
+
+def test_resolve_strongest():
+    cfg = RawConfigParser()
+    cfg.add_section('group fooers')
+    cfg.set('group fooers', 'members', 'jdoe')
+    cfg.set('group fooers', 'readonly', 'foo')
+    cfg.add_section('group barers')
+    cfg.set('group barers', 'members', 'jdoe')
+    cfg.set('group barers', 'writable', 'foo')
+    cfg.set('group barers', 'repositories', 'elsewhere')
+    eq(access.resolveAccess(config=cfg, user='jdoe', path='foo.git'),
+       ('writable', ('elsewhere', 'foo')))
+
+def test_resolve_readonly():
+    cfg = RawConfigParser()
+    cfg.add_section('group fooers')
+    cfg.set('group fooers', 'members', 'jdoe')
+    cfg.set('group fooers', 'readonly', 'foo/*')
+    eq(access.resolveAccess(config=cfg, user='jdoe', path='foo/bar'),
+       ('readonly', ('repositories', 'foo/bar')))
+
+def test_resolve_typo():
+    cfg = RawConfigParser()
+    cfg.add_section('group fooers')
+    cfg.set('group fooers', 'members', 'jdoe')
+    cfg.set('group fooers', 'writeable', 'foo')
+    cfg.set('group fooers', 'map readonly foo', 'bar')
+    eq(access.resolveAccess(config=cfg, user='jdoe', path='foo'),
+       ('writeable', ('repositories', 'foo')))
+
+def test_resolve_none():
+    cfg = RawConfigParser()
+    cfg.add_section('group fooers')
+    cfg.set('group fooers', 'members', 'jdoe')
+    cfg.set('group fooers', 'writable', 'foo')
+    eq(access.resolveAccess(config=cfg, user='jdoe', path='bar'), None)
+    eq(access.resolveAccess(config=cfg, user='wsmith', path='foo'), None)
+
+def test_resolve_sameAsHaveAccess():
+    cfg = RawConfigParser()
+    cfg.add_section('user jdoe')
+    cfg.set('user jdoe', 'readonly', 'a b')
+    cfg.add_section('group fooers')
+    cfg.set('group fooers', 'members', 'jdoe')
+    cfg.set('group fooers', 'writable', 'b c-*')
+    cfg.set('group fooers', 'map writable d', 'real-d')
+    cfg.add_section('group barers')
+    cfg.set('group barers', 'members', '@fooers')
+    cfg.set('group barers', 'writeable', 'e')
+    cfg.set('group barers', 'readonly', 'c-1 f')
+    for path in ['a', 'b', 'c-1', 'd', 'e', 'f', 'g']:
+        want = None
+        for mode in access.MODES:
+            newpath = access.haveAccess(
+                config=cfg, user='jdoe', mode=mode, path=path)
+            if newpath is not None:
+                want = (mode, newpath)
+                break
+        eq(access.resolveAccess(config=cfg, user='jdoe', path=path), want)
+
+def test_alias():
+    cfg = RawConfigParser()
+    cfg.add_section('alias public')
+    cfg.set('alias public', 'repos', 'bar @docs')
+    cfg.add_section('alias docs')
+    cfg.set('alias docs', 'repos', 'manual web-*')
+    cfg.add_section('group fooers')
+    cfg.set('group fooers', 'members', 'jdoe')
+    cfg.set('group fooers', 'writable', 'foo @public')
+    for path in ['foo', 'bar', 'manual', 'web-site']:
+        eq(access.haveAccess(config=cfg, user='jdoe', mode='writable',
+                             path=path),
+           ('repositories', path))
+    eq(access.haveAccess(config=cfg, user='jdoe', mode='writable',
+                         path='@public'),
+       None)
+    eq(access.resolveAccess(config=cfg, user='jdoe', path='web-x'),
+       ('writable', ('repositories', 'web-x')))
+
+def test_checker_sameAsHaveAccess():
+    cfg = RawConfigParser()
+    cfg.add_section('group fooers')
+    cfg.set('group fooers', 'members', 'jdoe @interns')
+    cfg.set('group fooers', 'writable', 'foo')
+    cfg.set('group fooers', 'map readonly quux', 'thing/quux')
+    cfg.add_section('group interns')
+    cfg.set('group interns', 'members', 'alice')
+    cfg.set('group interns', 'readonly', 'bar')
+    checker = access.AccessChecker(cfg)
+    for user in ['jdoe', 'alice', 'wsmith']:
+        for mode in ['readonly', 'writable']:
+            for path in ['foo', 'foo.git', 'bar', 'quux', 'baz']:
+                eq(checker.haveAccess(user=user, mode=mode, path=path),
+                   access.haveAccess(config=cfg, user=user, mode=mode,
+                                     path=path))
+        for path in ['foo', 'bar', 'quux', 'baz']:
+            eq(checker.resolveAccess(user=user, path=path),
+               access.resolveAccess(config=cfg, user=user, path=path))
@@ -0,0 +1,138 @@
+from nose.tools import eq_ as eq
+
+import os
+from ConfigParser import RawConfigParser
+
+from gitosis import accesscache
+from gitosis import serve
+from gitosis.test.util import maketemp, assert_raises
+
+def _cache(size=accesscache.DEFAULT_SIZE, fingerprint='fp'):
+    tmp = maketemp()
+    path = os.path.join(tmp, 'access-cache')
+    return accesscache.DecisionCache(path, fingerprint, size)
+
+def test_miss():
+    cache = _cache()
+    assert_raises(KeyError, cache.lookup, 'jdoe', 'foo')
+
+def test_hit():
+    cache = _cache()
+    cache.store('jdoe', 'foo', ('writable', ('repositories', 'foo')))
+    cache.store('jdoe', 'bar', None)
+    eq(cache.lookup('jdoe', 'foo'), ('writable', ('repositories', 'foo')))
+    eq(cache.lookup('jdoe', 'bar'), None)
+    assert_raises(KeyError, cache.lookup, 'wsmith', 'foo')
+
+def test_otherConfig():
+    cache = _cache()
+    cache.store('jdoe', 'foo', ('writable', ('repositories', 'foo')))
+    other = accesscache.DecisionCache(cache.path, 'changed')
+    assert_raises(KeyError, other.lookup, 'jdoe', 'foo')
+    other.store('jdoe', 'bar', None)
+    # and the old decisions are gone for good
+    assert_raises(KeyError, cache.lookup, 'jdoe', 'foo')
+    eq(other.lookup('jdoe', 'bar'), None)
+
+def test_lookup_nothingStored():
+    cache = _cache()
+    assert_raises(KeyError, cache.lookup, 'jdoe', 'foo')
+    eq(os.path.exists(cache.path + '.dat'), False)
+
+def test_evict():
+    cache = _cache(size=10)
+    for i in xrange(10):
+        cache.store('jdoe', 'repo%d' % i, None)
+    # looking it up does not keep it
+    cache.lookup('jdoe', 'repo0')
+    cache.store('jdoe', 'repo10', None)
+    assert_raises(KeyError, cache.lookup, 'jdoe', 'repo0')
+    eq(cache.lookup('jdoe', 'repo1'), None)
+    eq(cache.lookup('jdoe', 'repo10'), None)
+    cache.store('jdoe', 'repo11', None)
+    assert_raises(KeyError, cache.lookup, 'jdoe', 'repo1')
+
+def test_evict_storedAgain():
+    cache = _cache(size=10)
+    cache.store('jdoe', 'foo', None)
+    cache.store('jdoe', 'foo', ('readonly', ('repositories', 'foo')))
+    for i in xrange(9):
+        cache.store('jdoe', 'repo%d' % i, None)
+    # its first slot is reused, but it was stored again since
+    eq(cache.lookup('jdoe', 'foo'), ('readonly', ('repositories', 'foo')))
+    cache.store('jdoe', 'repo9', None)
+    assert_raises(KeyError, cache.lookup, 'jdoe', 'foo')
+    eq(cache.lookup('jdoe', 'repo0'), None)
+
+def test_invalidate():
+    tmp = maketemp()
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'generate-files-in', tmp)
+    cache = accesscache.DecisionCache(accesscache.getCachePath(cfg), 'fp')
+    cache.store('jdoe', 'foo', ('writable', ('repositories', 'foo')))
+    accesscache.invalidate(cfg)
+    assert_raises(KeyError, cache.lookup, 'jdoe', 'foo')
+
+def test_invalidate_neverUsed():
+    tmp = maketemp()
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'generate-files-in', tmp)
+    accesscache.invalidate(cfg)
+    eq(os.listdir(tmp), [])
+
+def test_open_noFingerprint():
+    cfg = RawConfigParser()
+    eq(accesscache.open_cache(cfg), None)
+
+def test_open_disabled():
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'access-cache-size', '0')
+    cfg.fingerprint = 'fp'
+    eq(accesscache.open_cache(cfg), None)
+
+def test_open_dumbdbm():
+    tmp = maketemp()
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'generate-files-in', tmp)
+    cfg.fingerprint = 'fp'
+    got = accesscache.open_cache(cfg)
+    if accesscache.usable():
+        eq(got.path, os.path.join(tmp, 'access-cache'))
+    else:
+        eq(got, None)
+
+def test_serve_usesCache():
+    tmp = maketemp()
+    os.mkdir(os.path.join(tmp, 'foo.git'))
+    cfg = RawConfigParser()
+    cache = _cache()
+    cache.store('jdoe', 'foo', ('writable', (tmp, 'foo')))
+    got = serve.serve(
+        cfg=cfg,
+        user='jdoe',
+        command="git-receive-pack 'foo'",
+        cache=cache,
+        )
+    eq(got, "git-receive-pack '%s/foo.git'" % tmp)
+
+def test_serve_fillsCache():
+    tmp = maketemp()
+    os.mkdir(os.path.join(tmp, 'foo.git'))
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'repositories', tmp)
+    cfg.add_section('group foo')
+    cfg.set('group foo', 'members', 'jdoe')
+    cfg.set('group foo', 'readonly', 'foo')
+    cache = _cache()
+    serve.serve(
+        cfg=cfg,
+        user='jdoe',
+        command="git-upload-pack 'foo'",
+        cache=cache,
+        )
+    eq(cache.lookup('jdoe', 'foo'), ('readonly', (tmp, 'foo')))
@@ -0,0 +1,68 @@
+from nose.tools import eq_ as eq
+
+from ConfigParser import RawConfigParser
+
+from gitosis import alias
+from gitosis import lazyconfig
+from gitosis.test.util import assert_raises
+
+def _config():
+    cfg = RawConfigParser()
+    cfg.add_section('alias public')
+    cfg.set('alias public', 'repos', 'bar @docs baz')
+    cfg.add_section('alias docs')
+    cfg.set('alias docs', 'repos', 'manual bar @nosuch')
+    return cfg
+
+def test_expand():
+    table = alias.getAliasTable(_config())
+    eq(table.expand('docs'), ('manual', 'bar', '@nosuch'))
+    eq(table.expand('public'), ('bar', 'manual', '@nosuch', 'baz'))
+    eq(table.expand('nosuch'), ())
+
+def test_expandWords():
+    table = alias.getAliasTable(_config())
+    eq(table.expandWords(['foo', '@docs', '@all']),
+       ['foo', 'manual', 'bar', '@nosuch', '@all'])
+    eq(alias.getAliasTable(RawConfigParser()).expandWords(['@docs']),
+       ['@docs'])
+
+def test_compile():
+    table = alias.getAliasTable(_config())
+    m = table.compile('foo @public')
+    assert m.match('manual')
+    assert m.match('foo')
+    assert not m.match('thud')
+    assert table.compile('foo @public') is m
+
+def test_cycle():
+    cfg = _config()
+    cfg.set('alias docs', 'repos', 'manual @public')
+    e = assert_raises(alias.AliasCycleError,
+                      alias.getAliasTable(cfg).expand, 'public')
+    eq(str(e), 'Repository alias cycle: public -> docs -> public')
+
+def test_table_rebuilt():
+    cfg = _config()
+    table = alias.getAliasTable(cfg)
+    assert alias.getAliasTable(cfg) is table
+    cfg.set('alias docs', 'repos', 'other')
+    eq(alias.getAliasTable(cfg).expand('docs'), ('other',))
+    cfg.add_section('alias new')
+    cfg.set('alias new', 'repos', 'thud')
+    eq(alias.getAliasTable(cfg).expand('new'), ('thud',))
+
+class CountingConfig(lazyconfig.LazyConfigParser):
+    scans = 0
+
+    def sections(self):
+        self.scans += 1
+        return lazyconfig.LazyConfigParser.sections(self)
+
+def test_table_noRescan():
+    cfg = CountingConfig()
+    cfg.add_section('alias docs')
+    cfg.set('alias docs', 'repos', 'manual')
+    alias.getAliasTable(cfg)
+    eq(alias.getAliasTable(cfg).expand('docs'), ('manual',))
+    eq(cfg.scans, 1)
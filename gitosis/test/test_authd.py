@@ -0,0 +1,121 @@
+from nose.tools import eq_ as eq
+
+import os
+import socket
+import threading
+
+from gitosis import authd
+from gitosis import repository
+from gitosis.test.util import maketemp, writeFile, assert_raises
+
+def _setup():
+    tmp = maketemp()
+    repository.init(os.path.join(tmp, 'foo.git'))
+    path = os.path.join(tmp, 'gitosis.conf')
+    writeFile(path, """\
+[gitosis]
+repositories = %s
+
+[group foo]
+members = jdoe
+readonly = foo
+""" % tmp)
+    return (tmp, path)
+
+def test_decide_ok():
+    (tmp, path) = _setup()
+    policy = authd.Policy(path)
+    eq(policy.decide('jdoe', "git-upload-pack 'foo'"),
+       (authd.OK, "git-upload-pack '%s/foo.git'" % tmp))
+
+def test_decide_deny():
+    (tmp, path) = _setup()
+    policy = authd.Policy(path)
+    eq(policy.decide('jdoe', "git-receive-pack 'foo'"),
+       (authd.DENY, 'Repository write access denied'))
+    eq(policy.decide('wsmith', "git-upload-pack 'foo'"),
+       (authd.DENY, 'Repository read access denied'))
+
+def test_decide_cvs():
+    (tmp, path) = _setup()
+    policy = authd.Policy(path)
+    (status, payload) = policy.decide('jdoe', "cvs 'foo' server")
+    eq(status, authd.FALLBACK)
+
+def test_decide_autoinit():
+    (tmp, path) = _setup()
+    writeFile(path, """\
+[gitosis]
+repositories = %s
+
+[group foo]
+members = jdoe
+writable = bar
+""" % tmp)
+    policy = authd.Policy(path)
+    (status, payload) = policy.decide('jdoe', "git-receive-pack 'bar'")
+    eq(status, authd.FALLBACK)
+    eq(os.path.exists(os.path.join(tmp, 'bar.git')), False)
+
+def test_reload():
+    (tmp, path) = _setup()
+    policy = authd.Policy(path)
+    eq(policy.decide('wsmith', "git-upload-pack 'foo'")[0], authd.DENY)
+    writeFile(path, """\
+[gitosis]
+repositories = %s
+
+[group foo]
+members = jdoe wsmith
+readonly = foo
+""" % tmp)
+    eq(policy.decide('wsmith', "git-upload-pack 'foo'")[0], authd.OK)
+
+def test_reload_broken():
+    (tmp, path) = _setup()
+    policy = authd.Policy(path)
+    writeFile(path, 'junk\n')
+    eq(policy.decide('jdoe', "git-upload-pack 'foo'")[0], authd.OK)
+
+def test_query():
+    (tmp, path) = _setup()
+    sock = os.path.join(tmp, 'authd.sock')
+    server = authd.AuthServer(sock, authd.Policy(path))
+    try:
+        t = threading.Thread(target=server.handle_request)
+        t.start()
+        got = authd.query(sock, 'jdoe', "git-upload-pack 'foo'")
+        t.join()
+    finally:
+        server.server_close()
+    eq(got, (authd.OK, "git-upload-pack '%s/foo.git'" % tmp))
+
+def test_query_slowClient():
+    (tmp, path) = _setup()
+    sock = os.path.join(tmp, 'authd.sock')
+    server = authd.AuthServer(sock, authd.Policy(path))
+    t = threading.Thread(target=server.serve_forever)
+    t.start()
+    slow = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        # connected, but never sending its request
+        slow.connect(sock)
+        got = authd.query(sock, 'jdoe', "git-upload-pack 'foo'",
+                          timeout=1.0)
+    finally:
+        slow.close()
+        server.shutdown()
+        t.join()
+        server.server_close()
+    eq(got, (authd.OK, "git-upload-pack '%s/foo.git'" % tmp))
+
+def test_query_notRunning():
+    tmp = maketemp()
+    e = assert_raises(
+        authd.DaemonUnavailable,
+        authd.query,
+        os.path.join(tmp, 'authd.sock'),
+        'jdoe',
+        "git-upload-pack 'foo'",
+        )
+    assert str(e).startswith('Authorization daemon not available: ')
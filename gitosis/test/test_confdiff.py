@@ -0,0 +1,100 @@
+from nose.tools import eq_ as eq
+
+from ConfigParser import RawConfigParser
+from cStringIO import StringIO
+
+from gitosis import confdiff
+
+BASE = """\
+[gitosis]
+
+[group devs]
+members = jdoe @interns
+writable = foo bar
+
+[group interns]
+members = alice
+
+[group qa]
+members = @devs
+readonly = baz squee-*
+
+[group others]
+members = wsmith
+readonly = unrelated
+
+[user jdoe]
+name = John Doe
+
+[repo foo]
+description = the foo
+"""
+
+ONDISK = ['foo', 'bar', 'baz', 'squee-1', 'squee-2', 'unrelated']
+
+def _config(text):
+    cfg = RawConfigParser()
+    cfg.readfp(StringIO(text))
+    return cfg
+
+def _changes(new, old=BASE):
+    return confdiff.Changes(_config(old), _config(new), ONDISK)
+
+def test_diffSections():
+    old = _config(BASE)
+    new = _config(BASE.replace('description = the foo',
+                               'description = the new foo')
+                  + '\n[repo added]\n')
+    eq(confdiff.diffSections(old, new),
+       {'repo foo': set(['description']), 'repo added': set()})
+
+def test_unchanged():
+    got = _changes(BASE)
+    eq(got.full, False)
+    eq(got.repos, set())
+    eq(got.projects, False)
+    eq(got.groups, False)
+
+def test_global():
+    got = _changes(BASE.replace('[gitosis]\n', '[gitosis]\ngitweb = yes\n'))
+    eq(got.full, True)
+
+def test_repoSection():
+    got = _changes(BASE.replace('the foo', 'the new foo'))
+    eq(got.full, False)
+    eq(got.repos, set(['foo']))
+    eq(got.projects, True)
+    eq(got.groups, False)
+
+def test_grant():
+    got = _changes(BASE.replace('writable = foo bar', 'writable = foo thud'))
+    eq(got.repos, set(['foo', 'bar', 'thud']))
+    eq(got.projects, False)
+    eq(got.groups, False)
+
+def test_grant_pattern():
+    got = _changes(BASE.replace('readonly = baz squee-*', 'readonly = baz'))
+    eq(got.repos, set(['baz', 'squee-1', 'squee-2']))
+
+def test_members_closure():
+    # interns are in devs, and devs in qa
+    got = _changes(BASE.replace('members = alice', 'members = alice bob'))
+    eq(got.repos, set(['foo', 'bar', 'baz', 'squee-1', 'squee-2']))
+    eq(got.groups, True)
+
+def test_userName():
+    got = _changes(BASE.replace('John Doe', 'Johnny Doe'))
+    eq(got.repos, set())
+    eq(got.projects, True)
+
+def test_groupRemoved():
+    got = _changes(BASE.replace('[group others]\nmembers = wsmith\n'
+                                'readonly = unrelated\n', ''))
+    eq(got.repos, set(['unrelated']))
+    eq(got.groups, True)
+
+def test_alias():
+    old = BASE + '\n[alias docs]\nrepos = bar\n'
+    old = old.replace('readonly = unrelated', 'readonly = unrelated @docs')
+    got = _changes(old.replace('repos = bar', 'repos = baz'), old=old)
+    eq(got.repos, set(['bar', 'baz']))
@@ -0,0 +1,83 @@
+from nose.tools import eq_ as eq
+
+import os
+from ConfigParser import RawConfigParser
+from cStringIO import StringIO
+
+from gitosis import access
+from gitosis import explain
+from gitosis import serve
+from gitosis.test.util import maketemp
+
+def _config():
+    cfg = RawConfigParser()
+    cfg.add_section('group fooers')
+    cfg.set('group fooers', 'members', 'jdoe')
+    cfg.set('group fooers', 'readonly', 'foo/*')
+    cfg.add_section('group barers')
+    cfg.set('group barers', 'members', 'jdoe')
+    cfg.set('group barers', 'map writable bar', 'quux')
+    return cfg
+
+def test_fromEnviron():
+    eq(explain.fromEnviron({}), None)
+    eq(explain.fromEnviron({'GITOSIS_EXPLAIN': '0'}), None)
+    assert explain.fromEnviron({'GITOSIS_EXPLAIN': '1'}) is not None
+
+def test_pattern():
+    got = StringIO()
+    e = explain.Explainer(fp=got)
+    eq(access.resolveAccess(_config(), 'jdoe', 'foo/x.git', explain=e),
+       ('readonly', ('repositories', 'foo/x')))
+    lines = got.getvalue().splitlines()
+    eq(lines, [
+        "explain: 'jdoe' is in 3 groups, checking sections"
+        + " [user jdoe], [group fooers], [group barers], [group all]",
+        "explain: [group fooers] readonly matches 'foo/x' by pattern 'foo/*'",
+        "explain: 'jdoe' gets readonly access to 'foo/x'",
+        ])
+    eq(sorted(e.timings.keys()), ['map', 'membership', 'patterns'])
+
+def test_map():
+    got = StringIO()
+    e = explain.Explainer(fp=got)
+    eq(access.haveAccess(_config(), 'jdoe', 'writable', 'bar', explain=e),
+       ('repositories', 'quux'))
+    assert 'explain: [group barers] map writable bar = quux\n' \
+           in got.getvalue()
+
+def test_denied():
+    got = StringIO()
+    e = explain.Explainer(fp=got)
+    eq(access.resolveAccess(_config(), 'wsmith', 'foo/x', explain=e), None)
+    assert got.getvalue().endswith(
+        "explain: 'wsmith' has no access to 'foo/x'\n")
+
+def test_report():
+    got = StringIO()
+    e = explain.Explainer(fp=got)
+    e.timings = {'patterns': 0.002, 'config': 0.001, 'other': 0.0005}
+    e.report()
+    eq(got.getvalue(), '''\
+explain: config        1.000ms
+explain: patterns      2.000ms
+explain: other         0.500ms
+''')
+
+def test_serve_skipsCache():
+    class Cache(object):
+        def lookup(self, user, path):
+            raise AssertionError('cache consulted')
+        def store(self, user, path, result):
+            pass
+    got = StringIO()
+    e = explain.Explainer(fp=got)
+    tmp = maketemp()
+    os.makedirs(os.path.join(tmp, 'foo', 'x.git'))
+    cfg = _config()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'repositories', tmp)
+    eq(serve.serve(cfg, 'jdoe', "git-upload-pack 'foo/x'",
+                   cache=Cache(), explain=e),
+       "git-upload-pack '%s/foo/x.git'" % tmp)
+    assert "gets readonly access" in got.getvalue()
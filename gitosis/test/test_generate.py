@@ -0,0 +1,64 @@
+from nose.tools import eq_ as eq
+
+import os
+from ConfigParser import RawConfigParser
+
+from gitosis import generate
+from gitosis.test.util import maketemp, readFile, writeFile
+
+def test_getWorkers_default():
+    cfg = RawConfigParser()
+    eq(generate.getWorkers(cfg), 1)
+
+def test_getWorkers():
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'generate-workers', '8')
+    eq(generate.getWorkers(cfg), 8)
+    cfg.set('gitosis', 'generate-workers', '0')
+    eq(generate.getWorkers(cfg), 1)
+
+def test_getPool():
+    cfg = RawConfigParser()
+    eq(generate.getPool(cfg), 'thread')
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'generate-pool', 'process')
+    eq(generate.getPool(cfg), 'process')
+    cfg.set('gitosis', 'generate-pool', 'fibers')
+    eq(generate.getPool(cfg), 'thread')
+
+def test_serial_order():
+    got = []
+    def stage(name, tasks):
+        def run():
+            got.append(name)
+            return [(got.append, ('%s.%d' % (name, i),))
+                    for i in range(tasks)]
+        return run
+    generate.Engine().run([stage('a', 2), stage('b', 0), stage('c', 1)])
+    eq(got, ['a', 'a.0', 'a.1', 'b', 'c', 'c.0'])
+
+def _tasks(tmp, count):
+    return [(writeFile, (os.path.join(tmp, 'f%d' % i), 'data %d\n' % i))
+            for i in range(count)]
+
+def _check(tmp, count):
+    eq(sorted(os.listdir(tmp)), sorted(['f%d' % i for i in range(count)]))
+    for i in range(count):
+        eq(readFile(os.path.join(tmp, 'f%d' % i)), 'data %d\n' % i)
+
+def test_parallel_threads():
+    tmp = maketemp()
+    engine = generate.Engine(workers=4, pool='thread')
+    engine.run([
+            lambda: _tasks(tmp, 20),
+            lambda: None,
+            lambda: writeFile(os.path.join(tmp, 'f20'), 'data 20\n'),
+            ])
+    _check(tmp, 21)
+
+def test_parallel_processes():
+    tmp = maketemp()
+    engine = generate.Engine(workers=3, pool='process')
+    engine.run([lambda: _tasks(tmp, 10)])
+    _check(tmp, 10)
@@ -186,3 +186,26 @@ def test_git_daemon_export_ok_allowed_all():
     eq(exported(os.path.join(tmp, 'foo.git')), True)
     eq(exported(os.path.join(tmp, 'quux.git')), True)
     eq(exported(os.path.join(tmp, 'thud.git')), False)
+
+def test_git_daemon_export_ok_allowed_all_pattern():
+    tmp = maketemp()
+
+    for repo in [
+        'squee-1.git',
+        'squee-2.git',
+        'other.git',
+        ]:
+        path = os.path.join(tmp, repo)
+        os.mkdir(path)
+
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'repositories', tmp)
+    cfg.add_section('defaults')
+    cfg.set('defaults', 'daemon-if-all', 'yes')
+    cfg.add_section('group all')
+    cfg.set('group all', 'readonly', 'squee-*')
+    gitdaemon.set_export_ok(config=cfg)
+    eq(exported(os.path.join(tmp, 'squee-1.git')), True)
+    eq(exported(os.path.join(tmp, 'squee-2.git')), True)
+    eq(exported(os.path.join(tmp, 'other.git')), False)
@@ -4,6 +4,8 @@ from ConfigParser import RawConfigParser
 from cStringIO import StringIO
 
 from gitosis import group
+from gitosis import lazyconfig
+from gitosis.test import util
 
 def test_no_emptyConfig():
     cfg = RawConfigParser()
@@ -158,3 +160,115 @@ foo: a b c d
 bar: c d
 baz: 
 ''')
+
+def test_index_cycle():
+    cfg = RawConfigParser()
+    cfg.add_section('group a')
+    cfg.set('group a', 'members', 'jdoe @c')
+    cfg.add_section('group b')
+    cfg.set('group b', 'members', '@a')
+    cfg.add_section('group c')
+    cfg.set('group c', 'members', '@b')
+    cfg.add_section('group d')
+    cfg.set('group d', 'members', '@all')
+    eq(list(group.getMembership(config=cfg, user='jdoe')),
+       ['a', 'b', 'c', 'd', 'all'])
+
+def test_index_deep():
+    cfg = RawConfigParser()
+    cfg.add_section('group g0')
+    cfg.set('group g0', 'members', 'jdoe')
+    for i in xrange(1, 3000):
+        cfg.add_section('group g%d' % i)
+        cfg.set('group g%d' % i, 'members', '@g%d' % (i-1))
+    got = list(group.getMembership(config=cfg, user='jdoe'))
+    eq(len(got), 3001)
+    eq(got[-2], 'g2999')
+
+def test_index_reused():
+    cfg = RawConfigParser()
+    cfg.add_section('group hackers')
+    cfg.set('group hackers', 'members', 'jdoe')
+    first = group.getMembershipIndex(cfg)
+    assert group.getMembershipIndex(cfg) is first
+    cfg.set('group hackers', 'members', 'wsmith')
+    second = group.getMembershipIndex(cfg)
+    assert second is not first
+    eq(list(group.getMembership(config=cfg, user='jdoe')), ['all'])
+    eq(list(group.getMembership(config=cfg, user='wsmith')),
+       ['hackers', 'all'])
+
+def test_index_lazyconfig():
+    cfg = lazyconfig.LazyConfigParser()
+    cfg.add_section('group hackers')
+    cfg.set('group hackers', 'members', 'jdoe')
+    first = group.getMembershipIndex(cfg)
+    assert group.getMembershipIndex(cfg) is first
+    cfg.set('group hackers', 'members', 'wsmith')
+    eq(list(group.getMembership(config=cfg, user='wsmith')),
+       ['hackers', 'all'])
+
+def test_listMembers_nested():
+    cfg = RawConfigParser()
+    cfg.add_section('group foo')
+    cfg.set('group foo', 'members', 'a @bar @all')
+    cfg.add_section('group bar')
+    cfg.set('group bar', 'members', 'b @baz')
+    cfg.add_section('group baz')
+    cfg.set('group baz', 'members', 'c @missing')
+    cfg.add_section('group all')
+    cfg.set('group all', 'members', 'ignored')
+    got = set(['x'])
+    group.listMembers(cfg, 'foo', got)
+    eq(sorted(got), ['@all', '@bar', '@baz', '@missing', 'a', 'b', 'c', 'x'])
+
+def test_listMembers_memoized():
+    cfg = RawConfigParser()
+    cfg.add_section('group foo')
+    cfg.set('group foo', 'members', 'a @bar')
+    cfg.add_section('group bar')
+    cfg.set('group bar', 'members', 'b')
+    group.listMembers(cfg, 'foo', set())
+    index = group.getMembershipIndex(cfg)
+    eq(sorted(index.expansion.keys()), ['bar', 'foo'])
+    assert index.expand('bar') is index.expansion['bar']
+
+class CountingConfig(lazyconfig.LazyConfigParser):
+    scans = 0
+
+    def sections(self):
+        self.scans += 1
+        return lazyconfig.LazyConfigParser.sections(self)
+
+def test_listMembers_noRescan():
+    cfg = CountingConfig()
+    cfg.add_section('group foo')
+    cfg.set('group foo', 'members', 'a @bar')
+    cfg.add_section('group bar')
+    cfg.set('group bar', 'members', 'b')
+    group.listMembers(cfg, 'foo', set())
+    eq(cfg.scans, 1)
+    got = set()
+    group.listMembers(cfg, 'bar', got)
+    group.listMembers(cfg, 'foo', got)
+    eq(cfg.scans, 1)
+    eq(sorted(got), ['@bar', 'a', 'b'])
+
+def test_listMembers_cycle():
+    cfg = RawConfigParser()
+    cfg.add_section('group foo')
+    cfg.set('group foo', 'members', 'a @bar')
+    cfg.add_section('group bar')
+    cfg.set('group bar', 'members', 'b @baz')
+    cfg.add_section('group baz')
+    cfg.set('group baz', 'members', '@bar')
+    e = util.assert_raises(group.GroupCycleError,
+                           group.listMembers, cfg, 'foo', set())
+    eq(str(e), 'Group membership cycle: bar -> baz -> bar')
+
+def test_groupList_cycle():
+    cfg = RawConfigParser()
+    cfg.add_section('group foo')
+    cfg.set('group foo', 'members', '@foo')
+    assert_raises(group.GroupCycleError,
+                  group.generate_group_list_fp, config=cfg, fp=StringIO())
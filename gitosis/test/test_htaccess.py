@@ -103,3 +103,28 @@ def test_htaccess_disabled():
     cfg.set('gitosis', 'repositories', tmp)
     eq(htaccess.gen_htaccess_if_enabled(config=cfg),False)
     exported(path, '')
+
+def test_htaccess_export_ok_pattern():
+    tmp = maketemp()
+    foo = os.path.join(tmp, 'foo')
+    os.mkdir(foo)
+    path = os.path.join(foo, 'bar.git')
+    os.mkdir(path)
+    other = os.path.join(tmp, 'baz.git')
+    os.mkdir(other)
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'repositories', tmp)
+    cfg.add_section('group some')
+    cfg.set('group some', 'writable', 'foo/*')
+    cfg.add_section('user jdoe')
+    cfg.set('user jdoe', 'readonly', 'foo/b?r')
+    htaccess.gen_htaccess(config=cfg)
+    exported(path, '''\
+Require user jdoe
+Require group some
+''')
+    exported(other, '''\
+Order allow,deny
+Deny from all
+''')
@@ -111,11 +111,18 @@ def test_init_admin_repository():
         tmp,
         'admin.git',
         'hooks',
-        'post-update',
+        'post-receive',
         )
     util.check_mode(hook, 0755, is_file=True)
     got = util.readFile(hook).splitlines()
-    assert 'gitosis-run-hook post-update' in got
+    assert 'gitosis-run-hook post-receive' in got
+    hook = os.path.join(
+        tmp,
+        'admin.git',
+        'hooks',
+        'post-update',
+        )
+    util.check_mode(hook, 0755, is_file=True)
     export_dir = os.path.join(tmp, 'export')
     repository.export(git_dir=admin_repository,
                       path=export_dir)
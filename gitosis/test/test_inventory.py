@@ -0,0 +1,93 @@
+from nose.tools import eq_ as eq
+
+import os
+from ConfigParser import RawConfigParser
+
+from gitosis import gitdaemon
+from gitosis import gitweb
+from gitosis import inventory
+from gitosis.test.util import mkdir, maketemp, writeFile
+
+def _config(tmp):
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'repositories', tmp)
+    return cfg
+
+def _tree():
+    tmp = maketemp()
+    for path in ['foo.git', 'plain', 'sub', 'sub/bar.git', 'sub/deeper',
+                 'sub/deeper/baz.git', 'elsewhere', 'elsewhere/hidden.git']:
+        mkdir(os.path.join(tmp, path))
+    writeFile(os.path.join(tmp, 'README'), 'hello\n')
+    os.symlink('sub/bar.git', os.path.join(tmp, 'linked.git'))
+    os.symlink('elsewhere', os.path.join(tmp, 'linkdir'))
+    os.symlink('nowhere', os.path.join(tmp, 'dangling.git'))
+    return tmp
+
+def test_repos():
+    tmp = _tree()
+    cfg = _config(tmp)
+    got = inventory.RepositoryInventory(cfg)
+    eq(sorted(got.repos), sorted(gitdaemon.walk_repos(cfg)))
+    eq(sorted([name for (dirpath, repo, name) in got.repos]),
+       ['elsewhere/hidden', 'foo', 'linked', 'sub/bar', 'sub/deeper/baz'])
+
+def test_repos_missing():
+    tmp = maketemp()
+    got = inventory.RepositoryInventory(_config(os.path.join(tmp, 'nope')))
+    eq(got.repos, [])
+    eq(got.exists('foo.git'), False)
+    eq(got.listings, 1)
+
+def test_exists():
+    tmp = _tree()
+    got = inventory.RepositoryInventory(_config(tmp))
+    stats = got.stats
+    for path in ['foo.git', 'plain', 'README', 'linked.git', 'linkdir',
+                 'sub/bar.git', 'sub/deeper/baz.git']:
+        eq(got.exists(path), True, path)
+    for path in ['bar.git', 'sub/foo.git', 'dangling.git', 'plain/x.git']:
+        eq(got.exists(path), False, path)
+    eq(got.stats, stats)
+
+def test_exists_unlisted():
+    tmp = _tree()
+    got = inventory.RepositoryInventory(_config(tmp))
+    stats = got.stats
+    # not walked into, so these go to the disk
+    eq(got.exists('linkdir/hidden.git'), True)
+    eq(got.exists('foo.git/nothing'), False)
+    eq(got.exists('sub/../foo.git'), True)
+    eq(got.exists('./foo.git'), True)
+    eq(got.stats, stats + 4)
+
+def test_stats():
+    tmp = _tree()
+    got = inventory.RepositoryInventory(_config(tmp))
+    # the top, sub, sub/deeper, plain and elsewhere; not linkdir or
+    # the repositories
+    eq(got.listings, 5)
+    if inventory.scandir is None:
+        # every entry, and the three symlinks again
+        eq(got.stats, 12 + 3)
+
+def test_refresh():
+    tmp = maketemp()
+    got = inventory.RepositoryInventory(_config(tmp))
+    eq(got.repos, [])
+    mkdir(os.path.join(tmp, 'foo.git'))
+    eq(got.exists('foo.git'), False)
+    got.refresh()
+    eq(got.repos, [(tmp, 'foo.git', 'foo')])
+    eq(got.exists('foo.git'), True)
+    eq(got.listings, 2)
+
+def test_enum_cfg_repos():
+    tmp = _tree()
+    cfg = _config(tmp)
+    for name in ['foo', 'sub/bar', 'plain', 'missing']:
+        cfg.add_section('repo %s' % name)
+    got = inventory.RepositoryInventory(cfg)
+    eq(list(gitweb.enum_cfg_repos(cfg, got)),
+       list(gitweb.enum_cfg_repos(cfg)))
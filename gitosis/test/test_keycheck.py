@@ -0,0 +1,120 @@
+from nose.tools import eq_ as eq
+
+import base64
+import struct
+import threading
+
+from gitosis import keycheck
+from gitosis.test import util
+
+def _string(s):
+    return struct.pack('>I', len(s)) + s
+
+def _key(*fields):
+    return '%s %s comment@host' % (
+        fields[0], base64.b64encode(''.join([_string(f) for f in fields])))
+
+ED25519 = _key('ssh-ed25519', 'k' * 32)
+RSA = _key('ssh-rsa', '\x01\x00\x01', '\x00' + '\xff' * 128)
+ECDSA = _key('ecdsa-sha2-nistp256', 'nistp256', '\x04' + 'q' * 64)
+
+def _reason(line):
+    e = util.assert_raises(keycheck.InvalidKeyError,
+                           keycheck.validateKey, line)
+    return e.args[0]
+
+def test_valid():
+    for key in [ED25519, RSA, ECDSA]:
+        eq(keycheck.validateKey(key), key)
+
+def test_whitespace():
+    eq(keycheck.validateKey('  %s \r' % ED25519), ED25519)
+
+def test_noComment():
+    key = ' '.join(ED25519.split()[:2])
+    eq(keycheck.validateKey(key), key)
+
+def test_skipped():
+    eq(keycheck.validateKey(''), None)
+    eq(keycheck.validateKey('   '), None)
+    eq(keycheck.validateKey('# %s' % ED25519), None)
+
+def test_options():
+    eq(_reason('no-pty %s' % ED25519), 'key options are not allowed')
+    eq(_reason('command="sh",no-pty %s' % ED25519),
+       'key options are not allowed')
+
+def test_unknownType():
+    eq(_reason('ssh-foo AAAA'), "unknown key type 'ssh-foo'")
+
+def test_noKey():
+    eq(_reason('ssh-ed25519'), 'no key')
+
+def test_badBase64():
+    eq(_reason('ssh-ed25519 AAA!'), 'bad base64')
+    eq(_reason('ssh-ed25519 AAAAA'), 'bad base64')
+
+def test_control():
+    eq(_reason(ED25519 + '\0'), 'control characters')
+
+def test_typeMismatch():
+    key = _key('ssh-rsa', 'k' * 32).replace('ssh-rsa', 'ssh-ed25519', 1)
+    eq(_reason(key), "key is not of type 'ssh-ed25519'")
+
+def test_truncated():
+    (keytype, blob, comment) = ED25519.split()
+    raw = base64.b64decode(blob)[:-1]
+    eq(_reason('%s %s' % (keytype, base64.b64encode(raw))), 'truncated key')
+
+def test_extraFields():
+    eq(_reason(_key('ssh-ed25519', 'k' * 32, 'more')),
+       'malformed ssh-ed25519 key')
+
+def test_shortEd25519():
+    eq(_reason(_key('ssh-ed25519', 'k' * 31)), 'malformed ssh-ed25519 key')
+
+def test_shortRSA():
+    eq(_reason(_key('ssh-rsa', '\x01\x00\x01', '\x00' + '\xff' * 64)),
+       'RSA key too short')
+
+def test_wrongCurve():
+    eq(_reason(_key('ecdsa-sha2-nistp256', 'nistp384', '\x04')),
+       "wrong curve for ecdsa-sha2-nistp256")
+
+def test_checkKeyFile():
+    eq(keycheck.checkKeyFile('%s\n\njunk\n# comment\n%s' % (ED25519, RSA)),
+       ([ED25519, RSA], [(3, "unknown key type 'junk'")]))
+
+def test_checkKeyFiles_parallel():
+    contents = ['%s\n%s\nno-pty %s\n' % (ED25519, RSA, ECDSA)] * 50
+    old = (keycheck.PARALLEL_THRESHOLD, keycheck.multiprocessing.cpu_count)
+    keycheck.PARALLEL_THRESHOLD = 10
+    keycheck.multiprocessing.cpu_count = lambda: 2
+    try:
+        got = keycheck.checkKeyFiles(contents)
+    finally:
+        (keycheck.PARALLEL_THRESHOLD,
+         keycheck.multiprocessing.cpu_count) = old
+    eq(got, map(keycheck.checkKeyFile, contents))
+    eq(got[0], ([ED25519, RSA], [(3, 'key options are not allowed')]))
+
+def test_checkKeyFiles_thread():
+    contents = ['%s\n%s\nno-pty %s\n' % (ED25519, RSA, ECDSA)] * 50
+    old = (keycheck.PARALLEL_THRESHOLD, keycheck.multiprocessing.cpu_count,
+           keycheck.multiprocessing.Pool)
+    keycheck.PARALLEL_THRESHOLD = 10
+    keycheck.multiprocessing.cpu_count = lambda: 2
+    def no_pool(*a, **kw):
+        raise AssertionError('forked from a thread')
+    keycheck.multiprocessing.Pool = no_pool
+    got = []
+    try:
+        thread = threading.Thread(
+            target=lambda: got.append(keycheck.checkKeyFiles(contents)))
+        thread.start()
+        thread.join()
+    finally:
+        (keycheck.PARALLEL_THRESHOLD,
+         keycheck.multiprocessing.cpu_count,
+         keycheck.multiprocessing.Pool) = old
+    eq(got, [map(keycheck.checkKeyFile, contents)])
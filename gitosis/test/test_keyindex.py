@@ -0,0 +1,133 @@
+from nose.tools import eq_ as eq
+
+import base64
+import hashlib
+import os
+import struct
+
+from gitosis import keyindex
+from gitosis import lazyconfig
+from gitosis import ssh
+from gitosis.test.util import mkdir, maketemp, writeFile, readFile
+
+def _string(s):
+    return struct.pack('>I', len(s)) + s
+
+def _key(seed):
+    blob = _string('ssh-ed25519') + _string(hashlib.sha256(seed).digest())
+    return 'ssh-ed25519 %s %s@example.com' % (base64.b64encode(blob), seed)
+
+KEY_1 = _key('jdoe')
+KEY_2 = _key('wsmith')
+KEY_3 = _key('alice')
+
+def test_parseKey():
+    eq(keyindex.parseKey(KEY_1), tuple(KEY_1.split()[:2]))
+    eq(keyindex.parseKey('no-pty ' + KEY_1), tuple(KEY_1.split()[:2]))
+    eq(keyindex.parseKey(''), None)
+    eq(keyindex.parseKey('# ' + KEY_1), None)
+    eq(keyindex.parseKey('junk'), None)
+
+def test_fingerprint():
+    # ssh-keygen -lf agrees
+    blob = base64.b64encode('\0\0\0\x0bssh-ed25519' + '\0' * 32)
+    eq(keyindex.fingerprint(blob),
+       'SHA256:' + base64.b64encode(
+           hashlib.sha256(base64.b64decode(blob)).digest()
+           ).rstrip('='))
+    assert '=' not in keyindex.fingerprint(blob)
+
+def test_indexKeys():
+    entries = keyindex.indexKeys([
+        ('wsmith', KEY_2),
+        ('jdoe', KEY_1),
+        ('jdoe', ''),
+        ])
+    eq(sorted([(user, key) for (fp, user, key) in entries]),
+       [('jdoe', KEY_1), ('wsmith', KEY_2)])
+    eq([fp for (fp, user, key) in entries],
+       sorted([keyindex.fingerprint(KEY_1.split()[1]),
+               keyindex.fingerprint(KEY_2.split()[1])]))
+
+def test_indexKeys_duplicate():
+    # the first one listed, like in authorized_keys
+    entries = keyindex.indexKeys([
+        ('wsmith', KEY_1),
+        ('jdoe', KEY_1),
+        ('jdoe', KEY_1),
+        ])
+    fp = keyindex.fingerprint(KEY_1.split()[1])
+    eq(entries, [(fp, 'wsmith', KEY_1)])
+
+def test_indexKeys_malformed():
+    entries = keyindex.indexKeys([
+        ('jdoe', 'ssh-rsa AAA'),
+        ])
+    eq(entries, [])
+
+def _writeIndex(tmp, keys):
+    keydir = os.path.join(tmp, 'keydir')
+    mkdir(keydir)
+    for (user, key) in keys:
+        writeFile(os.path.join(keydir, '%s.pub' % user), key + '\n')
+    path = os.path.join(tmp, 'keys.index')
+    keyindex.writeKeyIndex(path=path, keydir=keydir)
+    return path
+
+def test_writeKeyIndex_duplicate():
+    # jdoe-x.pub sorts before jdoe.pub, but jdoe before jdoe-x
+    tmp = maketemp()
+    path = _writeIndex(tmp, [('jdoe', KEY_1), ('jdoe-x', KEY_1)])
+    authorized_keys = os.path.join(tmp, 'authorized_keys')
+    ssh.writeAuthorizedKeys(path=authorized_keys,
+                            keydir=os.path.join(tmp, 'keydir'))
+    eq(keyindex.lookup(path, keyindex.fingerprint(KEY_1.split()[1])),
+       ('jdoe-x', KEY_1))
+    eq(readFile(authorized_keys).count(KEY_1), 1)
+    assert 'gitosis-serve jdoe-x"' in readFile(authorized_keys)
+
+def test_writeKeyIndex():
+    tmp = maketemp()
+    path = _writeIndex(tmp, [('jdoe', KEY_1), ('wsmith', KEY_2)])
+    lines = readFile(path).splitlines()
+    eq(len(lines), 2)
+    eq(lines, sorted(lines))
+    eq(sorted([line.split('\t', 2)[1:] for line in lines]),
+       [['jdoe', KEY_1], ['wsmith', KEY_2]])
+
+def test_lookup():
+    tmp = maketemp()
+    path = _writeIndex(tmp, [('jdoe', KEY_1), ('wsmith', KEY_2)])
+    eq(keyindex.lookup(path, keyindex.fingerprint(KEY_1.split()[1])),
+       ('jdoe', KEY_1))
+    eq(keyindex.lookup(path, keyindex.fingerprint(KEY_2.split()[1])),
+       ('wsmith', KEY_2))
+    eq(keyindex.lookup(path, keyindex.fingerprint(KEY_3.split()[1])),
+       None)
+
+def test_lookup_many():
+    tmp = maketemp()
+    keys = [('u%d' % i, _key('k%d' % i)) for i in xrange(500)]
+    path = _writeIndex(tmp, keys)
+    for (user, key) in keys:
+        eq(keyindex.lookup(path, keyindex.fingerprint(key.split()[1])),
+           (user, key))
+    eq(keyindex.lookup(path, 'SHA256:'), None)
+    eq(keyindex.lookup(path, 'SHA256:~'), None)
+
+def test_lookup_noIndex():
+    tmp = maketemp()
+    eq(keyindex.lookup(os.path.join(tmp, 'keys.index'), 'SHA256:x'), None)
+
+def test_lookup_line():
+    tmp = maketemp()
+    path = _writeIndex(tmp, [('jdoe', KEY_1)])
+    (user, key) = keyindex.lookup(
+        path, keyindex.fingerprint(KEY_1.split()[1]))
+    eq(ssh.TEMPLATE % dict(user=user, key=key),
+       list(ssh.generateAuthorizedKeys([('jdoe', KEY_1)]))[1])
+
+def test_main_lazyConfig():
+    # only the [gitosis] section is needed on every login
+    cfg = keyindex.Main().create_config(options=None)
+    assert isinstance(cfg, lazyconfig.LazyConfigParser)
@@ -0,0 +1,175 @@
+from nose.tools import eq_ as eq
+
+import os
+from ConfigParser import RawConfigParser, NoSectionError, \
+     MissingSectionHeaderError
+from cStringIO import StringIO
+
+from gitosis import lazyconfig
+from gitosis.test.util import maketemp, writeFile, assert_raises
+
+CONFIG = """\
+# leading comment
+
+[gitosis]
+loglevel = DEBUG
+
+[group quux]
+members = jdoe wsmith
+writable = foo bar
+  baz/thud
+
+[user jdoe]
+readonly = xyzzy
+map writable visiblename1 = actualname1
+
+[group quux]
+readonly = extra
+"""
+
+def _open(path):
+    cfg = lazyconfig.LazyConfigParser()
+    f = file(path)
+    try:
+        cfg.readfp(f)
+    finally:
+        f.close()
+    return cfg
+
+def _reference(content):
+    cfg = RawConfigParser()
+    cfg.readfp(StringIO(content))
+    return cfg
+
+def test_build_index():
+    (order, spans) = lazyconfig.build_index(CONFIG)
+    eq(order, ('gitosis', 'group quux', 'user jdoe'))
+    eq(len(spans['group quux']), 2)
+    eq(CONFIG[slice(*spans[None][0])], '# leading comment\n\n')
+    (start, end) = spans['user jdoe'][0]
+    assert CONFIG[start:end].startswith('[user jdoe]\n')
+
+def test_sameAsRawConfigParser():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'gitosis.conf')
+    writeFile(path, CONFIG)
+    got = _open(path)
+    want = _reference(CONFIG)
+    eq(got.sections(), want.sections())
+    for section in want.sections():
+        eq(got.items(section), want.items(section))
+
+def test_parsesOnlyWhatIsAsked():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'gitosis.conf')
+    writeFile(path, CONFIG)
+    cfg = _open(path)
+    eq(cfg._sections.keys(), [])
+    eq(cfg.get('user jdoe', 'readonly'), 'xyzzy')
+    eq(cfg._sections.keys(), ['user jdoe'])
+    assert cfg.has_section('gitosis')
+    eq(cfg._sections.keys(), ['user jdoe'])
+
+def test_noSection():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'gitosis.conf')
+    writeFile(path, CONFIG)
+    cfg = _open(path)
+    assert_raises(NoSectionError, cfg.get, 'group nonexistent', 'members')
+
+def test_indexCached():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'gitosis.conf')
+    writeFile(path, CONFIG)
+    first = _open(path)
+    assert os.path.exists(os.path.join(tmp, 'gitosis.conf.index'))
+    second = _open(path)
+    eq(second.fingerprint, first.fingerprint)
+    eq(second.get('group quux', 'readonly'), 'extra')
+
+def test_indexStale():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'gitosis.conf')
+    writeFile(path, CONFIG)
+    first = _open(path)
+    writeFile(path, '[user jdoe]\nreadonly = other\n')
+    second = _open(path)
+    assert second.fingerprint != first.fingerprint
+    eq(second.sections(), ['user jdoe'])
+    eq(second.get('user jdoe', 'readonly'), 'other')
+
+def test_indexStaleInPlace():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'gitosis.conf')
+    writeFile(path, CONFIG)
+    os.utime(path, (1234567890, 1234567890))
+    first = _open(path)
+    # same size, same inode, and the mtime set back
+    f = file(path, 'r+')
+    try:
+        f.write(CONFIG.replace('extra', 'EXTRA'))
+    finally:
+        f.close()
+    os.utime(path, (1234567890, 1234567890))
+    second = _open(path)
+    assert second.fingerprint != first.fingerprint
+    eq(second.get('group quux', 'readonly'), 'EXTRA')
+    eq(lazyconfig.fingerprint(path), second.fingerprint)
+
+def test_indexCorrupt():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'gitosis.conf')
+    writeFile(path, CONFIG)
+    writeFile(os.path.join(tmp, 'gitosis.conf.index'), 'garbage')
+    cfg = _open(path)
+    eq(cfg.get('gitosis', 'loglevel'), 'DEBUG')
+
+def test_emptyFile():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'gitosis.conf')
+    writeFile(path, '')
+    cfg = _open(path)
+    eq(cfg.sections(), [])
+
+def test_missingSectionHeader():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'gitosis.conf')
+    writeFile(path, 'foo = bar\n[gitosis]\n')
+    assert_raises(MissingSectionHeaderError, _open, path)
+
+def test_defaults():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'gitosis.conf')
+    writeFile(path, '[DEFAULT]\nfoo = bar\n\n[gitosis]\n')
+    cfg = _open(path)
+    eq(cfg.sections(), ['gitosis'])
+    eq(cfg.get('gitosis', 'foo'), 'bar')
+
+def test_notAFile():
+    cfg = lazyconfig.LazyConfigParser()
+    cfg.readfp(StringIO(CONFIG))
+    eq(cfg.get('user jdoe', 'readonly'), 'xyzzy')
+
+def test_modify():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'gitosis.conf')
+    writeFile(path, CONFIG)
+    cfg = _open(path)
+    cfg.set('user jdoe', 'writable', 'foo')
+    cfg.add_section('user wsmith')
+    assert cfg.remove_section('gitosis')
+    eq(cfg.sections(), ['group quux', 'user jdoe', 'user wsmith'])
+    eq(cfg.get('user jdoe', 'readonly'), 'xyzzy')
+    eq(cfg.get('user jdoe', 'writable'), 'foo')
+
+def test_readMore():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'gitosis.conf')
+    writeFile(path, CONFIG)
+    more = os.path.join(tmp, 'more.conf')
+    writeFile(more, '[user jdoe]\nwritable = foo\n')
+    cfg = _open(path)
+    cfg.read(more)
+    eq(cfg.get('user jdoe', 'readonly'), 'xyzzy')
+    eq(cfg.get('user jdoe', 'writable'), 'foo')
+    eq(cfg.get('gitosis', 'loglevel'), 'DEBUG')
@@ -0,0 +1,88 @@
+from nose.tools import eq_ as eq
+
+from fnmatch import fnmatch
+
+from gitosis import matcher
+
+PATTERNS = [
+    'foo',
+    'baz/thud',
+    'a.b+c',
+    'squee-*',
+    'team/*',
+    'deep/er**',
+    'x?z',
+    '[!a]bc',
+    'half[open',
+    'mid*dle',
+    '*.old',
+    ]
+
+NAMES = [
+    'foo', 'fo', 'foox', 'baz/thud', 'baz/thud/x', 'a.b+c', 'aXb+c',
+    'squee-', 'squee-1', 'squee', 'team/a', 'team/a/b', 'team',
+    'deep/er', 'deep/erx', 'xyz', 'xz', 'bbc', 'abc', 'half[open',
+    'halfo', 'middle', 'mid/x/dle', 'foo.old', '.old', 'old',
+    ]
+
+def _check(patterns, names):
+    m = matcher.PatternMatcher(patterns)
+    for name in names:
+        want = False
+        for pattern in patterns:
+            if fnmatch(name, pattern):
+                want = True
+                break
+        eq(m.match(name), want, '%r against %r' % (name, patterns))
+
+def test_empty():
+    m = matcher.PatternMatcher([])
+    eq(m.match('foo'), False)
+
+def test_sameAsFnmatch():
+    _check(PATTERNS, NAMES)
+
+def test_sameAsFnmatch_eachPattern():
+    for pattern in PATTERNS:
+        _check([pattern], NAMES)
+
+def test_star():
+    m = matcher.PatternMatcher(['*'])
+    eq(m.match(''), True)
+    eq(m.match('any/thing'), True)
+
+def test_sorted():
+    m = matcher.PatternMatcher(PATTERNS)
+    eq(m.literals, set(['foo', 'baz/thud', 'a.b+c']))
+    eq(len(m.regexes), 1)
+    assert 's' in m.trie
+    assert 't' in m.trie
+    assert 'd' in m.trie
+
+def test_manyRegexes():
+    patterns = ['r%d?x*y' % i for i in xrange(matcher._REGEX_CHUNK * 2 + 1)]
+    m = matcher.PatternMatcher(patterns)
+    eq(len(m.regexes), 3)
+    eq(m.match('r1000axby'), True)
+    eq(m.match('r1001axb'), False)
+
+def test_compileOption_cached():
+    a = matcher.compileOption('foo bar\n  squee-*')
+    b = matcher.compileOption('foo bar\n  squee-*')
+    assert a is b
+    eq(a.match('squee-1'), True)
+    eq(a.match('bar'), True)
+
+def test_expandPatterns():
+    names = ['foo', 'foo/bar', 'foo/baz', 'fob', 'squee-1', 'squee-22',
+             'team/x/y', 'zap']
+    got = matcher.expandPatterns(
+        ['foo/*', 'fo?', 'squee-?', '*', 'zap', 'nope', 'team/*/y',
+         '[sz]*', 'squee-*2'],
+        names)
+    for (pattern, hits) in got.items():
+        eq(hits, sorted([n for n in names if fnmatch(n, pattern)]),
+           pattern)
+    eq(got['foo/*'], ['foo/bar', 'foo/baz'])
+    eq(got['nope'], [])
+    eq(got['squee-*2'], ['squee-22'])
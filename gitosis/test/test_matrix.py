@@ -0,0 +1,172 @@
+from nose.tools import eq_ as eq
+
+import random
+from ConfigParser import RawConfigParser
+from cStringIO import StringIO
+
+from gitosis import access
+from gitosis import group
+from gitosis import matrix
+from gitosis.test.util import assert_raises
+
+CONFIG = """\
+[group quux]
+members = jdoe wsmith @anothergroup
+writable = foo bar baz/thud
+readonly = xyzzy
+
+[group anothergroup]
+members = alice @third
+map writable visible = actual
+
+[group third]
+members = carol
+
+[group everyone]
+members = @all
+readonly = public
+
+[group all]
+writeable = scratch
+
+[user pat]
+writable = foo
+readonly = bar pats
+
+[repo unlisted]
+daemon = yes
+"""
+
+def _config():
+    cfg = RawConfigParser()
+    cfg.readfp(StringIO(CONFIG))
+    return cfg
+
+def test_bits():
+    eq(matrix._bits(0), [])
+    eq(matrix._bits(1), [0])
+    eq(matrix._bits((1 << 70) | (1 << 3)), [3, 70])
+
+def test_listRepositories():
+    m = matrix.AccessMatrix(_config())
+    eq(m.listRepositories('carol'),
+       (['actual', 'bar', 'baz/thud', 'foo', 'scratch'],
+        ['public', 'xyzzy']))
+    eq(m.listRepositories('pat'),
+       (['foo', 'scratch'], ['bar', 'pats', 'public']))
+    eq(m.listRepositories('nobody'), (['scratch'], ['public']))
+
+def test_iterRepositories():
+    m = matrix.AccessMatrix(_config())
+    got = list(m.iterRepositories('pat'))
+    eq([mode for (mode, name) in got],
+       ['writable', 'writable', 'readonly', 'readonly', 'readonly'])
+    eq(sorted(got), [('readonly', 'bar'), ('readonly', 'pats'),
+                     ('readonly', 'public'), ('writable', 'foo'),
+                     ('writable', 'scratch')])
+
+def test_listRepositories_visible():
+    m = matrix.AccessMatrix(_config(), visible=True)
+    eq(m.listRepositories('carol')[0],
+       ['bar', 'baz/thud', 'foo', 'scratch', 'visible'])
+
+def test_getAllAccess():
+    m = matrix.AccessMatrix(_config())
+    eq(m.getAllAccess('foo.git'),
+       (set(['pat']), set(['quux']),
+        set(['@quux', 'jdoe', 'wsmith', '@anothergroup', 'alice',
+             '@third', 'carol'])))
+    eq(m.getAllAccess('public'),
+       (set(), set(['everyone']), set(['@everyone', '@all'])))
+    eq(m.getAllAccess('unlisted'), (set(), set(), set()))
+    eq(m.getAllAccess('nonexistent'), (set(), set(), set()))
+
+def test_getAllAccess_sameAsAccess():
+    rand = random.Random(7)
+    for trial in xrange(50):
+        cfg = RawConfigParser()
+        for i in xrange(8):
+            section = 'group g%d' % i
+            cfg.add_section(section)
+            # no cycles, nested groups only point forward
+            members = [rand.choice(['u1', 'u2', 'u3', '@all']
+                                   + ['@g%d' % j for j in xrange(i+1, 8)])
+                       for _ in xrange(rand.randrange(4))]
+            cfg.set(section, 'members', ' '.join(members))
+            for mode in ['readonly', 'writable', 'writeable']:
+                repos = rand.sample(['r%d' % j for j in xrange(6)],
+                                    rand.randrange(3))
+                if repos:
+                    cfg.set(section, mode, ' '.join(repos))
+        cfg.add_section('user u1')
+        cfg.set('user u1', 'readonly', 'r0 r5')
+        table = access.getAccessTable(cfg)
+        m = matrix.AccessMatrix(cfg)
+        for j in xrange(6):
+            eq(m.getAllAccess('r%d' % j),
+               access.getAllAccess(cfg, table, 'r%d' % j))
+
+def test_userRow_sameAsAccess():
+    cfg = _config()
+    m = matrix.AccessMatrix(cfg)
+    for user in ['jdoe', 'alice', 'carol', 'pat', 'nobody']:
+        for (mode, modes) in [('readonly', ['readonly']),
+                              ('writable', ['writable', 'writeable'])]:
+            got = set(m.repos.lookup(m.userRow(user, mode)))
+            # map targets are only known by their visible name to
+            # haveAccess
+            got.discard('actual')
+            want = set()
+            for repo in m.repos.names:
+                for m2 in modes:
+                    if access.haveAccess(cfg, user, m2, repo) is not None:
+                        want.add(repo)
+            eq(got, want)
+
+def test_cycle_onlyWhenUsed():
+    cfg = RawConfigParser()
+    cfg.add_section('group loop')
+    cfg.set('group loop', 'members', '@loop')
+    cfg.set('group loop', 'readonly', 'bar')
+    cfg.add_section('user jdoe')
+    cfg.set('user jdoe', 'readonly', 'foo')
+    m = matrix.AccessMatrix(cfg)
+    eq(m.getAllAccess('foo'), (set(['jdoe']), set(), set()))
+    assert_raises(group.GroupCycleError, m.getAllAccess, 'bar')
+
+def test_patterns():
+    cfg = _config()
+    cfg.set('group third', 'readonly', 'third/*')
+    m = matrix.AccessMatrix(cfg, repos=['third/a', 'third/b', 'foo'])
+    eq(m.listRepositories('carol')[1],
+       ['public', 'third/a', 'third/b', 'xyzzy'])
+    eq(m.getAllAccess('third/a')[1], set(['third']))
+    # without a repository list, patterns are just names
+    m = matrix.AccessMatrix(cfg)
+    eq(m.getAllAccess('third/*')[1], set(['third']))
+    eq(m.getAllAccess('third/a'), (set(), set(), set()))
+
+def test_patterns_withLiteral():
+    cfg = RawConfigParser()
+    cfg.add_section('group fooers')
+    cfg.set('group fooers', 'writable', 'squee-*')
+    cfg.add_section('user jdoe')
+    cfg.set('user jdoe', 'writable', 'squee-1')
+    m = matrix.AccessMatrix(cfg, repos=['squee-1', 'squee-2', 'other'])
+    (users, groups, all_refs) = m.getAllAccess('squee-1.git')
+    eq(sorted(users), ['jdoe'])
+    eq(sorted(groups), ['fooers'])
+    (users, groups, all_refs) = m.getAllAccess('squee-2')
+    eq(sorted(users), [])
+    eq(sorted(groups), ['fooers'])
+    (users, groups, all_refs) = m.getAllAccess('other')
+    eq(sorted(groups), [])
+
+def test_alias():
+    cfg = _config()
+    cfg.add_section('alias docs')
+    cfg.set('alias docs', 'repos', 'manual website')
+    cfg.set('group third', 'writable', '@docs')
+    m = matrix.AccessMatrix(cfg)
+    eq(m.getAllAccess('website')[1], set(['third']))
+    assert 'manual' in m.listRepositories('carol')[0]
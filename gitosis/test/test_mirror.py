@@ -39,6 +39,21 @@ def test_get_mirrors_with_all():
     ok('git@github.com:res0nat0r/baz.git' in mirrors)
     eq(1, len(mirrors))
     
+def test_get_mirrors_with_alias():
+    cfg = get_config()
+    cfg.add_section('alias public')
+    cfg.set('alias public', 'repos', 'bar @docs')
+    cfg.add_section('alias docs')
+    cfg.set('alias docs', 'repos', 'manual')
+    cfg.add_section('mirror github')
+    cfg.set('mirror github', 'repos', '@public')
+    cfg.set('mirror github', 'uri', 'git@github.com:res0nat0r/%s.git')
+    eq(list(mirror.get_mirrors(cfg, 'manual')),
+       ['git@github.com:res0nat0r/manual.git'])
+    eq(list(mirror.get_mirrors(cfg, 'bar')),
+       ['git@github.com:res0nat0r/bar.git'])
+    eq(list(mirror.get_mirrors(cfg, 'baz')), [])
+
 def test_get_git_name():
     eq('foo', mirror.get_git_name('/home/git/repository', '/home/git/repository/foo.git'))
     
@@ -0,0 +1,59 @@
+from nose.tools import eq_ as eq
+
+import os
+from ConfigParser import RawConfigParser
+from cStringIO import StringIO
+
+from gitosis import access
+from gitosis import query
+
+def _config():
+    cfg = RawConfigParser()
+    cfg.add_section('group fooers')
+    cfg.set('group fooers', 'members', 'jdoe')
+    cfg.set('group fooers', 'writable', 'foo')
+    cfg.set('group fooers', 'map readonly quux', 'thing/quux')
+    return cfg
+
+def test_answer_ok():
+    checker = access.AccessChecker(_config())
+    eq(query.answer(checker, 'jdoe writable foo.git'),
+       'ok\trepositories\tfoo')
+
+def test_answer_map():
+    checker = access.AccessChecker(_config())
+    eq(query.answer(checker, 'jdoe readonly quux'),
+       'ok\trepositories\tthing/quux')
+
+def test_answer_deny():
+    checker = access.AccessChecker(_config())
+    eq(query.answer(checker, 'jdoe writable quux'), 'deny')
+    eq(query.answer(checker, 'wsmith readonly foo'), 'deny')
+
+def test_answer_error():
+    checker = access.AccessChecker(_config())
+    eq(query.answer(checker, 'jdoe foo'), 'error\texpected USER MODE PATH')
+    eq(query.answer(checker, 'jdoe push foo'), "error\tunknown mode 'push'")
+
+def test_answer_cache():
+    checker = access.AccessChecker(_config())
+    cache = {}
+    eq(query.answer(checker, 'jdoe writable foo', cache),
+       'ok\trepositories\tfoo')
+    eq(cache, {'jdoe writable foo': 'ok\trepositories\tfoo'})
+    cache['jdoe writable foo'] = 'deny'
+    eq(query.answer(checker, 'jdoe writable foo', cache), 'deny')
+
+def test_answer_all():
+    (r, w) = os.pipe()
+    os.write(w, 'jdoe writable foo\nwsmith readonly foo\njdoe readonly quux')
+    os.close(w)
+    out = StringIO()
+    try:
+        query.answer_all(_config(), r, out)
+    finally:
+        os.close(r)
+    eq(out.getvalue(),
+       'ok\trepositories\tfoo\n'
+       'deny\n'
+       'ok\trepositories\tthing/quux\n')
@@ -376,4 +376,55 @@ def test_mirror():
         path=export,
         )
     eq(os.listdir(export),
-       ['foo'])
\ No newline at end of file
+       ['foo'])
+def test_catFile():
+    tmp = maketemp()
+    git_dir = os.path.join(tmp, 'repo.git')
+    repository.init(path=git_dir)
+    repository.fast_import(
+        git_dir=git_dir,
+        committer='John Doe <jdoe@example.com>',
+        commit_msg='Stuff.',
+        files=[
+            ('foo', 'content'),
+            ('bar/quux', 'another\n'),
+            ('bar/empty', ''),
+            ],
+        )
+    catfile = repository.CatFile(git_dir)
+    try:
+        (sha1, type_, data) = catfile.read('HEAD:foo')
+        eq((type_, data), ('blob', 'content'))
+        eq(len(sha1), 40)
+        eq(catfile.read('HEAD:nonexistent'), None)
+        got = catfile.readMany(['HEAD:bar/quux', 'HEAD:nope', 'HEAD:bar/empty'])
+        eq([item and item[1:] for item in got],
+           [('blob', 'another\n'), None, ('blob', '')])
+        tree = catfile.readTree('HEAD:bar')
+        eq([(mode, name) for (mode, name, sha1) in tree],
+           [('100644', 'empty'), ('100644', 'quux')])
+        eq(catfile.read(tree[1][2])[2], 'another\n')
+        eq(catfile.readTree('HEAD:nope'), [])
+        assert_raises(repository.GitCatFileError,
+                      catfile.readTree, 'HEAD:foo')
+    finally:
+        catfile.close()
+
+def test_catFile_many():
+    tmp = maketemp()
+    git_dir = os.path.join(tmp, 'repo.git')
+    repository.init(path=git_dir)
+    repository.fast_import(
+        git_dir=git_dir,
+        committer='John Doe <jdoe@example.com>',
+        commit_msg='Stuff.',
+        files=[('f%d' % i, 'x' * 1000 + str(i)) for i in xrange(300)],
+        )
+    catfile = repository.CatFile(git_dir)
+    catfile.BATCH = 100
+    try:
+        got = catfile.readMany(['HEAD:f%d' % i for i in xrange(300)])
+    finally:
+        catfile.close()
+    eq([data for (sha1, type_, data) in got],
+       ['x' * 1000 + str(i) for i in xrange(300)])
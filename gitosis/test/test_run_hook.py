@@ -1,11 +1,12 @@
 from nose.tools import eq_ as eq
 
 import os
+import subprocess
 from ConfigParser import RawConfigParser
 from cStringIO import StringIO
 
-from gitosis import init, repository, run_hook
-from gitosis.test.util import maketemp, readFile
+from gitosis import init, lazyconfig, repository, run_hook, serve, shard, spool
+from gitosis.test.util import assert_raises, maketemp, readFile, writeFile
 
 def test_post_update_simple():
     tmp = maketemp()
@@ -54,11 +55,9 @@ description = blah blah
 description = auto-init me
 """),
             ('keydir/jdoe.pub',
-             'ssh-somealgo '
-             +'0123456789ABCDEFBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBB'
-             +'BBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBB'
-             +'BBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBB'
-             +'BBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBB= jdoe@host.example.com'),
+             'ssh-ed25519 '
+             +'AAAAC3NzaC1lZDI1NTE5AAAAIHaSw601QLuAPAILOu5mzYiHEjI06gxucUPArd'
+             +'c/9DHt jdoe@host.example.com'),
             ],
         )
     cfg = RawConfigParser()
@@ -84,7 +83,10 @@ description = auto-init me
     got = readFile(os.path.join(repos, 'initme.git', 'description'))
     eq(got, 'auto-init me\n')
     got = sorted(os.listdir(generated))
-    eq(got, ['groups', 'projects.list'])
+    eq(got, ['groups', 'keydir.manifest', 'keys.index', 'projects.list',
+             'shards'])
+    got = sorted(os.listdir(os.path.join(generated, 'shards')))
+    eq(got, ['jdoe.conf', 'theadmin.conf'])
     got = readFile(os.path.join(generated, 'projects.list'))
     eq(
         got,
@@ -105,5 +107,545 @@ gitosis-admin: theadmin
     got = os.listdir(ssh)
     eq(got, ['authorized_keys'])
     got = readFile(os.path.join(ssh, 'authorized_keys')).splitlines(True)
-    assert 'command="gitosis-serve jdoe",no-port-forwarding,no-X11-forwarding,no-agent-forwarding,no-pty ssh-somealgo 0123456789ABCDEFBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBB= jdoe@host.example.com\n' in got, \
+    assert 'command="gitosis-serve jdoe",no-port-forwarding,no-X11-forwarding,no-agent-forwarding,no-pty ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAIHaSw601QLuAPAILOu5mzYiHEjI06gxucUPArdc/9DHt jdoe@host.example.com\n' in got, \
         "SSH authorized_keys line for jdoe not found: %r" % got
+    # nothing checked out in the admin repository
+    for name in ['index', 'gitosis-export']:
+        assert not os.path.exists(os.path.join(admin_repository, name)), \
+            "%s written to the admin repository" % name
+
+def test_post_update_incremental():
+    tmp = maketemp()
+    repos = os.path.join(tmp, 'repositories')
+    os.mkdir(repos)
+    admin_repository = os.path.join(repos, 'gitosis-admin.git')
+    pubkey = (
+        'ssh-somealgo '
+        +'0123456789ABCDEFAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA'
+        +'AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA'
+        +'AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA'
+        +'AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA= fakeuser@fakehost')
+    init.init_admin_repository(
+        git_dir=admin_repository,
+        pubkey=pubkey,
+        user='theadmin',
+        )
+    repository.init(path=os.path.join(repos, 'foo.git'))
+    repository.init(path=os.path.join(repos, 'bar.git'))
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'repositories', repos)
+    generated = os.path.join(tmp, 'generated')
+    os.mkdir(generated)
+    cfg.set('gitosis', 'generate-files-in', generated)
+    ssh = os.path.join(tmp, 'ssh')
+    os.mkdir(ssh)
+    cfg.set(
+        'gitosis',
+        'ssh-authorized-keys-path',
+        os.path.join(ssh, 'authorized_keys'),
+        )
+
+    def push(conf, full=False):
+        repository.fast_import(
+            git_dir=admin_repository,
+            committer='John Doe <jdoe@example.com>',
+            commit_msg='stuff\n',
+            parent='refs/heads/master^0',
+            files=[('gitosis.conf', conf)],
+            )
+        run_hook.post_update(
+            cfg=cfg,
+            git_dir=admin_repository,
+            full=full,
+            )
+
+    conf = """\
+[group gitosis-admin]
+members = theadmin
+writable = gitosis-admin
+
+[repo foo]
+description = foo one
+
+[repo bar]
+description = bar one
+"""
+    push(conf)
+    eq(readFile(os.path.join(repos, 'foo.git', 'description')), 'foo one\n')
+    eq(readFile(os.path.join(repos, 'bar.git', 'description')), 'bar one\n')
+
+    # bar is not touched by the next change, so nobody notices this
+    os.unlink(os.path.join(repos, 'bar.git', 'description'))
+    conf = conf.replace('foo one', 'foo two')
+    push(conf)
+    eq(readFile(os.path.join(repos, 'foo.git', 'description')), 'foo two\n')
+    assert not os.path.exists(os.path.join(repos, 'bar.git', 'description'))
+
+    push(conf, full=True)
+    eq(readFile(os.path.join(repos, 'bar.git', 'description')), 'bar one\n')
+
+def _rev_parse(git_dir, rev):
+    child = subprocess.Popen(
+        args=['git', '--git-dir=%s' % git_dir, 'rev-parse', rev],
+        stdout=subprocess.PIPE,
+        close_fds=True,
+        )
+    got = child.stdout.read().strip()
+    eq(child.wait(), 0)
+    return got
+
+def test_read_updates():
+    got = run_hook.read_updates(StringIO(
+            'a b refs/heads/master\n\njunk\nc d refs/heads/other\n'))
+    eq(got, [('a', 'b', 'refs/heads/master'),
+             ('c', 'd', 'refs/heads/other')])
+
+class NoInput(object):
+    def __iter__(self):
+        raise AssertionError('must not read standard input')
+
+def test_hook_updates():
+    eq(run_hook.hook_updates('post-update', NoInput()), None)
+    eq(run_hook.hook_updates('post-receive', StringIO(
+                'a b refs/heads/master\n')),
+       [('a', 'b', 'refs/heads/master')])
+
+def test_post_update_refDiff():
+    tmp = maketemp()
+    repos = os.path.join(tmp, 'repositories')
+    os.mkdir(repos)
+    admin_repository = os.path.join(repos, 'gitosis-admin.git')
+    init.init_admin_repository(
+        git_dir=admin_repository,
+        pubkey='ssh-ed25519 '
+        +'AAAAC3NzaC1lZDI1NTE5AAAAID/EzP50WHDiwNmfcfMP8GVsje3UHMHX09N2sNvmheLz'
+        +' theadmin@host',
+        user='theadmin',
+        )
+    repository.init(path=os.path.join(repos, 'foo.git'))
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'repositories', repos)
+    generated = os.path.join(tmp, 'generated')
+    os.mkdir(generated)
+    cfg.set('gitosis', 'generate-files-in', generated)
+    ssh = os.path.join(tmp, 'ssh')
+    os.mkdir(ssh)
+    authorized_keys = os.path.join(ssh, 'authorized_keys')
+    cfg.set('gitosis', 'ssh-authorized-keys-path', authorized_keys)
+    description = os.path.join(repos, 'foo.git', 'description')
+
+    def push(files, ref='refs/heads/master'):
+        old = _rev_parse(admin_repository, 'refs/heads/master')
+        repository.fast_import(
+            git_dir=admin_repository,
+            committer='John Doe <jdoe@example.com>',
+            commit_msg='stuff\n',
+            parent='refs/heads/master^0',
+            files=files,
+            )
+        new = _rev_parse(admin_repository, 'refs/heads/master')
+        run_hook.post_update(
+            cfg=cfg,
+            git_dir=admin_repository,
+            updates=[(old, new, ref)],
+            )
+
+    conf = """\
+[group gitosis-admin]
+members = theadmin
+writable = gitosis-admin
+
+[repo foo]
+description = foo one
+"""
+    push([('gitosis.conf', conf)])
+    eq(readFile(description), 'foo one\n')
+    assert 'theadmin' in readFile(authorized_keys)
+
+    # neither config nor keys change
+    os.unlink(description)
+    os.unlink(authorized_keys)
+    push([('README', 'hello\n')])
+    assert not os.path.exists(description)
+    assert not os.path.exists(authorized_keys)
+
+    # only keys change
+    push([('keydir/jdoe.pub', 'ssh-ed25519 '
+           +'AAAAC3NzaC1lZDI1NTE5AAAAIItbnbDBPbJCVsgpqjZKqQxtLroxi5IypKuTE7lU01Vf'
+           +' jdoe@host\n')])
+    assert not os.path.exists(description)
+    assert 'jdoe@host' in readFile(authorized_keys)
+    eq(sorted(os.listdir(os.path.join(generated, 'shards'))),
+       ['jdoe.conf', 'theadmin.conf'])
+
+    # only the config changes
+    os.unlink(authorized_keys)
+    push([('gitosis.conf', conf.replace('foo one', 'foo two'))])
+    eq(readFile(description), 'foo two\n')
+    assert not os.path.exists(authorized_keys)
+
+    # the config says to put the keys elsewhere
+    moved = os.path.join(ssh, 'moved_keys')
+    push([('gitosis.conf', conf.replace('foo one', 'foo two')
+           + '\n[gitosis]\nssh-authorized-keys-path = %s\n' % moved)])
+    assert 'jdoe@host' in readFile(moved)
+
+    # some other branch
+    push([('gitosis.conf', conf.replace('foo one', 'foo three'))],
+         ref='refs/heads/other')
+    eq(readFile(description), 'foo two\n')
+
+def test_post_update_coalesced():
+    tmp = maketemp()
+    repos = os.path.join(tmp, 'repositories')
+    os.mkdir(repos)
+    admin_repository = os.path.join(repos, 'gitosis-admin.git')
+    init.init_admin_repository(
+        git_dir=admin_repository,
+        pubkey='ssh-ed25519 '
+        +'AAAAC3NzaC1lZDI1NTE5AAAAID/EzP50WHDiwNmfcfMP8GVsje3UHMHX09N2sNvmheLz'
+        +' theadmin@host',
+        user='theadmin',
+        )
+    repository.init(path=os.path.join(repos, 'foo.git'))
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'repositories', repos)
+    cfg.set('gitosis', 'generate-files-in', os.path.join(tmp, 'generated'))
+    cfg.set('gitosis', 'ssh-authorized-keys-path',
+            os.path.join(tmp, 'authorized_keys'))
+    description = os.path.join(repos, 'foo.git', 'description')
+
+    def push(files):
+        old = _rev_parse(admin_repository, 'refs/heads/master')
+        repository.fast_import(
+            git_dir=admin_repository,
+            committer='John Doe <jdoe@example.com>',
+            commit_msg='stuff\n',
+            parent='refs/heads/master^0',
+            files=files,
+            )
+        new = _rev_parse(admin_repository, 'refs/heads/master')
+        return spool.makeRequest(
+            config='unused',
+            git_dir=admin_repository,
+            updates=[(old, new, 'refs/heads/master')],
+            )
+
+    conf = """\
+[group gitosis-admin]
+members = theadmin
+writable = gitosis-admin
+
+[repo foo]
+description = foo one
+"""
+    first = push([('gitosis.conf', conf)])
+    run_hook.post_update(cfg=cfg, git_dir=admin_repository,
+                         updates=first['updates'])
+    eq(readFile(description), 'foo one\n')
+
+    # two pushes, regenerated for at once; only the second one
+    # changes the config
+    merged = spool.coalesce([
+            push([('README', 'hello\n')]),
+            push([('gitosis.conf', conf.replace('foo one', 'foo two'))]),
+            ])
+    run_hook.post_update(cfg=cfg, git_dir=admin_repository,
+                         updates=merged['updates'])
+    eq(readFile(description), 'foo two\n')
+    eq(readFile(os.path.join(admin_repository, 'gitosis.conf')),
+       conf.replace('foo one', 'foo two'))
+
+def test_post_update_grantRemoved():
+    tmp = maketemp()
+    repos = os.path.join(tmp, 'repositories')
+    os.mkdir(repos)
+    admin_repository = os.path.join(repos, 'gitosis-admin.git')
+    init.init_admin_repository(
+        git_dir=admin_repository,
+        pubkey='ssh-ed25519 '
+        +'AAAAC3NzaC1lZDI1NTE5AAAAID/EzP50WHDiwNmfcfMP8GVsje3UHMHX09N2sNvmheLz'
+        +' theadmin@host',
+        user='theadmin',
+        )
+    repository.init(path=os.path.join(repos, 'secret.git'))
+    conf = """\
+[gitosis]
+repositories = %s
+generate-files-in = %s
+ssh-authorized-keys-path = %s
+
+[group gitosis-admin]
+members = theadmin
+writable = gitosis-admin
+""" % (repos,
+       os.path.join(tmp, 'generated'),
+       os.path.join(tmp, 'authorized_keys'))
+    # the one post-update keeps using, like gitosis-run-hook does
+    cfg = RawConfigParser()
+
+    def push(data):
+        repository.fast_import(
+            git_dir=admin_repository,
+            committer='John Doe <jdoe@example.com>',
+            commit_msg='stuff\n',
+            parent='refs/heads/master^0',
+            files=[('gitosis.conf', data)],
+            )
+        run_hook.post_update(cfg=cfg, git_dir=admin_repository)
+        served = lazyconfig.LazyConfigParser()
+        f = file(os.path.join(admin_repository, 'gitosis.conf'))
+        try:
+            served.readfp(f)
+        finally:
+            f.close()
+        got = shard.read_shard(served, 'theadmin')
+        assert got is not None
+        return (served, got)
+
+    (served, got) = push(conf + """
+[group secret]
+members = theadmin
+writable = secret
+""")
+    serve.serve(cfg=served, user='theadmin',
+                command="git-receive-pack 'secret'", shard=got)
+
+    (served, got) = push(conf)
+    assert_raises(serve.AccessDenied, serve.serve, cfg=served,
+                  user='theadmin', command="git-receive-pack 'secret'",
+                  shard=got)
+
+def test_post_update_optionRemoved():
+    tmp = maketemp()
+    repos = os.path.join(tmp, 'repositories')
+    os.mkdir(repos)
+    admin_repository = os.path.join(repos, 'gitosis-admin.git')
+    init.init_admin_repository(
+        git_dir=admin_repository,
+        pubkey='ssh-ed25519 '
+        +'AAAAC3NzaC1lZDI1NTE5AAAAID/EzP50WHDiwNmfcfMP8GVsje3UHMHX09N2sNvmheLz'
+        +' theadmin@host',
+        user='theadmin',
+        )
+    repository.init(path=os.path.join(repos, 'foo.git'))
+    conf = """\
+[gitosis]
+repositories = %s
+generate-files-in = %s
+ssh-authorized-keys-path = %s
+
+[group gitosis-admin]
+members = theadmin
+writable = gitosis-admin
+
+[repo foo]
+""" % (repos,
+       os.path.join(tmp, 'generated'),
+       os.path.join(tmp, 'authorized_keys'))
+    export_ok = os.path.join(repos, 'foo.git', 'git-daemon-export-ok')
+    cfg = RawConfigParser()
+
+    def push(data):
+        repository.fast_import(
+            git_dir=admin_repository,
+            committer='John Doe <jdoe@example.com>',
+            commit_msg='stuff\n',
+            parent='refs/heads/master^0',
+            files=[('gitosis.conf', data)],
+            )
+        run_hook.post_update(cfg=cfg, git_dir=admin_repository)
+
+    push(conf + 'daemon = yes\n')
+    assert os.path.exists(export_ok)
+    push(conf)
+    assert not os.path.exists(export_ok)
+
+def _snapshot(top):
+    found = {}
+    for (dirpath, dirnames, filenames) in os.walk(top):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            found[path] = readFile(path)
+    return found
+
+def test_post_update_parallel():
+    tmp = maketemp()
+    repos = os.path.join(tmp, 'repositories')
+    os.mkdir(repos)
+    admin_repository = os.path.join(repos, 'gitosis-admin.git')
+    pubkey = (
+        'ssh-ed25519 '
+        +'AAAAC3NzaC1lZDI1NTE5AAAAIHaSw601QLuAPAILOu5mzYiHEjI06gxucUPArd'
+        +'c/9DHt theadmin@host.example.com')
+    init.init_admin_repository(
+        git_dir=admin_repository,
+        pubkey=pubkey,
+        user='theadmin',
+        )
+    conf = """\
+[defaults]
+daemon-if-all = yes
+
+[group gitosis-admin]
+members = theadmin
+writable = gitosis-admin
+
+[group everyone]
+members = @all
+readonly = pub0 pub1 pub2
+
+[group devs]
+members = jdoe wsmith
+writable = repo0 repo1 repo2 repo3 repo4
+
+[repo same]
+description = first
+
+[repo same.git]
+description = second
+"""
+    for i in range(20):
+        conf += """
+[repo repo%d]
+description = number %d
+gitweb = yes
+daemon = %s
+""" % (i, i, ['yes', 'no'][i % 2])
+    names = ['same', 'pub0', 'pub1', 'pub2'] + ['repo%d' % i
+                                                for i in range(20)]
+    for name in names:
+        repository.init(path=os.path.join(repos, '%s.git' % name))
+    repository.fast_import(
+        git_dir=admin_repository,
+        committer='John Doe <jdoe@example.com>',
+        commit_msg='stuff\n',
+        parent='refs/heads/master^0',
+        files=[('gitosis.conf', conf)],
+        )
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'repositories', repos)
+    cfg.set('gitosis', 'htaccess', 'yes')
+    generated = os.path.join(tmp, 'generated')
+    os.mkdir(generated)
+    cfg.set('gitosis', 'generate-files-in', generated)
+    ssh = os.path.join(tmp, 'ssh')
+    os.mkdir(ssh)
+    cfg.set(
+        'gitosis',
+        'ssh-authorized-keys-path',
+        os.path.join(ssh, 'authorized_keys'),
+        )
+
+    base = _snapshot(tmp)
+    run_hook.post_update(cfg=cfg, git_dir=admin_repository, full=True)
+    serial = _snapshot(tmp)
+    eq(serial[os.path.join(repos, 'same.git', 'description')], 'second\n')
+
+    for pool in ['thread', 'process']:
+        for path in serial:
+            if path not in base:
+                os.unlink(path)
+            elif serial[path] != base[path]:
+                writeFile(path, base[path])
+        eq(_snapshot(tmp), base)
+        cfg.set('gitosis', 'generate-workers', '4')
+        cfg.set('gitosis', 'generate-pool', pool)
+        run_hook.post_update(cfg=cfg, git_dir=admin_repository, full=True)
+        got = _snapshot(tmp)
+        eq(sorted(got), sorted(serial))
+        for path in serial:
+            if path.endswith('.index') and path.startswith(admin_repository):
+                # keyed by the inode of the rewritten gitosis.conf
+                continue
+            eq(got[path], serial[path], 'mismatch in %s with %s pool'
+               % (path, pool))
+
+def test_regenerate():
+    tmp = maketemp()
+    repos = os.path.join(tmp, 'repositories')
+    os.mkdir(repos)
+    admin_repository = os.path.join(repos, 'gitosis-admin.git')
+    init.init_admin_repository(
+        git_dir=admin_repository,
+        pubkey=('ssh-ed25519 '
+                +'AAAAC3NzaC1lZDI1NTE5AAAAIHaSw601QLuAPAILOu5mzYiHEjI06gxuc'
+                +'UPArdc/9DHt theadmin@host.example.com'),
+        user='theadmin',
+        )
+    repository.init(path=os.path.join(repos, 'foo.git'))
+    repository.fast_import(
+        git_dir=admin_repository,
+        committer='John Doe <jdoe@example.com>',
+        commit_msg='stuff\n',
+        parent='refs/heads/master^0',
+        files=[('gitosis.conf', """\
+[gitosis]
+repositories = %s
+generate-files-in = %s
+ssh-authorized-keys-path = %s
+
+[group gitosis-admin]
+members = theadmin
+writable = gitosis-admin
+
+[repo foo]
+description = foo one
+
+[repo bar.git]
+description = bar one
+
+[repo baz]
+daemon = yes
+""" % (repos, os.path.join(tmp, 'generated'),
+       os.path.join(tmp, 'authorized_keys')))],
+        )
+    # like ~/.gitosis.conf
+    config = os.path.join(tmp, 'gitosis.conf')
+    os.symlink(os.path.join(admin_repository, 'gitosis.conf'), config)
+
+    run_hook.regenerate(spool.makeRequest(
+            config=config,
+            git_dir=admin_repository,
+            ))
+    eq(readFile(os.path.join(repos, 'foo.git', 'description')), 'foo one\n')
+    assert os.path.exists(os.path.join(tmp, 'authorized_keys'))
+
+    # bar and baz were created by gitosis-serve since
+    repository.init(path=os.path.join(repos, 'bar.git'))
+    repository.init(path=os.path.join(repos, 'baz.git'))
+    run_hook.regenerate(spool.makeRequest(config=config,
+                                          repos=['bar', 'baz']))
+    eq(readFile(os.path.join(repos, 'bar.git', 'description')), 'bar one\n')
+    assert os.path.exists(
+        os.path.join(repos, 'baz.git', 'git-daemon-export-ok'))
+
+    # a push and a new repository merged into one request
+    repository.fast_import(
+        git_dir=admin_repository,
+        committer='John Doe <jdoe@example.com>',
+        commit_msg='stuff\n',
+        parent='refs/heads/master^0',
+        files=[('gitosis.conf', """\
+[gitosis]
+repositories = %s
+generate-files-in = %s
+ssh-authorized-keys-path = %s
+
+[group gitosis-admin]
+members = theadmin
+writable = gitosis-admin
+
+[repo foo]
+description = foo two
+""" % (repos, os.path.join(tmp, 'generated'),
+       os.path.join(tmp, 'authorized_keys')))],
+        )
+    run_hook.regenerate(spool.makeRequest(config=config,
+                                          git_dir=admin_repository,
+                                          repos=['foo']))
+    eq(readFile(os.path.join(repos, 'foo.git', 'description')), 'foo two\n')
@@ -3,9 +3,13 @@ from gitosis.test.util import assert_raises, readFile, check_mode
 
 import logging
 import os
+import subprocess
+import sys
+import time
 from cStringIO import StringIO
 from ConfigParser import RawConfigParser
 
+from gitosis import accesscache
 from gitosis import serve
 from gitosis import repository
 
@@ -668,3 +672,120 @@ def test_typo_writeable():
         "Repository 'foo' config has typo \"writeable\", shou"
         +"ld be \"writable\"\n",
         )
+
+def test_typo_writeable_cached():
+    tmp = util.maketemp()
+    repository.init(os.path.join(tmp, 'foo.git'))
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'repositories', tmp)
+    cfg.add_section('group foo')
+    cfg.set('group foo', 'members', 'jdoe')
+    cfg.set('group foo', 'writeable', 'foo')
+    cache = accesscache.DecisionCache(
+        os.path.join(tmp, 'access-cache'), 'fp')
+    log = logging.getLogger('gitosis.serve')
+    buf = StringIO()
+    handler = logging.StreamHandler(buf)
+    log.addHandler(handler)
+    try:
+        # the second one is a cache hit
+        for i in range(2):
+            got = serve.serve(
+                cfg=cfg,
+                user='jdoe',
+                command="git-receive-pack 'foo'",
+                cache=cache,
+                )
+    finally:
+        log.removeHandler(handler)
+    eq(got, "git-receive-pack '%s/foo.git'" % tmp)
+    eq(cache.lookup('jdoe', 'foo'), ('writeable', (tmp, 'foo')))
+    handler.flush()
+    eq(
+        buf.getvalue(),
+        2*("Repository 'foo' config has typo \"writeable\", shou"
+           +"ld be \"writable\"\n"),
+        )
+
+def test_import_is_lean():
+    # gitosis-serve runs for every fetch and push; the auto-init
+    # helpers and pkg_resources must not be loaded up front
+    child = subprocess.Popen(
+        args=[
+            sys.executable,
+            '-c',
+            'import sys, gitosis.serve; '
+            +'print " ".join(sorted(sys.modules))',
+            ],
+        cwd=os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__)))),
+        stdout=subprocess.PIPE,
+        close_fds=True,
+        )
+    got = child.stdout.read().split()
+    eq(child.wait(), 0)
+    for name in [
+        'pkg_resources',
+        'gitosis.repository',
+        'gitosis.gitweb',
+        'gitosis.gitdaemon',
+        'gitosis.htaccess',
+        ]:
+        assert name not in got, '%s imported by gitosis.serve' % name
+
+def test_shard():
+    tmp = util.maketemp()
+    repository.init(os.path.join(tmp, 'foo.git'))
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'repositories', tmp)
+    shard = RawConfigParser()
+    shard.add_section('gitosis')
+    shard.set('gitosis', 'repositories', tmp)
+    shard.add_section('group foo')
+    shard.set('group foo', 'members', 'jdoe')
+    shard.set('group foo', 'writable', 'foo')
+    got = serve.serve(
+        cfg=cfg,
+        user='jdoe',
+        command="git-receive-pack 'foo'",
+        shard=shard,
+        )
+    eq(got, "git-receive-pack '%s/foo.git'" % tmp)
+
+def test_push_inits_queues_regeneration():
+    tmp = util.maketemp()
+    repositories = os.path.join(tmp, 'repositories')
+    os.mkdir(repositories)
+    generated = os.path.join(tmp, 'generated')
+    os.mkdir(generated)
+    config = os.path.join(tmp, 'gitosis.conf')
+    util.writeFile(config, """\
+[gitosis]
+repositories = %s
+generate-files-in = %s
+
+[group foo]
+members = jdoe
+writable = foo
+
+[repo foo]
+description = foodesc
+""" % (repositories, generated))
+    cfg = RawConfigParser()
+    cfg.read(config)
+    serve.serve(
+        cfg=cfg,
+        user='jdoe',
+        command="git-receive-pack 'foo'",
+        spool_config=config,
+        )
+    eq(os.listdir(repositories), ['foo.git'])
+    path = os.path.join(repositories, 'foo.git', 'description')
+    for i in range(200):
+        if (os.path.exists(path)
+            and util.readFile(path) == 'foodesc\n'):
+            break
+        time.sleep(0.05)
+    eq(util.readFile(path), 'foodesc\n')
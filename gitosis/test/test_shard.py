@@ -0,0 +1,122 @@
+from nose.tools import eq_ as eq
+
+import os
+from ConfigParser import RawConfigParser
+from cStringIO import StringIO
+
+from gitosis import access
+from gitosis import lazyconfig
+from gitosis import shard
+from gitosis.test.util import maketemp, writeFile
+
+CONFIG = """\
+[gitosis]
+repositories = repos
+
+[group quux]
+members = jdoe wsmith @anothergroup
+writable = foo bar baz/thud squee-*
+readonly = xyzzy
+
+[group anothergroup]
+members = alice bill @third
+map writable visible = actual
+repositories = elsewhere
+
+[group third]
+members = carol
+readonly = third/*
+
+[group everyone]
+members = @all
+readonly = public
+
+[group all]
+writeable = scratch
+
+[user pat]
+writable = foo
+readonly = bar
+"""
+
+def _config():
+    cfg = RawConfigParser()
+    cfg.readfp(StringIO(CONFIG))
+    return cfg
+
+def test_compile_sameAnswers():
+    cfg = _config()
+    for user in ['jdoe', 'alice', 'carol', 'pat', 'nobody']:
+        s = shard.compile_shard(cfg, user, 'fp')
+        for mode in ['readonly', 'writable', 'writeable']:
+            for path in ['foo', 'bar', 'baz/thud', 'squee-1', 'xyzzy',
+                         'visible', 'third/x', 'public', 'scratch',
+                         'nonexistent']:
+                eq(access.haveAccess(s, user, mode, path),
+                   access.haveAccess(cfg, user, mode, path))
+
+def test_compile_contents():
+    cfg = _config()
+    s = shard.compile_shard(cfg, 'carol', 'fp')
+    eq(s.sections(), ['shard', 'gitosis', 'group quux',
+                      'group anothergroup', 'group third',
+                      'group everyone', 'group all'])
+    eq(s.get('shard', 'groups'),
+       'third anothergroup quux everyone all')
+    eq(s.get('group quux', 'members'), '@anothergroup')
+    eq(s.get('group anothergroup', 'repositories'), 'elsewhere')
+    assert not s.has_option('group all', 'members')
+
+def test_compile_alias():
+    cfg = _config()
+    cfg.add_section('alias docs')
+    cfg.set('alias docs', 'repos', 'manual')
+    cfg.set('user pat', 'readonly', 'bar @docs')
+    s = shard.compile_shard(cfg, 'pat', 'fp')
+    eq(s.get('alias docs', 'repos'), 'manual')
+    eq(access.haveAccess(s, 'pat', 'readonly', 'manual'),
+       ('repos', 'manual'))
+
+def test_compile_notMember():
+    cfg = _config()
+    s = shard.compile_shard(cfg, 'nobody', 'fp')
+    eq(s.sections(), ['shard', 'gitosis', 'group everyone', 'group all'])
+
+def test_write_and_read():
+    tmp = maketemp()
+    path = os.path.join(tmp, 'gitosis.conf')
+    writeFile(path, CONFIG.replace(
+        'repositories = repos\n',
+        'repositories = repos\ngenerate-files-in = %s\n' % tmp))
+    cfg = lazyconfig.LazyConfigParser()
+    f = file(path)
+    try:
+        cfg.readfp(f)
+    finally:
+        f.close()
+
+    shard.write_shards(cfg, ['jdoe', 'pat'], cfg.fingerprint)
+    eq(sorted(os.listdir(os.path.join(tmp, 'shards'))),
+       ['jdoe.conf', 'pat.conf'])
+    got = shard.read_shard(cfg, 'jdoe')
+    eq(access.haveAccess(got, 'jdoe', 'writable', 'foo'),
+       ('repos', 'foo'))
+    eq(shard.read_shard(cfg, 'alice'), None)
+
+    shard.write_shards(cfg, ['jdoe'], cfg.fingerprint)
+    eq(os.listdir(os.path.join(tmp, 'shards')), ['jdoe.conf'])
+
+def test_read_stale():
+    tmp = maketemp()
+    cfg = _config()
+    cfg.set('gitosis', 'generate-files-in', tmp)
+    shard.write_shards(cfg, ['jdoe'], 'old')
+    cfg.fingerprint = 'new'
+    eq(shard.read_shard(cfg, 'jdoe'), None)
+
+def test_read_noFingerprint():
+    tmp = maketemp()
+    cfg = _config()
+    cfg.set('gitosis', 'generate-files-in', tmp)
+    shard.write_shards(cfg, ['jdoe'], 'fp')
+    eq(shard.read_shard(cfg, 'jdoe'), None)
@@ -0,0 +1,88 @@
+from nose.tools import eq_ as eq
+
+import os
+from ConfigParser import RawConfigParser
+from cStringIO import StringIO
+
+from gitosis import snagit
+from gitosis.test.util import maketemp
+
+def _config():
+    tmp = maketemp()
+    for name in ['squee-1.git', 'squee-2.git', 'other.git']:
+        os.mkdir(os.path.join(tmp, name))
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'repositories', tmp)
+    cfg.add_section('alias docs')
+    cfg.set('alias docs', 'repos', 'manual website')
+    cfg.add_section('group fooers')
+    cfg.set('group fooers', 'members', 'jdoe')
+    cfg.set('group fooers', 'writable', 'foo squee-*')
+    cfg.set('group fooers', 'readonly', 'bar squee-1 @docs')
+    cfg.add_section('group typos')
+    cfg.set('group typos', 'members', '@fooers')
+    cfg.set('group typos', 'writeable', 'website')
+    cfg.set('group typos', 'map readonly visible', 'actual')
+    cfg.add_section('user jdoe')
+    cfg.set('user jdoe', 'readonly', 'mine')
+    return cfg
+
+def _split(found):
+    modes = {'writable': [], 'readonly': []}
+    for (mode, name) in found:
+        modes[mode].append(name)
+    return (sorted(modes['writable']), sorted(modes['readonly']))
+
+def test_user_repos():
+    eq(_split(snagit.user_repos(_config(), 'jdoe')),
+       (['foo', 'squee-1', 'squee-2', 'website'],
+        ['bar', 'manual', 'mine', 'visible']))
+
+def test_user_repos_writableFirst():
+    got = [mode for (mode, name) in snagit.user_repos(_config(), 'jdoe')]
+    eq(got, ['writable'] * 4 + ['readonly'] * 4)
+
+def test_user_repos_none():
+    eq(list(snagit.user_repos(_config(), 'nobody')), [])
+
+def test_user_repos_noPatterns():
+    cfg = _config()
+    cfg.set('group fooers', 'writable', 'foo')
+    # nothing to match, so the repositories are not even looked for
+    def walk_repos(config):
+        raise AssertionError('walked the repositories')
+        yield None
+    old = snagit.gitdaemon.walk_repos
+    snagit.gitdaemon.walk_repos = walk_repos
+    try:
+        got = _split(snagit.user_repos(cfg, 'jdoe'))
+    finally:
+        snagit.gitdaemon.walk_repos = old
+    eq(got, (['foo', 'website'],
+             ['bar', 'manual', 'mine', 'squee-1', 'visible']))
+
+def test_list_repos():
+    got = StringIO()
+    snagit.list_repos(_config(), 'jdoe', 'snagit list-repos', fp=got)
+    lines = got.getvalue().splitlines()
+    eq(sorted(lines[:4]), [
+            'foo, writable',
+            'squee-1, writable',
+            'squee-2, writable',
+            'website, writable',
+            ])
+    eq(sorted(lines[4:]), [
+            'bar, readonly',
+            'manual, readonly',
+            'mine, readonly',
+            'visible, readonly',
+            ])
+
+def test_list_repos_porcelain():
+    got = StringIO()
+    snagit.list_repos(_config(), 'jdoe', 'snagit list-repos --porcelain',
+                      fp=got)
+    eq(sorted(got.getvalue().splitlines()[:4]),
+       ['writable\tfoo', 'writable\tsquee-1', 'writable\tsquee-2',
+        'writable\twebsite'])
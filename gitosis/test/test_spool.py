@@ -0,0 +1,151 @@
+from nose.tools import eq_ as eq
+
+import fcntl
+import os
+import time
+from ConfigParser import RawConfigParser
+
+from gitosis import spool
+from gitosis.test.util import maketemp, readFile, writeFile, assert_raises
+
+def _wait_for(path):
+    for i in range(200):
+        if os.path.exists(path):
+            return
+        time.sleep(0.05)
+    raise AssertionError('%r did not appear' % path)
+
+def test_getSpoolDir():
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'generate-files-in', '/tmp/generated')
+    eq(spool.getSpoolDir(cfg), '/tmp/generated/spool')
+
+def test_enqueue():
+    tmp = maketemp()
+    spool_dir = os.path.join(tmp, 'spool')
+    eq(spool.pending(spool_dir), [])
+    first = spool.enqueue(spool_dir, spool.makeRequest(config='a'))
+    second = spool.enqueue(spool_dir, spool.makeRequest(config='b'))
+    writeFile(os.path.join(spool_dir, '.half-written.tmp'), 'junk')
+    eq(spool.pending(spool_dir), [first, second])
+
+def test_coalesce_repos():
+    got = spool.coalesce([
+            spool.makeRequest(config='old', repos=['foo']),
+            spool.makeRequest(config='new', repos=['bar', 'foo']),
+            ])
+    eq(got, spool.makeRequest(config='new', repos=['foo', 'bar']))
+
+def test_coalesce_updates():
+    got = spool.coalesce([
+            spool.makeRequest(config='c', git_dir='/admin.git',
+                              updates=[('a', 'b', 'refs/heads/master')]),
+            spool.makeRequest(config='c', repos=['foo']),
+            spool.makeRequest(config='c', git_dir='/admin.git', full=True,
+                              updates=[('b', 'c', 'refs/heads/master')]),
+            ])
+    eq(got, spool.makeRequest(
+            config='c',
+            git_dir='/admin.git',
+            full=True,
+            updates=[('a', 'b', 'refs/heads/master'),
+                     ('b', 'c', 'refs/heads/master')],
+            repos=['foo'],
+            ))
+
+def test_coalesce_updatesUnknown():
+    got = spool.coalesce([
+            spool.makeRequest(config='c', git_dir='/admin.git',
+                              updates=[('a', 'b', 'refs/heads/master')]),
+            spool.makeRequest(config='c', git_dir='/admin.git'),
+            spool.makeRequest(config='c', git_dir='/admin.git',
+                              updates=[('b', 'c', 'refs/heads/master')]),
+            ])
+    eq(got['updates'], None)
+
+def test_work():
+    tmp = maketemp()
+    for name in ['foo', 'bar']:
+        spool.enqueue(tmp, spool.makeRequest(config='c', repos=[name]))
+    got = []
+    eq(spool.work(tmp, got.append), True)
+    eq(got, [spool.makeRequest(config='c', repos=['foo', 'bar'])])
+    eq(spool.pending(tmp), [])
+
+def test_work_locked():
+    tmp = maketemp()
+    path = spool.enqueue(tmp, spool.makeRequest(config='c', repos=['foo']))
+    lock = file(os.path.join(tmp, 'lock'), 'a')
+    try:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        got = []
+        eq(spool.work(tmp, got.append), False)
+        eq(got, [])
+    finally:
+        lock.close()
+    eq(spool.pending(tmp), [path])
+
+def test_work_queuedMeanwhile():
+    tmp = maketemp()
+    spool.enqueue(tmp, spool.makeRequest(config='c', repos=['foo']))
+    got = []
+    def regenerate(request):
+        if not got:
+            spool.enqueue(tmp, spool.makeRequest(config='c', repos=['bar']))
+        got.append(request['repos'])
+    eq(spool.work(tmp, regenerate), True)
+    eq(got, [['foo'], ['bar']])
+
+def test_work_failing():
+    tmp = maketemp()
+    path = spool.enqueue(tmp, spool.makeRequest(config='c', repos=['foo']))
+    def regenerate(request):
+        raise RuntimeError('broken')
+    assert_raises(RuntimeError, spool.work, tmp, regenerate)
+    eq(spool.pending(tmp), [path])
+    # tried again with the next one
+    spool.enqueue(tmp, spool.makeRequest(config='c', repos=['bar']))
+    got = []
+    eq(spool.work(tmp, got.append), True)
+    eq(got, [spool.makeRequest(config='c', repos=['foo', 'bar'])])
+    eq(spool.pending(tmp), [])
+
+def test_work_unreadable():
+    tmp = maketemp()
+    path = spool.enqueue(tmp, spool.makeRequest(config='c', repos=['foo']))
+    writeFile(path, 'junk')
+    got = []
+    eq(spool.work(tmp, got.append), True)
+    eq(got, [])
+    eq(spool.pending(tmp), [])
+
+def _mark(request):
+    (path,) = request['repos']
+    writeFile(path, request['config'])
+
+def test_submit_wait():
+    tmp = maketemp()
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'generate-files-in', tmp)
+    mark = os.path.join(tmp, 'mark')
+    spool.submit(cfg, spool.makeRequest(config='c', repos=[mark]), _mark,
+                 wait=True)
+    eq(readFile(mark), 'c')
+    eq(spool.pending(spool.getSpoolDir(cfg)), [])
+
+def test_submit_background():
+    tmp = maketemp()
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'generate-files-in', tmp)
+    mark = os.path.join(tmp, 'mark')
+    spool.submit(cfg, spool.makeRequest(config='c', repos=[mark]), _mark)
+    _wait_for(mark)
+    eq(readFile(mark), 'c')
+    spool_dir = spool.getSpoolDir(cfg)
+    # once the worker is gone, the lock is free
+    spool.work(spool_dir, _mark, block=True)
+    eq(spool.pending(spool_dir), [])
+    assert os.path.exists(os.path.join(spool_dir, 'worker.log'))
@@ -3,6 +3,7 @@ from nose.tools import eq_ as eq, assert_raises
 import os
 from cStringIO import StringIO
 
+from gitosis import repository
 from gitosis import ssh
 from gitosis.test.util import mkdir, maketemp, writeFile, readFile
 
@@ -10,17 +11,13 @@ def _key(s):
     return ''.join(s.split('\n')).strip()
 
 KEY_1 = _key("""
-ssh-rsa +v5XLsUrLsHOKy7Stob1lHZM17YCCNXplcKfbpIztS2PujyixOaBev1ku6H6ny
-gUXfuYVzY+PmfTLviSwD3UETxEkR/jlBURACDQARJdUxpgt9XG2Lbs8bhOjonAPapxrH0o
-9O8R0Y6Pm1Vh+H2U0B4UBhPgEframpeJYedijBxBV5aq3yUvHkXpcjM/P0gsKqr036k= j
-unk@gunk
+ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAID/EzP50WHDiwNmfcfMP8GVsje3UHMHX09N2sNv
+mheLz junk@gunk
 """)
 
 KEY_2 = _key("""
-ssh-rsa 4BX2TxZoD3Og2zNjHwaMhVEa5/NLnPcw+Z02TDR0IGJrrqXk7YlfR3oz+Wb/Eb
-Ctli20SoWY0Ur8kBEF/xR4hRslZ2U8t0PAJhr8cq5mifhok/gAdckmSzjD67QJ68uZbga8
-ZwIAo7y/BU7cD3Y9UdVZykG34NiijHZLlCBo/TnobXjFIPXvFbfgQ3y8g+akwocFVcQ= f
-roop@snoop
+ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAIItbnbDBPbJCVsgpqjZKqQxtLroxi5IypKuTE7l
+U01Vf froop@snoop
 """)
 
 class ReadKeys_Test(object):
@@ -28,7 +25,7 @@ class ReadKeys_Test(object):
         tmp = maketemp()
         empty = os.path.join(tmp, 'empty')
         mkdir(empty)
-        gen = ssh.readKeys(keydir=empty)
+        gen = iter(ssh.readValidKeys(empty))
         assert_raises(StopIteration, gen.next)
 
     def test_ignore_dot(self):
@@ -36,7 +33,7 @@ class ReadKeys_Test(object):
         keydir = os.path.join(tmp, 'ignore_dot')
         mkdir(keydir)
         writeFile(os.path.join(keydir, '.jdoe.pub'), KEY_1+'\n')
-        gen = ssh.readKeys(keydir=keydir)
+        gen = iter(ssh.readValidKeys(keydir))
         assert_raises(StopIteration, gen.next)
 
     def test_ignore_nonpub(self):
@@ -44,7 +41,7 @@ class ReadKeys_Test(object):
         keydir = os.path.join(tmp, 'ignore_dot')
         mkdir(keydir)
         writeFile(os.path.join(keydir, 'jdoe.xub'), KEY_1+'\n')
-        gen = ssh.readKeys(keydir=keydir)
+        gen = iter(ssh.readValidKeys(keydir))
         assert_raises(StopIteration, gen.next)
 
     def test_one(self):
@@ -53,7 +50,7 @@ class ReadKeys_Test(object):
         mkdir(keydir)
         writeFile(os.path.join(keydir, 'jdoe.pub'), KEY_1+'\n')
 
-        gen = ssh.readKeys(keydir=keydir)
+        gen = iter(ssh.readValidKeys(keydir))
         eq(gen.next(), ('jdoe', KEY_1))
         assert_raises(StopIteration, gen.next)
 
@@ -64,7 +61,7 @@ class ReadKeys_Test(object):
         writeFile(os.path.join(keydir, 'jdoe.pub'), KEY_1+'\n')
         writeFile(os.path.join(keydir, 'wsmith.pub'), KEY_2+'\n')
 
-        gen = ssh.readKeys(keydir=keydir)
+        gen = iter(ssh.readValidKeys(keydir))
         got = frozenset(gen)
 
         eq(got,
@@ -79,7 +76,7 @@ class ReadKeys_Test(object):
         mkdir(keydir)
         writeFile(os.path.join(keydir, 'jd"oe.pub'), KEY_1+'\n')
 
-        gen = ssh.readKeys(keydir=keydir)
+        gen = iter(ssh.readValidKeys(keydir))
         got = frozenset(gen)
         eq(got, frozenset([]))
 
@@ -89,7 +86,7 @@ class ReadKeys_Test(object):
         mkdir(keydir)
         writeFile(os.path.join(keydir, 'jdoe.pub'), KEY_1+'\n'+KEY_2+'\n')
 
-        gen = ssh.readKeys(keydir=keydir)
+        gen = iter(ssh.readValidKeys(keydir))
         got = frozenset(gen)
 
         eq(got,
@@ -199,3 +196,160 @@ baz
 command="gitosis-serve jdoe",no-port-forwarding,\
 no-X11-forwarding,no-agent-forwarding,no-pty %(key_1)s
 ''' % dict(key_1=KEY_1))
+
+    def test_unchanged(self):
+        tmp = maketemp()
+        path = os.path.join(tmp, 'authorized_keys')
+        writeFile(path, '# foo\n')
+        keydir = os.path.join(tmp, 'one')
+        mkdir(keydir)
+        writeFile(os.path.join(keydir, 'jdoe.pub'), KEY_1+'\n')
+
+        eq(ssh.writeAuthorizedKeys(path=path, keydir=keydir), True)
+        before = os.stat(path).st_ino
+        eq(ssh.writeAuthorizedKeys(path=path, keydir=keydir), False)
+        eq(os.stat(path).st_ino, before)
+        assert readFile(path).startswith('# foo\n')
+
+    def test_manifest(self):
+        tmp = maketemp()
+        path = os.path.join(tmp, 'authorized_keys')
+        manifest = os.path.join(tmp, 'manifest')
+        keydir = os.path.join(tmp, 'one')
+        mkdir(keydir)
+        writeFile(os.path.join(keydir, 'jdoe.pub'), KEY_1+'\n')
+
+        eq(ssh.writeAuthorizedKeys(path=path, keydir=keydir,
+                                   manifest=manifest), True)
+        eq(ssh.writeAuthorizedKeys(path=path, keydir=keydir,
+                                   manifest=manifest), False)
+        writeFile(os.path.join(keydir, 'wsmith.pub'), KEY_2+'\n')
+        eq(ssh.writeAuthorizedKeys(path=path, keydir=keydir,
+                                   manifest=manifest), True)
+        got = readFile(path)
+        assert KEY_1 in got
+        assert KEY_2 in got
+
+
+    def test_duplicate(self):
+        tmp = maketemp()
+        path = os.path.join(tmp, 'authorized_keys')
+        keydir = os.path.join(tmp, 'one')
+        mkdir(keydir)
+        writeFile(os.path.join(keydir, 'jdoe.pub'), KEY_1+'\n')
+        writeFile(os.path.join(keydir, 'wsmith.pub'),
+                  KEY_1+'\n'+KEY_2+'\n')
+
+        ssh.writeAuthorizedKeys(path=path, keydir=keydir)
+
+        got = readFile(path)
+        eq(got, '''\
+### autogenerated by gitosis, DO NOT EDIT
+command="gitosis-serve jdoe",no-port-forwarding,\
+no-X11-forwarding,no-agent-forwarding,no-pty %(key_1)s
+command="gitosis-serve wsmith",no-port-forwarding,\
+no-X11-forwarding,no-agent-forwarding,no-pty %(key_2)s
+''' % dict(key_1=KEY_1, key_2=KEY_2))
+
+class ReadValidKeys_Test(object):
+    def test_simple(self):
+        tmp = maketemp()
+        keydir = os.path.join(tmp, 'keydir')
+        mkdir(keydir)
+        writeFile(os.path.join(keydir, 'jdoe.pub'),
+                  KEY_1+'\n\n'+KEY_2)
+        writeFile(os.path.join(keydir, 'wsmith.pub'), KEY_2+'\n')
+        writeFile(os.path.join(keydir, 'ignored.xub'), KEY_2+'\n')
+        manifest = os.path.join(tmp, 'manifest')
+        want = [
+            ('jdoe', KEY_1),
+            ('jdoe', KEY_2),
+            ('wsmith', KEY_2),
+            ]
+        eq(ssh.readValidKeys(keydir, manifest), want)
+        # again, from the manifest
+        eq(ssh.readValidKeys(keydir, manifest), want)
+
+    def test_cachedByStat(self):
+        tmp = maketemp()
+        keydir = os.path.join(tmp, 'keydir')
+        mkdir(keydir)
+        key = os.path.join(keydir, 'jdoe.pub')
+        writeFile(key, KEY_1+'\n')
+        os.utime(key, (1000, 1000))
+        manifest = os.path.join(tmp, 'manifest')
+        eq(ssh.readValidKeys(keydir, manifest), [('jdoe', KEY_1)])
+        # not read again while size and mtime match
+        writeFile(key, KEY_1.upper()+'\n')
+        os.utime(key, (1000, 1000))
+        eq(ssh.readValidKeys(keydir, manifest), [('jdoe', KEY_1)])
+
+    def test_changed(self):
+        tmp = maketemp()
+        keydir = os.path.join(tmp, 'keydir')
+        mkdir(keydir)
+        key = os.path.join(keydir, 'jdoe.pub')
+        writeFile(key, KEY_1+'\n')
+        manifest = os.path.join(tmp, 'manifest')
+        eq(ssh.readValidKeys(keydir, manifest), [('jdoe', KEY_1)])
+        writeFile(key, KEY_2+'\n')
+        os.utime(key, (0, 0))
+        eq(ssh.readValidKeys(keydir, manifest), [('jdoe', KEY_2)])
+
+    def test_badManifest(self):
+        tmp = maketemp()
+        keydir = os.path.join(tmp, 'keydir')
+        mkdir(keydir)
+        writeFile(os.path.join(keydir, 'jdoe.pub'), KEY_1+'\n')
+        manifest = os.path.join(tmp, 'manifest')
+        writeFile(manifest, 'junk')
+        eq(ssh.readValidKeys(keydir, manifest), [('jdoe', KEY_1)])
+
+    def test_rejected(self):
+        tmp = maketemp()
+        keydir = os.path.join(tmp, 'keydir')
+        mkdir(keydir)
+        writeFile(os.path.join(keydir, 'jdoe.pub'),
+                  'garbage\n'
+                  +'no-pty,command="sh" '+KEY_2+'\n'
+                  +KEY_1+'\n')
+        eq(ssh.readValidKeys(keydir), [('jdoe', KEY_1)])
+
+    def test_keyTree(self):
+        tmp = maketemp()
+        git_dir = os.path.join(tmp, 'repo.git')
+        repository.init(path=git_dir)
+        repository.fast_import(
+            git_dir=git_dir,
+            committer='John Doe <jdoe@example.com>',
+            commit_msg='Keys.',
+            files=[
+                ('keydir/jdoe.pub', KEY_1+'\n'),
+                ('keydir/wsmith.pub', KEY_2+'\n'),
+                ('keydir/.hidden.pub', KEY_2+'\n'),
+                ('keydir/README', 'junk\n'),
+                ],
+            )
+        manifest = os.path.join(tmp, 'manifest')
+        catfile = repository.CatFile(git_dir)
+        try:
+            keydir = ssh.KeyTree(catfile, 'HEAD:keydir')
+            eq(ssh.keyUsers(keydir), ['jdoe', 'wsmith'])
+            want = [('jdoe', KEY_1), ('wsmith', KEY_2)]
+            eq(ssh.readValidKeys(keydir, manifest), want)
+            # again, from the manifest
+            keydir.contents = None
+            eq(ssh.readValidKeys(keydir, manifest), want)
+        finally:
+            catfile.close()
+
+
+def test_uniqueKeys():
+    eq(ssh.uniqueKeys([
+                ('wsmith', KEY_1),
+                ('jdoe', KEY_2),
+                ('jdoe', KEY_1.replace('junk@gunk', 'other')),
+                ('wsmith', KEY_1),
+                ]),
+       ([('wsmith', KEY_1), ('jdoe', KEY_2)],
+        [(KEY_1.replace('junk@gunk', 'other'), 'wsmith', 'jdoe')]))
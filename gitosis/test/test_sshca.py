@@ -0,0 +1,108 @@
+from nose.tools import eq_ as eq
+
+import base64
+import os
+import struct
+from ConfigParser import RawConfigParser
+
+from gitosis import keycheck
+from gitosis import sshca
+from gitosis import ssh
+from gitosis.test import util
+from gitosis.test.util import maketemp, readFile
+
+def _string(s):
+    return struct.pack('>I', len(s)) + s
+
+CA_KEY = 'ssh-ed25519 %s ca@example.com' % base64.b64encode(
+    _string('ssh-ed25519') + _string('c' * 32))
+
+def _cert(principals, certtype='ssh-ed25519-cert-v01@openssh.com',
+          kind=sshca.USER_CERT, pubkey=None):
+    if pubkey is None:
+        pubkey = [_string('k' * 32)]
+    return ''.join(
+        [_string(certtype), _string('nonce')]
+        + pubkey
+        + [struct.pack('>QI', 42, kind),
+           _string('key id'),
+           _string(''.join([_string(p) for p in principals])),
+           struct.pack('>QQ', 0, 2**64 - 1),
+           _string(''), _string(''), _string(''),
+           _string(CA_KEY.split()[1].decode('base64')),
+           _string('signature'),
+           ])
+
+def test_certPrincipals():
+    eq(sshca.certPrincipals(_cert(['jdoe', 'john'])), ['jdoe', 'john'])
+
+def test_certPrincipals_none():
+    eq(sshca.certPrincipals(_cert([])), [])
+
+def test_certPrincipals_rsa():
+    got = sshca.certPrincipals(_cert(
+        ['jdoe'],
+        certtype='ssh-rsa-cert-v01@openssh.com',
+        pubkey=[_string('\x01\x00\x01'), _string('\xff' * 256)],
+        ))
+    eq(got, ['jdoe'])
+
+def test_certPrincipals_notCert():
+    e = util.assert_raises(keycheck.InvalidKeyError,
+                           sshca.certPrincipals,
+                           _string('ssh-ed25519') + _string('k' * 32))
+    eq(e.args[0], "not a certificate: 'ssh-ed25519'")
+
+def test_certPrincipals_hostCert():
+    e = util.assert_raises(keycheck.InvalidKeyError,
+                           sshca.certPrincipals, _cert(['jdoe'], kind=2))
+    eq(e.args[0], 'not a user certificate')
+
+def test_certPrincipals_truncated():
+    e = util.assert_raises(keycheck.InvalidKeyError,
+                           sshca.certPrincipals, _cert(['jdoe'])[:40])
+    eq(e.args[0], 'truncated certificate')
+
+def test_generateAuthorizedPrincipals():
+    eq(list(sshca.generateAuthorizedPrincipals(['jdoe', 'bad"user'])),
+       [ssh.TEMPLATE % dict(user='jdoe', key='jdoe')])
+
+def test_getCAKeys():
+    cfg = RawConfigParser()
+    eq(sshca.getCAKeys(cfg), [])
+    cfg.add_section('gitosis')
+    cfg.set('gitosis', 'ssh-ca-keys', '%s\njunk' % CA_KEY)
+    eq(sshca.getCAKeys(cfg), [CA_KEY])
+
+def test_knownUsers():
+    cfg = RawConfigParser()
+    cfg.add_section('group fooers')
+    cfg.set('group fooers', 'members', 'jdoe @others')
+    cfg.add_section('group others')
+    cfg.add_section('user wsmith')
+    eq(sshca.knownUsers(cfg, ['alice', 'jdoe']), ['alice', 'jdoe', 'wsmith'])
+
+def test_writeCAFiles():
+    tmp = maketemp()
+    cfg = RawConfigParser()
+    cfg.add_section('gitosis')
+    cfg.add_section('group fooers')
+    cfg.set('group fooers', 'members', 'jdoe')
+    sshca.writeCAFiles(cfg, tmp, ['wsmith'])
+    eq(os.listdir(tmp), [])
+
+    cfg.set('gitosis', 'ssh-ca-keys', CA_KEY)
+    sshca.writeCAFiles(cfg, tmp, ['wsmith'])
+    eq(readFile(os.path.join(tmp, 'ssh_ca_keys')), CA_KEY + '\n')
+    eq(readFile(os.path.join(tmp, 'authorized_principals')),
+       ''.join(['%s\n' % ssh.TEMPLATE % dict(user=user, key=user)
+                for user in ['jdoe', 'wsmith']]))
+
+def test_main_noConfig():
+    tmp = maketemp()
+    main = sshca.Main()
+    (options, args) = main.create_parser().parse_args(
+        ['--config', os.path.join(tmp, 'missing.conf')])
+    cfg = main.create_config(options)
+    main.read_config(options, cfg)
+    eq(cfg.sections(), [])
@@ -36,6 +36,13 @@ def getSSHAuthorizedKeysPath(config):
         path = os.path.expanduser('~/.ssh/authorized_keys')
     return path
 
+def getSSHKeyIndexPath(config):
+    try:
+        path = config.get('gitosis', 'ssh-key-index-path')
+    except (NoSectionError, NoOptionError):
+        path = os.path.join(getGeneratedFilesDir(config), 'keys.index')
+    return path
+
 
 def getConfigList(config, section, entry):
     try:
@@ -73,3 +80,14 @@ def getConfigDefaultBoolean(config, specificSection, entry, defaultValue, defaul
             return toBoolean(config, config.get(defaultSection, entry))
         except (NoSectionError, NoOptionError):
             return defaultValue
+
+def getConfigGeneration(config):
+    """
+    Get a number that changes whenever ``config`` does, for caches
+    kept per config object.
+
+    Only ``lazyconfig.LazyConfigParser`` counts its changes; for any
+    other config, returns ``None``, and a cache has to compare what it
+    was built from instead.
+    """
+    return getattr(config, 'generation', None)
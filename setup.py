@@ -45,6 +45,10 @@ arbitrary commands.
             'gitosis-serve = gitosis.serve:Main.run',
             'gitosis-run-hook = gitosis.run_hook:Main.run',
             'gitosis-init = gitosis.init:Main.run',
+            'gitosis-authd = gitosis.authd:Main.run',
+            'gitosis-access-query = gitosis.query:Main.run',
+            'gitosis-authorized-keys = gitosis.keyindex:Main.run',
+            'gitosis-authorized-principals = gitosis.sshca:Main.run',
             ],
         },
 